@@ -18,12 +18,16 @@ from node_operations.similarity_calculation import calculate_similarity_api
 
 from node_operations.data_import import dataset_api
 from node_operations.gradient_descent import gradient_api
+from node_operations.gradient_sessions import gradient_session_api
+from utils.compression import init_compression
 
 app = Flask(__name__)
 CORS(app)
+init_compression(app)
 
 app.register_blueprint(dataset_api)
 app.register_blueprint(gradient_api)
+app.register_blueprint(gradient_session_api)
 app.register_blueprint(eigen_api)
 app.register_blueprint(covariance_api)
 app.register_blueprint(code_api)
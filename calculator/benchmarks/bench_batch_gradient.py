@@ -0,0 +1,54 @@
+"""
+批量梯度下降基准：K组参数逐个调用 /api/gradient_descent vs 一次调用 /api/gradient_descent/batch
+
+    python -m benchmarks.bench_batch_gradient
+
+通过Flask测试客户端发送JSON请求，计时包括请求体的解析、P的归一化和响应的编码。
+每组参数只迭代少量次数，这时逐个调用的开销主要来自重复上传和准备 n×n 的P。
+"""
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from app import app
+
+
+def make_body(n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 10))
+    sq = np.einsum('ij,ij->i', X, X)
+    P = np.exp(-np.maximum(sq[:, None] + sq[None, :] - 2 * X @ X.T, 0) / 10)
+    np.fill_diagonal(P, 0)
+    return {'algorithm': 'tsne', 'node': {'id': 'benchmark', 'dataset': X[:, :2].tolist(),
+                                          'computed': {'high_similarity_matrix': P.tolist()}}}
+
+
+def main(sizes=(500, 1000), learning_rates=(50, 100, 200, 400), iterations=50):
+    client = app.test_client()
+    print(f"{'n':>6}  {'K':>3}  {'逐个调用':>9}  {'批量':>9}  {'加速比':>6}  {'最大差异':>9}")
+    for n in sizes:
+        body = make_body(n)
+        base = {'iterations': iterations, 'recording_interval': 10}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            single = [client.post('/api/gradient_descent', json={
+                **body, 'parameters': {**base, 'learning_rate': lr}}).get_json() for lr in learning_rates]
+            single_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            batch = client.post('/api/gradient_descent/batch', json={
+                **body, 'parameters': base,
+                'runs': [{'parameters': {'learning_rate': lr}} for lr in learning_rates]}).get_json()
+            batch_time = time.perf_counter() - start
+
+        diff = max(np.abs(np.array(run['embedding']) - np.array(ref['node']['dataset'])).max()
+                   for run, ref in zip(batch['runs'], single))
+        print(f"{n:6d}  {len(learning_rates):3d}  {single_time:8.2f}s  {batch_time:8.2f}s  "
+              f"{single_time / batch_time:5.1f}x  {diff:9.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+精确模式内存基准：融合内核 vs 按行分块
+
+    python -m benchmarks.bench_blocked_gradient
+
+P为每行k个近邻的稀疏矩阵，分块模式下保持稀疏。峰值内存由 tracemalloc 统计，
+包含工作区的创建（融合内核需要3个 n×n 缓冲区，只在放得下时运行）。
+"""
+import time
+import tracemalloc
+
+import numpy as np
+from scipy import sparse
+
+from node_operations.gradient_descent import create_exact_workspace, exact_iteration
+from utils.blockedGradient import plan_block_rows, normalize_sparse_p, create_blocked_workspace, blocked_iteration
+
+# 融合内核的点数上限
+FUSED_MAX_N = 5000
+
+
+def make_problem(n, k=30, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n), k)
+    cols = rng.integers(0, n, size=n * k)
+    P = sparse.csr_matrix((rng.random(n * k), (rows, cols)), shape=(n, n))
+    return P + P.T, rng.normal(scale=5.0, size=(n, 2))
+
+
+def measure(func):
+    """返回 (耗时, 峰值内存字节数, 结果)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def fused(P, Y):
+    P = P.toarray()
+    P = np.maximum(P, 1e-12)
+    P /= P.sum()
+    return exact_iteration('tsne', P, Y, create_exact_workspace(P, Y.shape[1]))
+
+
+def blocked(P, Y, memory_budget_mb):
+    P, p_fill = normalize_sparse_p(P)
+    block_rows = plan_block_rows(Y.shape[0], memory_budget_mb)
+    return blocked_iteration('tsne', P, Y, create_blocked_workspace(P, Y.shape[1], block_rows, p_fill))
+
+
+def main(sizes=(2000, 5000, 10000, 20000), memory_budget_mb=256):
+    print(f"内存预算 {memory_budget_mb} MB")
+    print(f"{'n':>6}  {'融合':>9}  {'融合峰值':>9}  {'分块':>9}  {'分块峰值':>9}  {'梯度误差':>8}")
+    for n in sizes:
+        P, Y = make_problem(n)
+        blocked_time, blocked_peak, (blocked_grad, blocked_cost) = measure(lambda: blocked(P, Y, memory_budget_mb))
+
+        if n <= FUSED_MAX_N:
+            fused_time, fused_peak, (fused_grad, fused_cost) = measure(lambda: fused(P, Y))
+            assert np.isclose(blocked_cost, fused_cost, rtol=1e-10)
+            error = np.abs(blocked_grad - fused_grad).max() / np.abs(fused_grad).max()
+            fused_cells = f"{fused_time * 1000:7.0f}ms  {fused_peak / 2 ** 20:7.0f}MB"
+            error_cell = f"{error:8.1e}"
+        else:
+            fused_cells, error_cell = f"{'-':>9}  {'-':>9}", f"{'-':>8}"
+
+        print(f"{n:6d}  {fused_cells}  {blocked_time * 1000:7.0f}ms  {blocked_peak / 2 ** 20:7.0f}MB  {error_cell}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+精确模式单次迭代基准：分步计算（Q、梯度、KL散度各自重建距离矩阵）vs 融合内核
+
+    python -m benchmarks.bench_exact_kernel
+
+峰值内存由 tracemalloc 统计（numpy 的数组分配会计入）。融合内核的缓冲区在整个优化过程中只创建一次，
+单独列出，不计入单次迭代的峰值。
+"""
+import time
+import tracemalloc
+
+import numpy as np
+
+from node_operations.gradient_descent import (
+    compute_low_dimensional_similarity_tsne, compute_gradient_tsne, calculate_cost_tsne,
+    compute_low_dimensional_similarity_sne, compute_gradient_sne, calculate_cost_sne,
+    create_exact_workspace, exact_iteration
+)
+
+STEPS = {
+    'tsne': (compute_low_dimensional_similarity_tsne, compute_gradient_tsne, calculate_cost_tsne),
+    'sne': (compute_low_dimensional_similarity_sne, compute_gradient_sne, calculate_cost_sne),
+}
+
+
+def make_problem(n, seed=0):
+    rng = np.random.default_rng(seed)
+    P = rng.random((n, n))
+    P = P + P.T
+    np.fill_diagonal(P, 0.0)
+    P = np.maximum(P, 1e-12)
+    return P / P.sum(), rng.normal(scale=5.0, size=(n, 2))
+
+
+def stepwise_iteration(algorithm, P, Y):
+    compute_low_similarity, compute_gradient, calculate_cost = STEPS[algorithm]
+    Q = compute_low_similarity(Y)
+    return compute_gradient(P, Q, Y), calculate_cost(P, Q)
+
+
+def measure(func, repeat=3):
+    """返回 (最短耗时, 峰值新增内存字节数, 结果)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def main(sizes=(500, 1000, 2000, 4000)):
+    print(f"{'算法':>4}  {'n':>5}  {'分步':>9}  {'融合':>9}  {'加速':>6}  {'分步峰值':>9}  {'融合峰值':>9}  {'缓冲区':>8}  {'梯度误差':>8}")
+    for algorithm in ('tsne', 'sne'):
+        for n in sizes:
+            P, Y = make_problem(n)
+            workspace = create_exact_workspace(P, Y.shape[1])
+            # P_floor 可能直接引用P，不重复计入
+            buffer_bytes = sum(v.nbytes for v in workspace.values() if isinstance(v, np.ndarray) and v is not P)
+
+            old_time, old_peak, (old_grad, old_cost) = measure(lambda: stepwise_iteration(algorithm, P, Y))
+            new_time, new_peak, (new_grad, new_cost) = measure(
+                lambda: exact_iteration(algorithm, P, Y, workspace))
+
+            assert np.isclose(new_cost, old_cost, rtol=1e-10)
+            error = np.abs(new_grad - old_grad).max() / np.abs(old_grad).max()
+            print(f"{algorithm:>4}  {n:5d}  {old_time * 1000:7.1f}ms  {new_time * 1000:7.1f}ms  "
+                  f"{old_time / new_time:5.1f}x  {old_peak / 2 ** 20:7.1f}MB  {new_peak / 2 ** 20:7.1f}MB  {buffer_bytes / 2 ** 20:6.1f}MB  {error:8.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+响应序列化微基准：2000x2000 矩阵
+
+    python -m benchmarks.bench_json_serializer
+"""
+import json
+import time
+
+import numpy as np
+
+from utils.jsonProcess import dumps_json
+
+
+def legacy_dumps(data):
+    """旧实现：先 .tolist() 转成Python列表，再由json模块编码"""
+    return json.dumps(data.tolist(), separators=(',', ':')).encode('utf-8')
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(n=2000):
+    matrix = np.random.default_rng(0).random((n, n))
+
+    legacy_time, legacy_body = best_of(lambda: legacy_dumps(matrix))
+    fast_time, fast_body = best_of(lambda: dumps_json(matrix))
+    float32_time, float32_body = best_of(lambda: dumps_json(matrix, precision='float32'))
+
+    assert np.array_equal(np.array(json.loads(fast_body)), matrix)
+
+    print(f"矩阵 {n}x{n}")
+    print(f"tolist + json.dumps : {legacy_time * 1000:8.1f} ms  {len(legacy_body) / 1e6:6.1f} MB")
+    print(f"dumps_json          : {fast_time * 1000:8.1f} ms  {len(fast_body) / 1e6:6.1f} MB  加速 {legacy_time / fast_time:.1f}x")
+    print(f"dumps_json(float32) : {float32_time * 1000:8.1f} ms  {len(float32_body) / 1e6:6.1f} MB  加速 {legacy_time / float32_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
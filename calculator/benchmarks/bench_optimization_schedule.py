@@ -0,0 +1,52 @@
+"""
+优化策略基准：固定动量和学习率 vs 标准策略（早期夸大、动量切换、自适应步长、提前停止）
+
+    python -m benchmarks.bench_optimization_schedule
+
+数据为sklearn的手写数字，P按困惑度30校准。两种策略使用相同的初始嵌入、学习率和迭代上限，
+报告实际迭代次数、耗时和最终的KL散度。
+"""
+import contextlib
+import io
+import time
+
+import numpy as np
+from scipy.spatial.distance import squareform
+from sklearn.datasets import load_digits
+from sklearn.manifold._t_sne import _joint_probabilities
+from sklearn.metrics import pairwise_distances
+
+from node_operations.gradient_descent import run_gradient_descent
+
+
+def make_node(n, seed=0):
+    X, _ = load_digits(return_X_y=True)
+    X = X[:n]
+    P = squareform(_joint_probabilities(pairwise_distances(X, squared=True), 30, 0))
+    Y = np.random.default_rng(seed).normal(scale=1e-4, size=(X.shape[0], 2))
+    return {'id': 'benchmark', 'dataset': Y, 'computed': {'high_similarity_matrix': P}}
+
+
+def run(node, parameters):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_gradient_descent('tsne', parameters, dict(node))
+    return time.perf_counter() - start, result['node']['computed']
+
+
+def main(sizes=(1000, 1797), iterations=1000):
+    print(f"{'n':>6}  {'近似':>10}  {'策略':>8}  {'迭代':>5}  {'耗时':>7}  {'KL':>7}  停止原因")
+    for n in sizes:
+        node = make_node(n)
+        for approximation in ('exact', 'barnes_hut'):
+            for schedule in ('fixed', 'standard'):
+                elapsed, computed = run(node, {
+                    'iterations': iterations, 'learning_rate': 200, 'recording_interval': 50,
+                    'approximation': approximation, 'schedule': schedule
+                })
+                print(f"{n:6d}  {approximation:>10}  {schedule:>8}  {computed['iterations_run']:5d}  "
+                      f"{elapsed:6.1f}s  {computed['final_cost']:7.4f}  {computed['stop_reason'] or '-'}")
+
+
+if __name__ == '__main__':
+    main()
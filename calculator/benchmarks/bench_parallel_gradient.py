@@ -0,0 +1,100 @@
+"""
+梯度计算的多线程扩展性基准
+
+    python -m benchmarks.bench_parallel_gradient [最大线程数]
+
+对融合内核、分块内核（单次迭代）和UMAP全梯度（包括缓冲区的创建），分别用 1、2、4 … 个线程计时
+（不超过最大线程数，默认为CPU核数），报告相对单线程的加速比和与单线程结果的最大差异。
+线程数超过CPU核数时不会再有加速。
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+from node_operations.gradient_descent import create_exact_workspace, exact_iteration, umap_gradient_descent
+from utils.blockedGradient import plan_block_rows, normalize_sparse_p, create_blocked_workspace, blocked_iteration
+
+
+def make_problem(n, k=30, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n), k)
+    cols = rng.integers(0, n, size=n * k)
+    P = sparse.csr_matrix((rng.random(n * k), (rows, cols)), shape=(n, n))
+    return P + P.T, rng.normal(scale=5.0, size=(n, 2))
+
+
+def fused_case(n=3000):
+    P, Y = make_problem(n)
+    P = np.maximum(P.toarray(), 1e-12)
+    P /= P.sum()
+
+    workspace = create_exact_workspace(P, Y.shape[1])
+
+    def run(n_jobs):
+        # 融合内核的各线程共用同一组缓冲区
+        workspace['n_jobs'] = n_jobs
+        return exact_iteration('tsne', P, Y, workspace)[0].copy()
+    return run
+
+
+def blocked_case(n=8000, memory_budget_mb=256):
+    P, Y = make_problem(n)
+    P, p_fill = normalize_sparse_p(P)
+
+    workspaces = {}
+
+    def run(n_jobs):
+        # 工作区只在第一次使用时创建，不计入之后的计时
+        if n_jobs not in workspaces:
+            block_rows = plan_block_rows(n, memory_budget_mb, n_jobs)
+            workspaces[n_jobs] = create_blocked_workspace(P, Y.shape[1], block_rows, p_fill, n_jobs)
+        return blocked_iteration('tsne', P, Y, workspaces[n_jobs])[0].copy()
+    return run
+
+
+def umap_case(n=2000, iterations=5):
+    P, Y = make_problem(n)
+    V = (P / P.max()).toarray()
+
+    def run(n_jobs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return umap_gradient_descent(V, Y, learning_rate=0.05, iterations=iterations,
+                                         recording_interval=iterations, n_jobs=n_jobs)[0]
+    return run
+
+
+def timed(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(max_jobs=None):
+    max_jobs = max_jobs or os.cpu_count() or 1
+    job_counts = [1]
+    while job_counts[-1] * 2 <= max_jobs:
+        job_counts.append(job_counts[-1] * 2)
+    if job_counts[-1] != max_jobs:
+        job_counts.append(max_jobs)
+
+    print(f"CPU核数 {os.cpu_count()}")
+    for name, case in (('融合 t-SNE n=3000', fused_case()), ('分块 t-SNE n=8000', blocked_case()),
+                       ('UMAP全梯度 n=2000', umap_case())):
+        print(name)
+        base_time, base = timed(lambda: case(1))
+        for n_jobs in job_counts:
+            elapsed, result = (base_time, base) if n_jobs == 1 else timed(lambda: case(n_jobs))
+            print(f"  {n_jobs:3d} 线程  {elapsed * 1000:8.0f}ms  加速 {base_time / elapsed:5.2f}x  "
+                  f"差异 {np.abs(result - base).max():.1e}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
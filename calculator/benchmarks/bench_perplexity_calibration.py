@@ -0,0 +1,49 @@
+"""
+困惑度校准基准：按块向量化的二分搜索 vs scikit-learn 的逐行Cython实现
+
+    python -m benchmarks.bench_perplexity_calibration
+
+两者都以自然对数的熵、相同的容差校准 beta，报告耗时、与sklearn结果的最大差异和实际困惑度的最大误差。
+"""
+import time
+
+import numpy as np
+from sklearn.datasets import load_digits
+from sklearn.manifold._utils import _binary_search_perplexity
+from sklearn.metrics.pairwise import euclidean_distances
+
+from node_operations.similarity_calculation import gaussian_conditional_probabilities
+
+
+def make_data(n, seed=0):
+    X, _ = load_digits(return_X_y=True)
+    if n <= X.shape[0]:
+        return X[:n]
+    rng = np.random.default_rng(seed)
+    return X[rng.integers(0, X.shape[0], n)] + rng.normal(scale=0.5, size=(n, X.shape[1]))
+
+
+def perplexity_error(P, perplexity):
+    logs = np.log(np.where(P > 0, P, 1.0))
+    return np.abs(np.exp(-np.sum(P * logs, axis=1)) - perplexity).max()
+
+
+def main(sizes=(1000, 1797, 5000), perplexity=30):
+    print(f"{'n':>6}  {'sklearn':>8}  {'分块向量化':>8}  {'加速比':>6}  {'最大差异':>9}  {'困惑度误差':>9}")
+    for n in sizes:
+        X = make_data(n)
+
+        start = time.perf_counter()
+        reference = _binary_search_perplexity(euclidean_distances(X, squared=True).astype(np.float32), perplexity, 0)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        P, _ = gaussian_conditional_probabilities(X, perplexity)
+        elapsed = time.perf_counter() - start
+
+        print(f"{n:6d}  {reference_time:7.2f}s  {elapsed:9.2f}s  {reference_time / elapsed:5.1f}x  "
+              f"{np.abs(P - reference).max():9.1e}  {perplexity_error(P, perplexity):9.1e}")
+
+
+if __name__ == '__main__':
+    main()
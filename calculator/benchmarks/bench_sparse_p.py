@@ -0,0 +1,57 @@
+"""
+稀疏P基准：稠密的对称SNE相似度 vs 只在 3·perplexity 个近邻上计算的CSR
+
+    python -m benchmarks.bench_sparse_p
+
+数据为带噪声的手写数字（超过1797个样本时重复采样）。报告计算耗时、tracemalloc统计的峰值内存、
+非零元素数，以及稠密P在稀疏P的非零位置上的质量（即稀疏模式保留的概率质量）。
+稠密模式只在 dense_max 以内的规模上运行。
+
+样本数达到 EXACT_KNN_MAX_SAMPLES 时近邻由NN-descent查找，进程中第一次调用要先由numba编译（单核上约一分钟），
+计时前先预热一次。NN-descent内部的候选更新缓冲区大小固定（约1GB），峰值内存中的这一部分与样本数无关。
+"""
+import contextlib
+import io
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.datasets import load_digits
+
+from node_operations.similarity_calculation import EXACT_KNN_MAX_SAMPLES, compute_high_dimensional_similarity
+
+
+def make_data(n, seed=0):
+    X, _ = load_digits(return_X_y=True)
+    rng = np.random.default_rng(seed)
+    return X[rng.integers(0, X.shape[0], n)] + rng.normal(scale=0.5, size=(n, X.shape[1]))
+
+
+def measure(X, sparse_mode):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        P = compute_high_dimensional_similarity(X, 'symmetric_sne', {'perplexity': 30, 'sparse': sparse_mode})
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return P, elapsed, peak
+
+
+def main(sizes=(2000, 5000, 20000), dense_max=5000):
+    measure(make_data(EXACT_KNN_MAX_SAMPLES, seed=1), True)
+    print(f"{'n':>6}  {'模式':>6}  {'耗时':>7}  {'峰值内存':>9}  {'非零元素':>10}  {'保留质量':>8}")
+    for n in sizes:
+        X = make_data(n)
+        P_sparse, elapsed, peak = measure(X, True)
+        mass = '-'
+        if n <= dense_max:
+            P_dense, dense_elapsed, dense_peak = measure(X, False)
+            print(f"{n:6d}  {'dense':>6}  {dense_elapsed:6.2f}s  {dense_peak / 2 ** 20:7.1f}MB  {n * n:10d}  {1.0:8.4f}")
+            coo = P_sparse.tocoo()
+            mass = f"{P_dense[coo.row, coo.col].sum():8.4f}"
+        print(f"{n:6d}  {'sparse':>6}  {elapsed:6.2f}s  {peak / 2 ** 20:7.1f}MB  {P_sparse.nnz:10d}  {mass:>8}")
+
+
+if __name__ == '__main__':
+    main()
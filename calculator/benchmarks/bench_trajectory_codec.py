@@ -0,0 +1,70 @@
+"""
+迭代轨迹编码的体积基准：完整记录 vs 关键帧+差分
+
+    python -m benchmarks.bench_trajectory_codec
+
+用FFT近似的t-SNE对2000个点迭代1000次、每10次记录一次，比较 iterations 部分的JSON体积、
+gzip后的体积和二进制（.npy）传输的字节数，并给出重放误差（相对于该帧坐标最大绝对值）。
+"""
+import contextlib
+import gzip
+import io
+
+import numpy as np
+from sklearn.datasets import make_blobs
+from sklearn.metrics import pairwise_distances
+
+from node_operations.gradient_descent import run_gradient_descent
+from utils.arrayTransport import extract_arrays
+from utils.jsonProcess import dumps_json
+from utils.trajectoryCodec import encode_trajectory, decode_trajectory
+
+
+def make_trajectory(n=2000, iterations=1000, recording_interval=10, seed=0):
+    X, _ = make_blobs(n_samples=n, n_features=10, centers=8, random_state=seed)
+    P = np.exp(-pairwise_distances(X, squared=True) / 20.0)
+    np.fill_diagonal(P, 0.0)
+    rng = np.random.default_rng(seed)
+    node = {'id': 'bench', 'dataset': rng.normal(scale=1e-4, size=(n, 2)),
+            'computed': {'high_similarity_matrix': P}}
+    parameters = {'iterations': iterations, 'recording_interval': recording_interval,
+                  'learning_rate': 200, 'approximation': 'fft'}
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_gradient_descent('tsne', parameters, node)
+    return result['iterations']
+
+
+def sizes(payload):
+    """(JSON字节数, gzip后的字节数, 二进制传输的字节数)"""
+    body = dumps_json(payload)
+    meta, arrays = extract_arrays(payload)
+    binary = len(dumps_json(meta)) + sum(np.asarray(array).nbytes for _, array in arrays)
+    return len(body), len(gzip.compress(body, 6)), binary
+
+
+def max_error(records, replayed):
+    return max(np.abs(np.asarray(b['embedding']) - a['embedding']).max() / np.abs(a['embedding']).max()
+               for a, b in zip(records, replayed))
+
+
+def main():
+    records = make_trajectory()
+    n, d = records[0]['embedding'].shape
+    print(f"{len(records)} 条记录，每条 {n}×{d}")
+
+    raw = sizes({'iterations': records})
+    print(f"{'编码':>18}  {'JSON':>9}  {'gzip':>9}  {'二进制':>9}  {'最大相对误差':>10}")
+    print(f"{'完整记录':>18}  {raw[0] / 2 ** 20:7.2f}MB  {raw[1] / 2 ** 20:7.2f}MB  {raw[2] / 2 ** 20:7.2f}MB  {0:10.1e}")
+
+    for tolerance in (1e-3, 1e-4, 1e-5):
+        encoded = encode_trajectory(records, tolerance)
+        size = sizes({'iterations': encoded})
+        error = max_error(records, decode_trajectory(encoded))
+        assert error <= tolerance / 2 * (1 + 1e-6) + 1e-7
+        label = f"tolerance={tolerance:g}"
+        print(f"{label:>18}  {size[0] / 2 ** 20:7.2f}MB  {size[1] / 2 ** 20:7.2f}MB  {size[2] / 2 ** 20:7.2f}MB  "
+              f"{error:10.1e}   (JSON {raw[0] / size[0]:.1f}x, gzip {raw[1] / size[1]:.1f}x, 二进制 {raw[2] / size[2]:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
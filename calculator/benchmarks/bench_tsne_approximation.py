@@ -0,0 +1,69 @@
+"""
+t-SNE单次梯度计算基准：精确 vs Barnes-Hut vs FFT插值
+
+    python -m benchmarks.bench_tsne_approximation
+
+嵌入取若干个高斯簇（与t-SNE中后期的嵌入形态相近），P为每行k个近邻的稀疏矩阵。
+精确模式需要多个 n×n 矩阵，只在较小的n上运行。
+"""
+import time
+
+import numpy as np
+from scipy import sparse
+
+from node_operations.gradient_descent import compute_gradient_tsne, compute_low_dimensional_similarity_tsne
+from utils.tsneApproximation import to_sparse_p, barnes_hut_gradient, fft_gradient
+
+# 精确模式的点数上限
+EXACT_MAX_N = 5000
+
+
+def make_problem(n, k=30, n_clusters=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-30, 30, size=(n_clusters, 2))
+    labels = rng.integers(0, n_clusters, size=n)
+    Y = centers[labels] + rng.normal(scale=3.0, size=(n, 2))
+
+    rows = np.repeat(np.arange(n), k)
+    cols = rng.integers(0, n, size=n * k)
+    P = to_sparse_p(sparse.csr_matrix((rng.random(n * k), (rows, cols)), shape=(n, n)))
+    return P, Y
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def exact_gradient(P_dense, Y):
+    Q = compute_low_dimensional_similarity_tsne(Y)
+    return compute_gradient_tsne(P_dense, Q, Y)
+
+
+def main(sizes=(1000, 2500, 5000, 20000, 100000)):
+    print(f"{'n':>7}  {'精确':>9}  {'Barnes-Hut':>10}  {'FFT':>9}  {'BH误差':>8}  {'FFT误差':>8}")
+    for n in sizes:
+        P, Y = make_problem(n)
+
+        bh_time, (bh_grad, _) = best_of(lambda: barnes_hut_gradient(P, Y, theta=0.5))
+        fft_time, (fft_grad, _) = best_of(lambda: fft_gradient(P, Y))
+
+        if n <= EXACT_MAX_N:
+            P_dense = P.toarray().astype(np.float64)
+            exact_time, exact_grad = best_of(lambda: exact_gradient(P_dense, Y), repeat=1)
+            norm = np.linalg.norm(exact_grad)
+            bh_error = f"{np.linalg.norm(bh_grad - exact_grad) / norm:8.1e}"
+            fft_error = f"{np.linalg.norm(fft_grad - exact_grad) / norm:8.1e}"
+            exact_cell = f"{exact_time * 1000:7.0f}ms"
+        else:
+            exact_cell, bh_error, fft_error = f"{'-':>9}", f"{'-':>8}", f"{'-':>8}"
+
+        print(f"{n:7d}  {exact_cell}  {bh_time * 1000:8.0f}ms  {fft_time * 1000:7.0f}ms  {bh_error}  {fft_error}")
+
+
+if __name__ == '__main__':
+    main()
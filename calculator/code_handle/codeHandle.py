@@ -1,4 +1,4 @@
-from flask import request, jsonify, Blueprint
+from flask import request, Blueprint
 import io
 import traceback
 import contextlib
@@ -17,6 +17,8 @@ import pandas as pd
 import scipy
 import json
 
+from utils.jsonProcess import json_response
+
 code_api = Blueprint('code_api', __name__)
 
 class PlotCapture:
@@ -96,22 +98,22 @@ def run_code():
                 if plot_capture.figures:
                     output += '\n\n' + '\n'.join(plot_capture.figures)
 
-                return jsonify({
+                return json_response({
                     'output': output or '代码执行成功，但没有输出。',
                     'error': False
                 })
 
             except Exception as e:
                 error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
-                return jsonify({
+                return json_response({
                     'output': error_msg,
                     'error': True
                 })
 
     except Exception as e:
-        return jsonify({
+        return json_response({
             'output': f"服务器错误: {str(e)}",
             'error': True
-        }), 500
+        }, 500)
 
 
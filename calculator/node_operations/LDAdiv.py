@@ -8,6 +8,9 @@ from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from scipy import linalg
 import json
 
+from utils.arrayStore import resolve_array, has_array
+from utils.arrayTransport import get_request_data, respond, RequestFormatError
+
 """
 LDA矩阵计算器 - Flask后端
 提供计算类内散度矩阵和类间散度矩阵的API
@@ -55,7 +58,7 @@ def calculate_within_class_scatter(X, y, regularization=0.0):
     # 计算矩阵统计信息
     stats = calculate_matrix_stats(S_w)
 
-    return S_w.tolist(), stats
+    return S_w, stats
 
 
 def calculate_between_class_scatter(X, y, weight_type='proportional'):
@@ -105,7 +108,7 @@ def calculate_between_class_scatter(X, y, weight_type='proportional'):
     # 计算矩阵统计信息
     stats = calculate_matrix_stats(S_b)
 
-    return S_b.tolist(), stats
+    return S_b, stats
 
 
 def calculate_matrix_stats(matrix):
@@ -150,18 +153,18 @@ def calculate_lda_matrix():
     """
     try:
         # 解析请求数据
-        request_data = request.get_json()
+        request_data = get_request_data({'nodeData.dataset': 'matrix'})
 
         node_data = request_data.get('nodeData')
         matrix_type = request_data.get('matrixType')
         parameters = request_data.get('parameters')
 
         # 验证数据
-        if not node_data or not node_data.get('dataset') or not node_data.get('target'):
-            return jsonify({"error": "数据不足"}), 400
+        if not node_data or not has_array(node_data, 'dataset') or not node_data.get('target'):
+            return respond({"error": "数据不足"}, 400)
 
         # 提取特征和标签
-        dataset = np.array(node_data.get('dataset'))
+        dataset = np.asarray(resolve_array(node_data, 'dataset'))
         target = np.array(node_data.get('target'))
 
         # 根据矩阵类型进行计算
@@ -195,8 +198,11 @@ def calculate_lda_matrix():
         new_node["computed"][stats_key] = stats
         new_node["children"] = []
 
-        return jsonify(new_node)
+        return respond(new_node)
+
+    except RequestFormatError as e:
+        return respond({"error": str(e)}, 400)
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return respond({"error": str(e)}, 500)
 
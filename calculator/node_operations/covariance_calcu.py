@@ -6,6 +6,9 @@ import numpy as np
 import pandas as pd
 from uuid import uuid4
 
+from utils.arrayStore import resolve_array
+from utils.arrayTransport import get_request_data, respond, RequestFormatError
+
 covariance_api = Blueprint('covariance_api', __name__)
 
 def generate_id():
@@ -34,30 +37,31 @@ def calculate_covariance():
     """
     try:
         # 获取请求数据
-        request_data = request.json
+        request_data = get_request_data({'nodeData.dataset': 'table'})
         if not request_data or 'nodeData' not in request_data:
-            return jsonify({'error': '请求数据无效'}), 400
+            return respond({'error': '请求数据无效'}, 400)
 
         node_data = request_data['nodeData']
 
         # 验证数据集
-        if not node_data.get('dataset') or not isinstance(node_data['dataset'], list) or len(node_data['dataset']) == 0:
-            return jsonify({'error': '数据集为空或无效'}), 400
+        dataset = resolve_array(node_data, 'dataset')
+        if dataset is None or not isinstance(dataset, (list, np.ndarray)) or len(dataset) == 0:
+            return respond({'error': '数据集为空或无效'}, 400)
 
         # 将数据集转换为pandas DataFrame
-        df = pd.DataFrame(node_data['dataset'])
+        df = pd.DataFrame(dataset)
 
         # 提取数值列用于计算协方差矩阵
         numeric_columns = df.select_dtypes(include=[np.number]).columns.tolist()
 
         if len(numeric_columns) < 2:
-            return jsonify({'error': '需要至少两个数值特征才能计算协方差矩阵'}), 400
+            return respond({'error': '需要至少两个数值特征才能计算协方差矩阵'}, 400)
 
         # 提取数值数据
         numeric_data = df[numeric_columns]
 
         # 计算协方差矩阵
-        covariance_matrix = numeric_data.cov().values.tolist()
+        covariance_matrix = numeric_data.cov().values
 
         # 创建新节点
         new_node = node_data.copy()
@@ -69,16 +73,19 @@ def calculate_covariance():
         new_node["computed"]["featureNames"] = numeric_columns
         new_node["children"] = []
 
-        return jsonify({
+        return respond({
             'success': True,
             'node': new_node
         })
 
+    except RequestFormatError as e:
+        return respond({'error': str(e)}, 400)
+
     except Exception as e:
         # 捕获并返回任何错误
-        return jsonify({
+        return respond({
             'error': f'计算协方差矩阵时发生错误: {str(e)}'
-        }), 500
+        }, 500)
 
 
 # 处理缺失数据的函数
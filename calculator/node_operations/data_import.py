@@ -1,45 +1,28 @@
-from flask import Flask, request, jsonify, Blueprint
-from sklearn import datasets
+from flask import Flask, request, Blueprint, current_app
 import numpy as np
 import pandas as pd
 import tempfile
 import os
-from sklearn.datasets import fetch_openml
 
-from utils.jsonProcess import make_json_safe
+from utils.jsonProcess import dumps_json, json_response
+from utils.datasetRegistry import DATASETS, load_dataset
+from utils.memoryCache import SizedLRUCache
+from utils.arrayStore import put_array, get_array, ArrayNotFoundError
+from utils.arrayTransport import respond, wants_binary
 
 dataset_api = Blueprint('dataset_api', __name__)
 
-# 加载经典数据集的函数映射
-DATASETS = {
-    'iris': datasets.load_iris,
-    'wine': datasets.load_wine,
-    'breast_cancer': datasets.load_breast_cancer,
-    'digits': datasets.load_digits,
-    'boston': fetch_openml(name='boston', version=1, as_frame=True),
-    'mnist_small': lambda: load_mnist_small()  # 自定义函数加载MNIST小样本
-}
+# 内置数据集不会变化，进程内缓存numpy数组和已经编码好的JSON响应
+DATASET_MEMORY_CACHE_MB = int(os.environ.get('DATASET_MEMORY_CACHE_MB', '256'))
+_dataset_cache = SizedLRUCache(DATASET_MEMORY_CACHE_MB * 1024 * 1024)
 
 
-# boston = fetch_openml(name='boston', version=1, as_frame=True)
-
-def load_mnist_small():
-    """加载MNIST数据集的小样本版本"""
-    from sklearn.datasets import fetch_openml
-    from sklearn.utils import Bunch
-
-    # 获取MNIST数据集的一小部分
-    X, y = fetch_openml('mnist_784', version=1, return_X_y=True, parser='auto')
-    X = X[:2000]  # 只取前2000个样本
-    y = y[:2000]
-
-    return Bunch(
-        data=X,
-        target=y.astype(int),
-        feature_names=[f'pixel_{i}' for i in range(X.shape[1])],
-        target_names=np.unique(y),
-        DESCR="MNIST手写数字数据集(小样本版)"
-    )
+def get_target_labels(dataset):
+    """把数字标签映射为类别名称，回归目标（没有target_names）保持原值"""
+    target = np.asarray(dataset.target)
+    if dataset.target_names is not None and np.issubdtype(target.dtype, np.integer):
+        return np.asarray(dataset.target_names)[target].tolist()
+    return target.tolist()
 
 
 def format_dataset_preview(dataset):
@@ -122,34 +105,70 @@ def format_dataset_preview(dataset):
 
 
 
+def build_dataset_node(dataset_id, dataset, inline=True):
+    """
+    构建符合前端需要的树节点结构
+
+    节点总是带有 dataset_ref 句柄，inline 为 False 时不再内联 dataset 矩阵
+    """
+    node = {
+        "id": "1",
+        "selected": False,
+        "operation": f"原始数据集 ({dataset_id})",
+        "parameters": {},
+        # "target": dataset.target.tolist(),
+        "target": get_target_labels(dataset),
+        "dataset_ref": put_array(dataset.data),
+        "computed": {},
+        "feature_names": dataset.feature_names.tolist() if hasattr(dataset.feature_names, 'tolist') else dataset.feature_names,
+        "target_names": dataset.target_names.tolist() if hasattr(dataset.target_names, 'tolist') else dataset.target_names
+    }
+    if inline:
+        node["dataset"] = dataset.data
+    return node
+
+
+def get_cached_dataset(dataset_id):
+    """从进程内缓存取数据集的numpy数组，缺失时从注册表加载"""
+    dataset = _dataset_cache.get(('arrays', dataset_id))
+    if dataset is None:
+        dataset = load_dataset(dataset_id)
+        _dataset_cache.put(('arrays', dataset_id), dataset,
+                           dataset.data.nbytes + np.asarray(dataset.target).nbytes)
+    return dataset
+
+
+def get_cached_response(dataset_id, kind, build):
+    """
+    返回缓存的JSON响应字节，缺失时用 build(dataset) 构建并编码一次
+
+    Args:
+        dataset_id: 数据集ID
+        kind: 响应类型，'node' 或 'preview'
+        build: 由数据集构建响应字典的函数
+    """
+    body = _dataset_cache.get((kind, dataset_id))
+    if body is None:
+        body = dumps_json(build(get_cached_dataset(dataset_id)))
+        _dataset_cache.put((kind, dataset_id), body, len(body))
+    return current_app.response_class(body, mimetype='application/json')
+
+
 @dataset_api.route('/api/dataset/<dataset_id>', methods=['GET'])
 def get_dataset(dataset_id):
-    """根据数据集ID返回对应的数据集"""
+    """根据数据集ID返回对应的数据集，?inline=0 时只返回 dataset_ref 句柄"""
     try:
         if dataset_id in DATASETS:
-            # 加载经典数据集
-            dataset = DATASETS[dataset_id]()
-
-            # 构建符合前端需要的树节点结构
-            response = {
-                "id": "1",
-                "selected": False,
-                "operation": f"原始数据集 ({dataset_id})",
-                "parameters": {},
-                # "target": dataset.target.tolist(),
-                "target": [dataset.target_names[i] for i in dataset.target],
-                "dataset": dataset.data.tolist(),
-                "computed": {},
-                "feature_names": dataset.feature_names.tolist() if hasattr(dataset.feature_names, 'tolist') else dataset.feature_names,
-                "target_names": dataset.target_names.tolist() if hasattr(dataset.target_names, 'tolist') else dataset.target_names
-            }
-
-            return jsonify(response)
+            inline = request.args.get('inline', '1') != '0'
+            if wants_binary():
+                return respond(build_dataset_node(dataset_id, get_cached_dataset(dataset_id), inline))
+            return get_cached_response(dataset_id, 'node' if inline else 'node_ref',
+                                       lambda dataset: build_dataset_node(dataset_id, dataset, inline))
         else:
-            return jsonify({"error": f"找不到数据集: {dataset_id}"}), 404
+            return json_response({"error": f"找不到数据集: {dataset_id}"}, 404)
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @dataset_api.route('/api/dataset/<dataset_id>/preview', methods=['GET'])
 def get_dataset_preview(dataset_id):
@@ -157,29 +176,36 @@ def get_dataset_preview(dataset_id):
     print("dataset_id",dataset_id)
     try:
         if dataset_id in DATASETS:
-            # 加载经典数据集
-            dataset = DATASETS[dataset_id]()
-
-            return jsonify(format_dataset_preview(dataset))
+            return get_cached_response(dataset_id, 'preview', format_dataset_preview)
         else:
-            return jsonify({"error": f"找不到数据集: {dataset_id}"}), 404
+            return json_response({"error": f"找不到数据集: {dataset_id}"}, 404)
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
+
+@dataset_api.route('/api/array/<handle>', methods=['GET'])
+def get_array_by_handle(handle):
+    """按句柄取回数组内容"""
+    try:
+        return respond({"handle": handle, "data": get_array(handle)})
+    except ArrayNotFoundError as e:
+        return json_response({"error": str(e)}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
 
 @dataset_api.route('/api/dataset', methods=['GET'])
 def test():
-    return jsonify({"succeed": "成功"})
+    return json_response({"succeed": "成功"})
 
 @dataset_api.route('/api/dataset/upload', methods=['POST'])
 def upload_dataset():
     """处理上传的数据集文件"""
     if 'file' not in request.files:
-        return jsonify({"error": "没有上传文件"}), 400
+        return json_response({"error": "没有上传文件"}, 400)
 
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "没有选择文件"}), 400
+        return json_response({"error": "没有选择文件"}, 400)
 
     try:
         # 保存上传的文件到临时目录
@@ -194,7 +220,7 @@ def upload_dataset():
         else:
             os.close(fd)
             os.remove(temp_path)
-            return jsonify({"error": "不支持的文件格式"}), 400
+            return json_response({"error": "不支持的文件格式"}, 400)
 
         # 假设最后一列是目标变量
         X = df.iloc[:, :-1].values
@@ -207,15 +233,17 @@ def upload_dataset():
             "operation": "原始数据集 (上传)",
             "parameters": {},
             "target": y.tolist(),
-            "dataset": X.tolist(),
+            "dataset": X,
             "computed": {}
         }
+        if X.dtype != object:
+            response["dataset_ref"] = put_array(X)
 
         # 清理临时文件
         os.close(fd)
         os.remove(temp_path)
 
-        return jsonify(response)
+        return respond(response)
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
@@ -5,38 +5,45 @@ import uuid
 from matplotlib import pyplot as plt
 from scipy.stats import zscore
 
+from utils.arrayStore import resolve_array, assign_array, uses_refs
+from utils.arrayTransport import get_request_data, respond, RequestFormatError
+
 projection_api = Blueprint('projection_api', __name__)
 
 
 @projection_api.route('/api/projection', methods=['POST'])
 def perform_projection():
     try:
-        data = request.json
+        data = get_request_data({
+            'nodeData.dataset': 'matrix',
+            'eigenvectors': 'matrix',
+            'eigenvalues': 'vector'
+        })
 
         # 获取请求参数
         matrix_type = data.get('matrix_type')
         matrix_label = data.get('matrix_label')
-        eigenvectors = np.array(data.get('eigenvectors', []))
-        eigenvalues = np.array(data.get('eigenvalues', []))
+        eigenvectors = np.asarray(data.get('eigenvectors', []))
+        eigenvalues = np.asarray(data.get('eigenvalues', []))
         standardize = data.get('standardize', True)
         output_dimension = data.get('outputDimension', 2)
         node_data = data.get('nodeData', {})
 
         # 验证输入数据
         if not matrix_type or len(eigenvectors) == 0:
-            return jsonify({
+            return respond({
                 'success': False,
                 'message': '缺少必要的投影参数'
             })
 
         # 获取原始数据集
-        dataset = np.array(node_data.get('dataset', []))
+        dataset = np.asarray(resolve_array(node_data, 'dataset', []))
         feature_names = node_data.get('feature_names', [])
         target = node_data.get('target', [])
         target_names = node_data.get('target_names', [])
 
         if dataset.size == 0:
-            return jsonify({
+            return respond({
                 'success': False,
                 'message': '数据集为空'
             })
@@ -72,7 +79,6 @@ def perform_projection():
             'target_names': target_names,
             'target': target,
             'feature_names': new_feature_names,
-            'dataset': projected_data.tolist(),
             'computed': {
                 'projection_info': {
                     'original_features': feature_names,
@@ -80,14 +86,16 @@ def perform_projection():
                     'reduced_dimension': output_dimension,
                     'matrix_type': matrix_type,
                     'matrix_label': matrix_label,
-                    'eigenvalues_used': eigenvalues.tolist(),
+                    'eigenvalues_used': eigenvalues,
                     # 'variance_explained': calculate_variance_explained(eigenvalues),
-                    'projection_matrix': selected_eigenvectors.tolist()
+                    'projection_matrix': selected_eigenvectors
                 }
             },
             'children': []
         }
 
+        assign_array(new_node, 'dataset', projected_data, uses_refs(node_data))
+
         # 保留原始的computed信息（供后续分析使用）
         if 'computed' in node_data:
             # 只保留未被使用的矩阵信息
@@ -99,14 +107,20 @@ def perform_projection():
             if original_computed:
                 new_node['computed']['original_matrices'] = original_computed
 
-        return jsonify({
+        return respond({
             'success': True,
             'node': new_node,
             'message': f'使用{matrix_label}成功完成{output_dimension}维投影'
         })
 
+    except RequestFormatError as e:
+        return respond({
+            'success': False,
+            'message': str(e)
+        }, 400)
+
     except Exception as e:
-        return jsonify({
+        return respond({
             'success': False,
             'message': f'投影失败: {str(e)}'
         })
@@ -5,6 +5,9 @@ import uuid
 import scipy.linalg as linalg
 from copy import deepcopy
 
+from utils.arrayStore import resolve_array, has_array
+from utils.arrayTransport import get_request_data, respond, as_array, RequestFormatError
+
 eigen_api = Blueprint('eigen_api', __name__)
 
 # 矩阵名称中英文映射
@@ -62,31 +65,31 @@ def create_new_node(node_data, operation_name, result_key, eigenvalues, eigenvec
     new_node['id'] = str(uuid.uuid4())
     new_node['children'] = []
     new_node['operation'] = operation_name
-    new_node['computed'][f'{result_key}_eigenvalues'] = eigenvalues.tolist()
-    new_node['computed'][f'{result_key}_eigenvectors'] = eigenvectors.tolist()
+    new_node['computed'][f'{result_key}_eigenvalues'] = eigenvalues
+    new_node['computed'][f'{result_key}_eigenvectors'] = eigenvectors
     return new_node
 
 
 @eigen_api.route('/api/calculate-eigen', methods=['POST'])
 def calculate_eigen():
     try:
-        data = request.json
+        data = get_request_data({'node_data.computed.*_matrix': 'square'})
         node_data = data.get('node_data')
         calculation_type = data.get('calculation_type')
 
         # 检查节点数据是否有效
         if not node_data or 'computed' not in node_data:
-            return jsonify({'error': '无效的节点数据'}), 400
+            return respond({'error': '无效的节点数据'}, 400)
 
         computed = node_data['computed']
 
         # 根据计算类型进行不同的处理
         if calculation_type == 'single':
             matrix_name = data.get('matrix_name')
-            if matrix_name not in computed:
-                return jsonify({'error': f'矩阵 {matrix_name} 在计算数据中未找到'}), 400
+            if not has_array(computed, matrix_name):
+                return respond({'error': f'矩阵 {matrix_name} 在计算数据中未找到'}, 400)
 
-            matrix = np.array(computed[matrix_name])
+            matrix = as_array(resolve_array(computed, matrix_name), 'square', matrix_name)
             eigenvalues, eigenvectors = calculate_and_sort_eigen(matrix)
 
             # 创建新节点
@@ -100,11 +103,11 @@ def calculate_eigen():
             matrix_a_name = data.get('matrix_a_name')
             matrix_b_name = data.get('matrix_b_name')
 
-            if matrix_a_name not in computed or matrix_b_name not in computed:
-                return jsonify({'error': '一个或多个矩阵在计算数据中未找到'}), 400
+            if not has_array(computed, matrix_a_name) or not has_array(computed, matrix_b_name):
+                return respond({'error': '一个或多个矩阵在计算数据中未找到'}, 400)
 
-            matrix_a = np.array(computed[matrix_a_name])
-            matrix_b = np.array(computed[matrix_b_name])
+            matrix_a = as_array(resolve_array(computed, matrix_a_name), 'square', matrix_a_name)
+            matrix_b = as_array(resolve_array(computed, matrix_b_name), 'square', matrix_b_name)
 
             try:
                 eigenvalues, eigenvectors = calculate_and_sort_eigen(matrix_a, matrix_b)
@@ -122,17 +125,20 @@ def calculate_eigen():
                 )
 
             except Exception as e:
-                return jsonify({'error': f'广义特征值计算失败: {str(e)}'}), 500
+                return respond({'error': f'广义特征值计算失败: {str(e)}'}, 500)
 
         else:
-            return jsonify({'error': '无效的计算类型'}), 400
+            return respond({'error': '无效的计算类型'}, 400)
 
         # 返回结果
-        return jsonify({
-            'eigenvalues': eigenvalues.tolist(),
-            'eigenvectors': eigenvectors.tolist(),
+        return respond({
+            'eigenvalues': eigenvalues,
+            'eigenvectors': eigenvectors,
             'new_node': new_node
         })
 
+    except RequestFormatError as e:
+        return respond({'error': str(e)}, 400)
+
     except Exception as e:
-        return jsonify({'error': f'服务器错误: {str(e)}'}), 500
\ No newline at end of file
+        return respond({'error': f'服务器错误: {str(e)}'}, 500)
\ No newline at end of file
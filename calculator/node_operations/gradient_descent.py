@@ -1,12 +1,29 @@
-from flask import Flask, request, jsonify, Blueprint
-from sklearn.metrics import pairwise_distances
+from flask import Flask, Blueprint
 import numpy as np
+import os
 import uuid
 import copy
+import time
+from scipy import sparse
 from scipy.spatial.distance import pdist, squareform
-from umap.umap_ import find_ab_params
+from umap.umap_ import find_ab_params, make_epochs_per_sample
+
+from utils.arrayStore import resolve_array, assign_array, uses_refs
+from utils.arrayTransport import get_request_data, respond, respond_stream, coerce_arrays, RequestFormatError
+from utils.blockedGradient import (GRADIENT_MEMORY_BUDGET_MB, resolve_n_jobs, parallel_map, row_ranges,
+                                   plan_block_rows, normalize_sparse_p, create_blocked_workspace, similarity_rows,
+                                   q_scaling, gradient_rows, cost_rows, weighted_sum, blocked_iteration,
+                                   blocked_low_similarity, sparse_exact_similarity)
+from utils.computeDtype import resolve_dtype
+from utils.matrixCodec import encode_sparse
+from utils.tsneApproximation import (APPROXIMATIONS, to_sparse_p, clip_rows, barnes_hut_gradient, fft_gradient,
+                                    plan_max_boxes, interpolate_repulsion, sparse_low_similarity)
+
 gradient_api = Blueprint('gradient_api', __name__)
 
+# 批量接口一次最多运行的参数组数
+GRADIENT_BATCH_MAX_RUNS = int(os.environ.get('GRADIENT_BATCH_MAX_RUNS', '16'))
+
 
 def compute_low_dimensional_similarity_tsne(Y):
     """
@@ -25,8 +42,8 @@ def compute_low_dimensional_similarity_tsne(Y):
     num = 1 / (1 + D)
     np.fill_diagonal(num, 0)
 
-    # 归一化，防止除以零
-    q_sum = np.sum(num)
+    # 归一化，防止除以零（以float64累加）
+    q_sum = np.sum(num, dtype=np.float64)
     if q_sum < 1e-12:
         # 如果和太小，添加一个小常数防止除零
         q = num + 1e-12
@@ -57,8 +74,8 @@ def compute_low_dimensional_similarity_sne(Y):
     q = np.exp(-D)
     np.fill_diagonal(q, 0)
 
-    # 归一化，防止除以零
-    q_sum = np.sum(q)
+    # 归一化，防止除以零（以float64累加）
+    q_sum = np.sum(q, dtype=np.float64)
     if q_sum < 1e-12:
         # 如果和太小，添加一个小常数防止除零
         q = q + 1e-12
@@ -208,10 +225,186 @@ def calculate_gradient_norm(grad):
 
 
 
-def umap_gradient_descent(high_dim_sim, Y_init, learning_rate=1.0, iterations=1000,
-                          min_dist=0.1, recording_interval=100):
+def create_exact_workspace(P, n_components, n_jobs=1):
+    """
+    精确模式迭代内核的预分配缓冲区，整个梯度下降过程中复用
+
+    Args:
+        P: 高维相似度矩阵 (n, n)，在迭代中保持不变；缓冲区与P的dtype相同
+        n_components: 低维嵌入的维数
+        n_jobs: 线程数，各线程处理不同的行、共用这些缓冲区
+
+    Returns:
+        dict: kernel为核函数矩阵，Q为低维相似度，work为PQ差异/成本计算的工作区
+    """
+    n, dtype = P.shape[0], P.dtype
+    # 成本中使用的 max(P, 1e-12) 与迭代无关，只计算一次；P已满足下限时直接引用P
+    P_floor = P if P.min() >= 1e-12 else np.maximum(P, 1e-12)
+    return {
+        'P_floor': P_floor,
+        'kernel': np.empty((n, n), dtype=dtype),
+        'Q': np.empty((n, n), dtype=dtype),
+        'work': np.empty((n, n), dtype=dtype),
+        'sq_norms': np.empty(n, dtype=dtype),
+        'row_sums': np.empty(n, dtype=dtype),
+        'grad': np.empty((n, n_components), dtype=dtype),
+        'n_jobs': n_jobs
+    }
+
+
+def exact_iteration(algorithm, P, Y, workspace, compute_cost=True, exaggeration=1.0):
+    """
+    精确模式的单次迭代内核：一次计算距离、Q、梯度以及（可选的）KL散度
+
+    结果与依次调用 compute_low_dimensional_similarity_*、compute_gradient_* 和 calculate_cost_*
+    相同，但距离矩阵只计算一次，所有 n×n 的中间结果都写入 workspace 中的缓冲区，
+    不再逐行循环。各行分成固定大小的块，n_jobs > 1 时由线程池并行计算。
+
+    Args:
+        algorithm: 'tsne' 或 'sne'
+        P: 高维相似度矩阵
+        Y: 当前低维嵌入
+        workspace: create_exact_workspace 创建的缓冲区
+        compute_cost: 是否计算KL散度（只在需要记录的迭代中计算）
+        exaggeration: 早期夸大系数，梯度中以 exaggeration × P 代替 P，成本仍按原始P计算
+
+    Returns:
+        tuple: (梯度, 成本)；Q中出现NaN/Inf时返回 (None, None)，不计算成本时成本为 None
     """
-    UMAP梯度下降优化，接收高维相似度矩阵和初始低维嵌入
+    kernel, Q, work = workspace['kernel'], workspace['Q'], workspace['work']
+    sq_norms, row_sums, grad = workspace['sq_norms'], workspace['row_sums'], workspace['grad']
+    n_jobs = workspace['n_jobs']
+    n = Y.shape[0]
+    ranges = row_ranges(n)
+
+    # 第一步：核函数（t-SNE为 (1 + D)^-1，SNE为 exp(-D)）和去掉对角线后的Q的总和
+    np.einsum('ij,ij->i', Y, Y, out=sq_norms)
+    q_sum = sum(parallel_map(
+        lambda bounds: similarity_rows(algorithm, Y, sq_norms, *bounds, kernel[slice(*bounds)], Q[slice(*bounds)]),
+        ranges, n_jobs))
+    if not np.isfinite(q_sum):
+        return None, None
+    q_offset, q_total = q_scaling(q_sum, n)
+
+    # 第二步：归一化Q，计算梯度和成本
+    def process_rows(bounds):
+        rows = slice(*bounds)
+        gradient_rows(algorithm, P[rows], Y, *bounds, kernel[rows], Q[rows], work[rows], row_sums[rows], grad,
+                      q_offset, q_total, exaggeration)
+        if compute_cost:
+            return cost_rows(workspace['P_floor'][rows], Q[rows], work[rows])
+        return 0.0
+
+    costs = parallel_map(process_rows, ranges, n_jobs)
+
+    # 避免梯度爆炸：每行梯度范数不超过10
+    return clip_rows(grad), (sum(costs) if compute_cost else None)
+
+
+def collect_records(steps):
+    """
+    消费产出迭代记录的生成器
+
+    Returns:
+        tuple: (生成器的返回值, 全部迭代记录的列表)
+    """
+    records = []
+    while True:
+        try:
+            records.append(next(steps))
+        except StopIteration as stop:
+            return stop.value, records
+
+
+def count_records(steps, summary):
+    """转发迭代记录，同时在 summary 中统计记录数和最后一次的成本"""
+    try:
+        while True:
+            try:
+                record = next(steps)
+            except StopIteration as stop:
+                return stop.value
+            summary['recorded'] += 1
+            summary['final_cost'] = record['cost']
+            yield record
+    finally:
+        steps.close()
+
+
+def deadline_after(time_budget_ms):
+    """time_budget_ms 毫秒之后的截止时间（time.perf_counter() 的取值），不限时为 None"""
+    if time_budget_ms is None:
+        return None
+    return time.perf_counter() + time_budget_ms / 1000.0
+
+
+def check_time_budget(time_budget_ms):
+    """time_budget_ms 需要为正数或 None，无效时返回错误结果"""
+    if time_budget_ms is None:
+        return None
+    if isinstance(time_budget_ms, bool) or not isinstance(time_budget_ms, (int, float)) or time_budget_ms <= 0:
+        return {"success": False, "message": f"时间预算需要为正数（毫秒）: {time_budget_ms}"}
+    return None
+
+
+def remaining_budget_ms(time_budget_ms, start):
+    """从 start（time.perf_counter()）开始计时，time_budget_ms 中还剩下的毫秒数"""
+    if time_budget_ms is None:
+        return None
+    return time_budget_ms - (time.perf_counter() - start) * 1000.0
+
+
+def track_best(best, cost, Y, iteration):
+    """成本低于目前最好的状态时保存 Y 的副本，best 为 {'cost', 'embedding', 'iteration'}"""
+    if best['cost'] is None or cost < best['cost']:
+        best.update(cost=float(cost), embedding=Y.copy(), iteration=iteration)
+
+
+def umap_ab_params(min_dist):
+    """UMAP中的a和b参数，用于控制嵌入的分布"""
+    if min_dist > 0:
+        # 根据min_dist设置a和b
+        return 1.929, 0.7915
+    return 1.0, 1.0
+
+
+def pairwise_distances_into(Y, out, sq_norms):
+    """
+    在预分配的 out 中计算欧氏距离矩阵（|y_i|^2 + |y_j|^2 - 2 y_i·y_j 再开方）
+    """
+    np.einsum('ij,ij->i', Y, Y, out=sq_norms)
+    return distance_rows_into(Y, sq_norms, 0, Y.shape[0], out)
+
+
+def distance_rows_into(Y, sq_norms, start, stop, out):
+    """在 out 中计算第 start..stop 行的欧氏距离，sq_norms 为已计算好的 |y_i|^2"""
+    np.dot(Y[start:stop], Y.T, out=out)
+    out *= -2.0
+    out += sq_norms[start:stop, None]
+    out += sq_norms[None, :]
+    np.maximum(out, 0.0, out=out)
+    np.sqrt(out, out=out)
+    return out
+
+
+def umap_low_similarity_into(distances, a, b, out):
+    """在 out 中计算UMAP低维相似度 w = 1 / (1 + a * d^(2b))"""
+    np.power(distances, 2 * b, out=out)
+    out *= a
+    out += 1.0
+    np.reciprocal(out, out=out)
+    return out
+
+
+def umap_gradient_descent_steps(high_dim_sim, Y_init, learning_rate=1.0, iterations=1000,
+                                min_dist=0.1, recording_interval=100, n_jobs=1, time_budget_ms=None, progress=None,
+                                dtype=np.float64):
+    """
+    UMAP梯度下降优化，接收高维相似度矩阵和初始低维嵌入；每到记录间隔产出一条迭代记录
+
+    对所有点对 (i, j) 的吸引力、排斥力和交叉熵成本都以矩阵运算完成，
+    每次迭代只在预先分配好的 n×n 缓冲区中计算，不再逐对循环。
+    各行分成固定大小的块，n_jobs > 1 时由线程池并行计算。
 
     参数:
     high_dim_sim: 高维相似度矩阵，形状为 (n_samples, n_samples)，将被转换为numpy数组
@@ -220,78 +413,99 @@ def umap_gradient_descent(high_dim_sim, Y_init, learning_rate=1.0, iterations=10
     iterations: 梯度下降的迭代次数
     min_dist: 控制嵌入中点的最小距离
     recording_interval: 记录数据的间隔
+    n_jobs: 线程数
+    time_budget_ms: 时间预算（毫秒），用完后停止迭代并返回当前的嵌入；None 表示不限时
+    progress: 可选的dict，结束时写入实际迭代次数 iterations_run 和停止原因 stop_reason（超时为 'time_budget'）
+    dtype: 相似度矩阵、嵌入和 n×n 缓冲区的数值类型，成本总是以float64累加
 
-    返回:
+    产出:
+    迭代记录 {'iteration', 'embedding', 'cost', 'gradient_norm'}
+
+    返回（生成器结束时）:
     Y: 优化后的低维嵌入
     low_dim_sim: 最终的低维相似度矩阵
-    iterations_data: 迭代过程中记录的数据
     """
     # 确保输入是numpy数组
-    high_dim_sim = np.array(high_dim_sim)
-    Y = np.array(Y_init.copy()) if not isinstance(Y_init, np.ndarray) else Y_init.copy()
+    V = np.asarray(high_dim_sim, dtype=dtype)
+    Y = np.array(Y_init, dtype=dtype)
 
     n_samples = Y.shape[0]
 
-    # 创建存储迭代数据的列表
-    iterations_data = []
+    a, b = umap_ab_params(min_dist)
 
-    # UMAP中的a和b参数，用于控制嵌入的分布
-    a = 1.0
-    b = 1.0
-    if min_dist > 0:
-        # 根据min_dist设置a和b
-        a = 1.929
-        b = 0.7915
+    # 只有 v > 0 的点对有吸引力：
+    #   gradient_i = lr * Σ_j [(1 - v) w - v⁺ (1 - w)] (y_i - y_j) / (d + 1e-10)
+    #              = lr * Σ_j [w (1 - v + v⁺) - v⁺] (y_i - y_j) / (d + 1e-10)
+    V_pos = np.where(V > 0, V, 0.0)
+    repulsive_scale = 1.0 - V + V_pos
 
-    # 梯度下降优化
-    for iteration in range(iterations):
-        # 计算低维空间中的距离
-        Y_distances = pairwise_distances(Y)
-        np.fill_diagonal(Y_distances, 1.0)  # 避免除以零
-
-        # 计算梯度
-        gradient = np.zeros_like(Y)
+    # 成本只统计上三角中 v > 0 的点对：-v log(w) - (1 - v) log(1 - w)
+    cost_mask = np.triu(V > 0, k=1)
+    V_cost = np.where(cost_mask, V, 0.0)
+    V_cost_rest = np.where(cost_mask, 1.0 - V, 0.0)
 
-        for i in range(n_samples):
-            for j in range(n_samples):
-                if i != j:
-                    # 高维相似度
-                    v = high_dim_sim[i, j]
+    # 预分配的缓冲区
+    distances = np.empty((n_samples, n_samples), dtype=dtype)
+    W = np.empty_like(distances)
+    coef = np.empty_like(distances)
+    work = np.empty_like(distances)
+    sq_norms = np.empty(n_samples, dtype=dtype)
+    gradient = np.empty_like(Y)
+    diagonal = np.arange(n_samples)
 
-                    # 低维距离
-                    dist = Y_distances[i, j]
+    ranges = row_ranges(n_samples)
 
-                    # 方向向量
-                    direction = (Y[i] - Y[j]) / (dist + 1e-10)
+    def process_rows(bounds):
+        rows = slice(*bounds)
+        local = np.arange(bounds[1] - bounds[0])
+        D, W_rows, C, tmp = distances[rows], W[rows], coef[rows], work[rows]
 
-                    # UMAP的低维相似度函数
-                    w = 1.0 / (1.0 + a * (dist ** (2 * b)))
+        # 计算低维空间中的距离
+        distance_rows_into(Y, sq_norms, *bounds, D)
+        D[local, diagonal[rows]] = 1.0  # 避免除以零
+
+        # UMAP的低维相似度函数
+        umap_low_similarity_into(D, a, b, W_rows)
+
+        # 点对系数：吸引力（高维相似度 * 低维不相似度）与排斥力（低维相似度 * (1 - 高维相似度)）之和
+        np.multiply(W_rows, repulsive_scale[rows], out=C)
+        C -= V_pos[rows]
+        np.add(D, 1e-10, out=tmp)
+        C /= tmp
+        C[local, diagonal[rows]] = 0.0
+        C *= learning_rate
+
+        # Σ_j c_ij (y_i - y_j) = y_i Σ_j c_ij - (C Y)_i
+        block_gradient = gradient[rows]
+        np.dot(C, Y, out=block_gradient)
+        np.subtract(Y[rows] * C.sum(axis=1)[:, None], block_gradient, out=block_gradient)
+
+        # 当前成本（使用本次迭代更新前的距离）
+        np.add(W_rows, 1e-10, out=tmp)
+        np.log(tmp, out=tmp)
+        cost = -weighted_sum(V_cost[rows], tmp)
+        np.subtract(1.0, W_rows, out=tmp)
+        tmp += 1e-10
+        np.log(tmp, out=tmp)
+        return cost - weighted_sum(V_cost_rest[rows], tmp)
+
+    # 这里的成本只统计 v > 0 的点对（吸引项），并不随优化单调下降，超时时返回最后的嵌入而不是成本最低的
+    deadline = deadline_after(time_budget_ms)
+    iterations_run, stop_reason = 0, None
 
-                    # 梯度计算
-                    # 吸引力：高维相似度 * 低维不相似度
-                    # 排斥力：低维相似度 * (1 - 高维相似度)
-                    if v > 0:
-                        attractive_force = v * (1.0 - w) * direction
-                        gradient[i] -= learning_rate * attractive_force
+    # 梯度下降优化
+    for iteration in range(iterations):
+        # 至少完成一次迭代
+        if deadline is not None and iteration > 0 and time.perf_counter() >= deadline:
+            stop_reason = 'time_budget'
+            break
 
-                    # 所有点之间都有排斥力
-                    repulsive_force = (1.0 - v) * w * direction
-                    gradient[i] += learning_rate * repulsive_force
+        np.einsum('ij,ij->i', Y, Y, out=sq_norms)
+        cost = sum(parallel_map(process_rows, ranges, n_jobs))
 
         # 更新低维嵌入
         Y += gradient
-
-        # 计算当前成本
-        cost = 0.0
-        for i in range(n_samples):
-            for j in range(i + 1, n_samples):  # 只计算上三角矩阵，避免重复
-                v = high_dim_sim[i, j]
-                dist = Y_distances[i, j]
-                w = 1.0 / (1.0 + a * (dist ** (2 * b)))
-
-                if v > 0:
-                    # 正样本对的损失
-                    cost += -v * np.log(w + 1e-10) - (1 - v) * np.log(1 - w + 1e-10)
+        iterations_run = iteration + 1
 
         # 计算梯度范数
         grad_norm = np.linalg.norm(gradient)
@@ -299,66 +513,310 @@ def umap_gradient_descent(high_dim_sim, Y_init, learning_rate=1.0, iterations=10
         # 记录迭代数据
         if iteration % recording_interval == 0 or iteration == iterations - 1:
             print("迭代次数", iteration)
-            iterations_data.append({
+            yield {
                 'iteration': iteration,
-                'embedding': Y.tolist(),
+                'embedding': Y.copy(),
                 'cost': float(cost),
                 'gradient_norm': float(grad_norm)
-            })
+            }
+
+    if progress is not None:
+        progress.update(iterations_run=iterations_run, stop_reason=stop_reason)
 
     # 计算最终的低维相似度矩阵
-    final_Y_distances = pairwise_distances(Y)
-    np.fill_diagonal(final_Y_distances, 0.0)  # 对角线设为0，表示自己与自己的相似度最高
-
-    # 将距离转换为相似度
-    low_dim_sim = np.zeros_like(final_Y_distances)
-    for i in range(n_samples):
-        for j in range(n_samples):
-            if i != j:
-                dist = final_Y_distances[i, j]
-                # 使用UMAP的低维相似度函数计算相似度
-                low_dim_sim[i, j] = 1.0 / (1.0 + a * (dist ** (2 * b)))
-
-    # 返回最终的低维嵌入、低维相似度矩阵和迭代记录
+    pairwise_distances_into(Y, distances, sq_norms)
+    low_dim_sim = umap_low_similarity_into(distances, a, b, W)
+    # 对角线设为0
+    low_dim_sim[diagonal, diagonal] = 0.0
+
+    # 返回最终的低维嵌入和低维相似度矩阵
+    return Y, low_dim_sim
+
+
+def umap_gradient_descent(high_dim_sim, Y_init, learning_rate=1.0, iterations=1000,
+                          min_dist=0.1, recording_interval=100, n_jobs=1, time_budget_ms=None, progress=None,
+                          dtype=np.float64):
+    """
+    UMAP梯度下降优化，参数见 umap_gradient_descent_steps
+
+    返回:
+    Y: 优化后的低维嵌入
+    low_dim_sim: 最终的低维相似度矩阵
+    iterations_data: 迭代过程中记录的数据
+    """
+    (Y, low_dim_sim), iterations_data = collect_records(umap_gradient_descent_steps(
+        high_dim_sim, Y_init, learning_rate, iterations, min_dist, recording_interval, n_jobs, time_budget_ms,
+        progress, dtype))
     return Y, low_dim_sim, iterations_data
 
-def run_gradient_descent(algorithm, parameters, node_data):
+
+def scatter_add(out, index, values):
+    """out[index] += values，重复的索引会累加（按列用bincount，比 np.add.at 快得多）"""
+    for d in range(out.shape[1]):
+        out[:, d] += np.bincount(index, weights=values[:, d], minlength=out.shape[0])
+
+
+def umap_sgd_steps(graph, Y_init, learning_rate=1.0, n_epochs=200, min_dist=0.1,
+                   negative_sample_rate=5, recording_interval=10, repulsion_strength=1.0,
+                   random_state=42, time_budget_ms=None, progress=None, dtype=np.float64):
+    """
+    UMAP的按轮次随机梯度下降，只在稀疏近邻图的边和少量负样本上计算；每到记录间隔产出一条迭代记录
+
+    每条边按权重比例被采样：权重最大的边每轮都参与，权重为其一半的边每两轮参与一次；
+    每次采样一条边 (i, j) 时，i 与 j 相互吸引，并为 i 随机抽取 negative_sample_rate 个点产生排斥。
+    同一轮中的所有采样以数组运算一次完成（以本轮开始时的嵌入计算梯度），每轮代价为 O(n·k)。
+
+    参数:
+    graph: 高维相似度（模糊单纯集），scipy稀疏矩阵或稠密方阵
+    Y_init: 初始低维嵌入，形状为 (n_samples, n_components)
+    learning_rate: 初始学习率，随轮次线性衰减到0
+    n_epochs: 训练轮数
+    min_dist: 控制嵌入中点的最小距离
+    negative_sample_rate: 每个正样本对应的负样本数
+    recording_interval: 记录数据的间隔（轮）
+    repulsion_strength: 排斥力权重 gamma
+    random_state: 负采样的随机种子
+    time_budget_ms: 时间预算（毫秒），用完后停止训练并返回当前的嵌入；None 表示不限时
+    progress: 见 umap_gradient_descent_steps
+    dtype: 嵌入和梯度的数值类型
+
+    产出:
+    迭代记录 {'iteration', 'embedding', 'cost', 'gradient_norm'}
+
+    返回（生成器结束时）:
+    Y: 优化后的低维嵌入
+    low_dim_sim: 图中各条边上的低维相似度（CSR稀疏矩阵）
+    """
+    graph = sparse.coo_matrix(graph)
+    Y = np.array(Y_init, dtype=dtype)
+    n_vertices = Y.shape[0]
+    rng = np.random.default_rng(random_state)
+
+    a, b = find_ab_params(1.0, min_dist)
+
+    # 与UMAP一致：丢弃在整个训练中采样不到一次的弱边
+    keep = graph.data >= graph.data.max() / float(n_epochs)
+    head, tail, weights = graph.row[keep], graph.col[keep], graph.data[keep]
+
+    epochs_per_sample = make_epochs_per_sample(weights, n_epochs)
+    epochs_per_negative_sample = epochs_per_sample / negative_sample_rate
+    epoch_of_next_sample = epochs_per_sample.copy()
+    epoch_of_next_negative_sample = epochs_per_negative_sample.copy()
+
+    # 成本只统计上三角的边：-v log(w) - (1 - v) log(1 - w)
+    upper = head < tail
+
+    gradient = np.zeros_like(Y)
+
+    deadline = deadline_after(time_budget_ms)
+    iterations_run, stop_reason = 0, None
+
+    for epoch in range(n_epochs):
+        # 至少完成一轮
+        if deadline is not None and epoch > 0 and time.perf_counter() >= deadline:
+            stop_reason = 'time_budget'
+            break
+
+        alpha = learning_rate * (1.0 - epoch / float(n_epochs))
+        gradient.fill(0.0)
+
+        active = np.flatnonzero(epoch_of_next_sample <= epoch)
+        i, j = head[active], tail[active]
+
+        # 吸引力：-2ab d^(2(b-1)) / (1 + a d^(2b)) * (y_i - y_j)，每个分量截断到[-4, 4]
+        diff = Y[i] - Y[j]
+        dist_sq = np.einsum('ij,ij->i', diff, diff)
+        positive = dist_sq > 0
+        coeff = np.zeros_like(dist_sq)
+        coeff[positive] = (-2.0 * a * b * dist_sq[positive] ** (b - 1.0)
+                           / (a * dist_sq[positive] ** b + 1.0))
+        grad = np.clip(coeff[:, None] * diff, -4.0, 4.0)
+        scatter_add(gradient, i, grad)
+        scatter_add(gradient, j, -grad)
+
+        epoch_of_next_sample[active] += epochs_per_sample[active]
+
+        # 排斥力：为每条被采样的边抽取负样本
+        n_negative = ((epoch - epoch_of_next_negative_sample[active])
+                      / epochs_per_negative_sample[active]).astype(np.int64)
+        n_negative = np.maximum(n_negative, 0)
+        epoch_of_next_negative_sample[active] += n_negative * epochs_per_negative_sample[active]
+
+        neg_head = np.repeat(i, n_negative)
+        neg_tail = rng.integers(0, n_vertices, size=neg_head.shape[0])
+        distinct = neg_head != neg_tail
+        neg_head, neg_tail = neg_head[distinct], neg_tail[distinct]
+
+        diff = Y[neg_head] - Y[neg_tail]
+        dist_sq = np.einsum('ij,ij->i', diff, diff)
+        coeff = 2.0 * repulsion_strength * b / ((0.001 + dist_sq) * (a * dist_sq ** b + 1.0))
+        grad = np.clip(coeff[:, None] * diff, -4.0, 4.0)
+        # 重合的点之间没有方向，UMAP取梯度上限
+        grad[dist_sq == 0] = 4.0
+        scatter_add(gradient, neg_head, grad)
+
+        Y += alpha * gradient
+        iterations_run = epoch + 1
+
+        # 记录迭代数据
+        if epoch % recording_interval == 0 or epoch == n_epochs - 1:
+            diff = Y[head[upper]] - Y[tail[upper]]
+            w = 1.0 / (1.0 + a * np.einsum('ij,ij->i', diff, diff) ** b)
+            v = weights[upper]
+            cost = np.sum(-v * np.log(w + 1e-10) - (1 - v) * np.log(1 - w + 1e-10), dtype=np.float64)
+            yield {
+                'iteration': epoch,
+                'embedding': Y.copy(),
+                'cost': float(cost),
+                'gradient_norm': float(np.linalg.norm(gradient))
+            }
+
+    if progress is not None:
+        progress.update(iterations_run=iterations_run, stop_reason=stop_reason)
+
+    # 只在图的边上给出最终的低维相似度，避免构造 n×n 矩阵
+    diff = Y[head] - Y[tail]
+    w = 1.0 / (1.0 + a * np.einsum('ij,ij->i', diff, diff) ** b)
+    low_dim_sim = sparse.csr_matrix((w, (head, tail)), shape=(n_vertices, n_vertices))
+
+    return Y, low_dim_sim
+
+
+def umap_sgd_optimize(graph, Y_init, learning_rate=1.0, n_epochs=200, min_dist=0.1,
+                      negative_sample_rate=5, recording_interval=10, repulsion_strength=1.0,
+                      random_state=42, time_budget_ms=None, progress=None, dtype=np.float64):
+    """
+    UMAP的按轮次随机梯度下降，参数见 umap_sgd_steps
+
+    返回:
+    Y: 优化后的低维嵌入
+    low_dim_sim: 图中各条边上的低维相似度（CSR稀疏矩阵）
+    iterations_data: 迭代过程中记录的数据
+    """
+    (Y, low_dim_sim), iterations_data = collect_records(umap_sgd_steps(
+        graph, Y_init, learning_rate, n_epochs, min_dist, negative_sample_rate, recording_interval,
+        repulsion_strength, random_state, time_budget_ms, progress, dtype))
+    return Y, low_dim_sim, iterations_data
+
+
+# t-SNE/SNE的优化策略：'fixed' 全程使用固定的动量和学习率；'standard' 为 van der Maaten 的标准策略：
+# 早期夸大阶段（P乘以 early_exaggeration，动量为 initial_momentum）之后切换到 momentum，
+# 每个坐标的步长按 delta-bar-delta 规则自适应（gains），并在收敛后提前停止
+SCHEDULES = ('fixed', 'standard')
+
+# 'standard' 策略的默认参数，均可在 parameters 中覆盖
+STANDARD_SCHEDULE = {
+    'early_exaggeration': 12.0,
+    'exaggeration_iterations': 250,
+    'initial_momentum': 0.5,
+    'min_gain': 0.01,
+    # 夸大阶段结束后，每 convergence_check_interval 次迭代（以及每次记录时）检查一次收敛：
+    # 梯度范数小于 min_grad_norm，或连续 n_iter_without_progress 次迭代中成本的相对下降不足
+    # convergence_tolerance 时停止
+    'convergence_check_interval': 50,
+    'min_grad_norm': 1e-7,
+    'n_iter_without_progress': 100,
+    'convergence_tolerance': 1e-2
+}
+
+
+# 只影响迭代过程、不影响P和工作区的参数：会话的每次 step 和批量运行的每一组参数可以单独设置
+LOOP_PARAMETERS = ('learning_rate', 'momentum', 'recording_interval', 'theta', 'n_interpolation_points',
+                   'schedule', 'time_budget_ms') + tuple(STANDARD_SCHEDULE)
+
+# UMAP优化器只在迭代中使用的参数
+UMAP_LOOP_PARAMETERS = ('optimizer', 'min_dist', 'negative_sample_rate', 'random_state')
+
+
+def interpolation_max_boxes(parameters):
+    """FFT插值网格每个维度上格子数的上限，插值网格与精确模式的工作区共用同一个内存预算"""
+    return plan_max_boxes(parameters.get('memory_budget_mb') or GRADIENT_MEMORY_BUDGET_MB,
+                          parameters.get('n_interpolation_points', 3))
+
+
+def schedule_settings(parameters):
+    """'standard' 策略的参数：默认值与请求中的覆盖值合并"""
+    return {key: parameters.get(key, default) for key, default in STANDARD_SCHEDULE.items()}
+
+
+def initial_learning_rate(parameters, n_samples):
     """
-    执行梯度下降算法
+    初始学习率，默认200；'auto' 按样本数确定（Belkina et al. 2019），n/α/4 且不小于50
     """
+    learning_rate = parameters.get('learning_rate', 200)
+    if learning_rate == 'auto':
+        standard = parameters.get('schedule', 'fixed') == 'standard'
+        exaggeration = schedule_settings(parameters)['early_exaggeration'] if standard else 1.0
+        learning_rate = max(n_samples / exaggeration / 4, 50.0)
+    return learning_rate
+
+
+def prepare_optimization(algorithm, parameters, node_data):
+    """
+    梯度下降的准备工作：解析并归一化P，初始化低维表示、动量项和工作区
+
+    Returns:
+        tuple: (优化状态, None) 或 (None, 错误结果)。优化状态保存了继续迭代所需的全部数据，
+               optimization_steps 可以在同一个状态上多次调用
+
+    parameters 中的 dtype（默认为 COMPUTE_DTYPE）决定P、低维表示和工作区的数值类型
+    """
+    try:
+        dtype = resolve_dtype(parameters.get('dtype'))
+    except ValueError as e:
+        return None, {"success": False, "message": str(e)}
+
     # 将输入数据视为低维表示
-    dataset = np.array(node_data.get('dataset', []), dtype=np.float64)
+    dataset = np.asarray(resolve_array(node_data, 'dataset', []), dtype=dtype)
+    by_ref = uses_refs(node_data)
 
     # 确保数据的第二列是可操作的
     if dataset.size == 0 or dataset.ndim != 2:
-        return {"success": False, "message": "数据集格式不正确"}
+        return None, {"success": False, "message": "数据集格式不正确"}
 
     # 获取初始的高维相似度矩阵（如果存在）
     computed = node_data.get('computed', {})
 
+    # 梯度计算的线程数；精确模式的工作区超出内存预算时按行分块计算
+    n_jobs = resolve_n_jobs(parameters.get('n_jobs'))
+    block_rows = plan_block_rows(dataset.shape[0], parameters.get('memory_budget_mb'), n_jobs, dtype.itemsize)
+    p_fill = 0.0
+
     # 如果没有高维相似度矩阵，则计算一个
-    high_similarity_matrix = computed.get('high_similarity_matrix')
+    high_similarity_matrix = resolve_array(computed, 'high_similarity_matrix')
     if high_similarity_matrix is None:
         if 'feature_names' not in node_data or not node_data['feature_names']:
-            return {"success": False, "message": "需要特征数据来计算高维相似度矩阵"}
+            return None, {"success": False, "message": "需要特征数据来计算高维相似度矩阵"}
 
         # 假设dataset是低维表示，我们需要另一个高维数据来计算高维相似度
         # 通常在此之前应该有其他节点提供了高维数据
-        return {"success": False, "message": "缺少高维相似度矩阵"}
+        return None, {"success": False, "message": "缺少高维相似度矩阵"}
+    elif sparse.issparse(high_similarity_matrix) and (
+            algorithm == 'umap' or parameters.get('approximation', 'exact') != 'exact'):
+        # 稀疏近邻图直接交给UMAP的SGD优化器或t-SNE的近似梯度
+        P = None
+    elif sparse.issparse(high_similarity_matrix) and block_rows < dataset.shape[0]:
+        # 分块模式下稀疏P保持稀疏，逐块展开
+        P, p_fill = normalize_sparse_p(high_similarity_matrix, dtype)
+        if P is None:
+            return None, {"success": False, "message": "高维相似度矩阵无效，请重新计算"}
     else:
+        if sparse.issparse(high_similarity_matrix):
+            high_similarity_matrix = high_similarity_matrix.toarray()
+
         # 确保是numpy数组
-        P = np.array(high_similarity_matrix, dtype=np.float64)
+        P = np.asarray(high_similarity_matrix, dtype=dtype)
 
         # 确保P中没有无效值
         P = np.nan_to_num(P, nan=1e-12, posinf=1e-12, neginf=1e-12)
 
-        # 确保P是有效概率分布
+        # 确保P是有效概率分布（总和以float64累加）
         P = np.maximum(P, 1e-12)
-        P_sum = np.sum(P)
+        P_sum = np.sum(P, dtype=np.float64)
         if P_sum > 0:
             P = P / P_sum
         else:
-            return {"success": False, "message": "高维相似度矩阵无效，请重新计算"}
+            return None, {"success": False, "message": "高维相似度矩阵无效，请重新计算"}
 
     # 初始化低维表示
     # 如果数据集已经有2列，就直接使用
@@ -370,74 +828,154 @@ def run_gradient_descent(algorithm, parameters, node_data):
             Y = dataset[:, :2].copy()
         else:
             n_samples = dataset.shape[0]
-            Y = np.random.randn(n_samples, 2) * 0.0001
+            Y = (np.random.randn(n_samples, 2) * 0.0001).astype(dtype)
 
     # 检查Y中是否有无效值
     if np.isnan(Y).any() or np.isinf(Y).any():
         # 如果有无效值，则重新初始化
         n_samples = Y.shape[0]
-        Y = np.random.randn(n_samples, 2) * 0.0001
+        Y = (np.random.randn(n_samples, 2) * 0.0001).astype(dtype)
 
-    # 算法参数
-    iterations = parameters.get('iterations', 1000)
-    learning_rate = parameters.get('learning_rate', 200)
-    momentum = parameters.get('momentum', 0.8)
+    # t-SNE梯度的计算方式：'exact' 精确计算所有点对，'barnes_hut' 用四叉树/八叉树近似排斥力，
+    # 'fft' 用网格插值和FFT卷积近似排斥力（二维）
+    approximation = parameters.get('approximation', 'exact')
     perplexity = parameters.get('perplexity', 30)
-    n_neighbors = parameters.get('n_neighbors', 15)
-    min_dist = parameters.get('min_dist', 0.1)
-    recording_interval = parameters.get('recording_interval', 10)
 
-    # 初始化动量项
-    Y_prev = Y.copy()
-    Y_incs = np.zeros_like(Y)
-
-    # 记录迭代过程
-    iterations_data = []
-
-    # 根据算法选择不同的相似度计算方法
-    if algorithm == 'tsne':
-        compute_low_similarity = compute_low_dimensional_similarity_tsne
-        compute_gradient = compute_gradient_tsne
-        calculate_cost = calculate_cost_tsne
-        algorithm_params = {}
-    elif algorithm == 'sne':
-        compute_low_similarity = compute_low_dimensional_similarity_sne
-        compute_gradient = compute_gradient_sne
-        calculate_cost = calculate_cost_sne
-        algorithm_params = {}
-    elif algorithm == 'umap':
-        a, b = find_ab_params(1.0, min_dist)
-        try:
-            print("high_similarity_matrix",type(high_similarity_matrix))
-            print("Y",type(Y))
-            # print("high_similarity_matrix的尺寸", high_similarity_matrix.shape)
-            print("Y的尺寸", Y.shape)
-            Y, final_Q,iterations_data = umap_gradient_descent(high_similarity_matrix,Y,learning_rate,iterations,min_dist, recording_interval)
-        except Exception as e:
-            return {"success": False, "message": f"UMAP梯度下降过程中出错: {str(e)}"}
+    schedule = parameters.get('schedule', 'fixed')
+    error = check_time_budget(parameters.get('time_budget_ms'))
+    if error is not None:
+        return None, error
+
+    if algorithm == 'umap':
+        approximation = 'exact'
+    elif algorithm not in ('tsne', 'sne'):
+        return None, {"success": False, "message": f"不支持的算法: {algorithm}"}
+    elif schedule not in SCHEDULES:
+        return None, {"success": False, "message": f"不支持的优化策略: {schedule}"}
+    elif approximation not in APPROXIMATIONS:
+        return None, {"success": False, "message": f"不支持的近似方法: {approximation}"}
+    elif approximation != 'exact':
+        if algorithm != 'tsne':
+            return None, {"success": False, "message": "近似梯度只适用于t-SNE"}
+        # 近似方法只使用稀疏P，不再构造 n×n 的Q矩阵
+        P = to_sparse_p(high_similarity_matrix, perplexity)
+
+    state = {
+        'algorithm': algorithm,
+        'parameters': parameters,
+        'node_data': node_data,
+        'by_ref': by_ref,
+        'high_similarity_matrix': high_similarity_matrix,
+        'P': P,
+        'Y': Y,
+        # 初始化动量项
+        'Y_prev': Y.copy(),
+        'Y_incs': np.zeros_like(Y),
+        # 'standard' 策略中每个坐标的自适应步长
+        'gains': np.ones_like(Y),
+        'learning_rate': initial_learning_rate(parameters, Y.shape[0]),
+        'approximation': approximation,
+        'n_jobs': n_jobs,
+        # 已完成的迭代次数，多次调用 optimization_steps 时迭代序号接续
+        'iteration': 0,
+        # 记录数和最后一次记录的成本，写入新节点
+        'summary': {'recorded': 0, 'final_cost': None},
+        # 提前停止的原因：'gradient_norm'、'no_progress' 或 'time_budget'，未提前停止时为 None
+        'stop_reason': None,
+        # 因时间预算停止时，返回的（成本最低的）状态对应的迭代序号
+        'best_iteration': None,
+        'final_Q': None
+    }
 
-    else:
-        return {"success": False, "message": f"不支持的算法: {algorithm}"}
+    if algorithm != 'umap' and approximation == 'exact':
+        if block_rows < P.shape[0]:
+            state['workspace'] = create_blocked_workspace(P, Y.shape[1], block_rows, p_fill, n_jobs)
+            state['iteration_kernel'] = blocked_iteration
+        else:
+            state['workspace'] = create_exact_workspace(P, Y.shape[1], n_jobs)
+            state['iteration_kernel'] = exact_iteration
+    return state, None
 
-    # 梯度下降主循环
-    if algorithm !='umap':
-        for iteration in range(iterations):
-            try:
-                # 计算当前低维相似度
-                Q = compute_low_similarity(Y)
 
-                # 检查Q是否有效
-                if np.isnan(Q).any() or np.isinf(Q).any():
-                    # 如果Q无效，则尝试重置Y并减小学习率
-                    Y = Y_prev.copy()
-                    learning_rate *= 0.5
-                    if learning_rate < 1e-5:
-                        return {"success": False,
-                                "message": "梯度下降过程中出现数值不稳定，请尝试降低学习率或重新初始化"}
-                    continue
+def optimization_steps(state, iterations, time_budget_ms=None):
+    """
+    在优化状态上继续执行至多 iterations 次t-SNE/SNE迭代，每到记录间隔产出一条迭代记录；
+    'standard' 策略下收敛后提前停止，并产出停止时的记录
 
-                # 计算梯度
-                grad = compute_gradient(P, Q, Y, **algorithm_params)
+    给出 time_budget_ms（毫秒）时，时间用完后停止迭代，状态回到计算过成本（记录或检查收敛）的状态中
+    成本最低的一个，动量项清零。早期夸大阶段优化的不是KL散度，这一阶段的状态不参与比较
+
+    Returns（生成器结束时）:
+        None，或数值不稳定等情况下的错误结果
+    """
+    algorithm, P, parameters = state['algorithm'], state['P'], state['parameters']
+    approximation, summary = state['approximation'], state['summary']
+    final_momentum = parameters.get('momentum', 0.8)
+    recording_interval = parameters.get('recording_interval', 10)
+    theta = parameters.get('theta', 0.5)
+    n_interpolation_points = parameters.get('n_interpolation_points', 3)
+    max_boxes = interpolation_max_boxes(parameters)
+    standard = parameters.get('schedule', 'fixed') == 'standard'
+    settings = schedule_settings(parameters)
+
+    Y, Y_prev, Y_incs, gains = state['Y'], state['Y_prev'], state['Y_incs'], state['gains']
+    learning_rate = state['learning_rate']
+    first = state['iteration']
+    last = first + iterations - 1
+
+    # 每次调用重新开始判断成本是否停滞，会话中继续迭代时不会立即停止
+    best_cost, best_iteration = np.inf, first
+    state['stop_reason'] = None
+    state['best_iteration'] = None
+
+    deadline = deadline_after(time_budget_ms)
+    best = {'cost': None}
+    next_iteration = first
+
+    try:
+        for iteration in range(first, last + 1):
+            # 至少完成一次迭代
+            if deadline is not None and iteration > first and time.perf_counter() >= deadline:
+                state['stop_reason'] = 'time_budget'
+                break
+            next_iteration = iteration + 1
+
+            try:
+                exaggerating = standard and iteration < settings['exaggeration_iterations']
+                exaggeration = settings['early_exaggeration'] if exaggerating else 1.0
+                momentum = settings['initial_momentum'] if exaggerating else final_momentum
+
+                recording = iteration % recording_interval == 0 or iteration == last
+                checking = standard and not exaggerating and (
+                    recording or iteration % settings['convergence_check_interval'] == 0)
+                compute_cost = recording or checking
+
+                if approximation == 'barnes_hut':
+                    # 只在需要记录或检查收敛时计算KL散度
+                    grad, cost = barnes_hut_gradient(P, Y, theta, compute_error=compute_cost,
+                                                     exaggeration=exaggeration)
+                elif approximation == 'fft':
+                    grad, cost = fft_gradient(P, Y, compute_error=compute_cost,
+                                              n_interpolation_points=n_interpolation_points,
+                                              exaggeration=exaggeration, max_boxes=max_boxes)
+                else:
+                    # 一次计算低维相似度、梯度和（需要时的）KL散度
+                    grad, cost = state['iteration_kernel'](algorithm, P, Y, state['workspace'],
+                                                           compute_cost=compute_cost, exaggeration=exaggeration)
+
+                    # 检查Q是否有效
+                    if grad is None:
+                        # 如果Q无效，则尝试重置Y并减小学习率
+                        Y = Y_prev.copy()
+                        learning_rate *= 0.5
+                        if learning_rate < 1e-5:
+                            return {"success": False,
+                                    "message": "梯度下降过程中出现数值不稳定，请尝试降低学习率或重新初始化"}
+                        continue
+
+                # 成本对应更新前的嵌入
+                if deadline is not None and cost is not None and not exaggerating:
+                    track_best(best, cost, Y, iteration)
 
                 # 检查梯度是否有效
                 if np.isnan(grad).any() or np.isinf(grad).any():
@@ -448,12 +986,19 @@ def run_gradient_descent(algorithm, parameters, node_data):
                     if grad_norm > 1.0:
                         grad = grad / grad_norm
 
-                # 计算当前成本和梯度范数
-                cost = calculate_cost(P, Q)
+                # 计算梯度范数
                 grad_norm = calculate_gradient_norm(grad)
 
                 # 应用动量和学习率
-                Y_incs = momentum * Y_incs - learning_rate * grad
+                if standard:
+                    # delta-bar-delta：梯度方向与上一步的更新方向相反（仍在下降）时增大该坐标的步长，否则减小
+                    descending = Y_incs * grad < 0.0
+                    gains[descending] += 0.2
+                    gains[~descending] *= 0.8
+                    np.maximum(gains, settings['min_gain'], out=gains)
+                    Y_incs = momentum * Y_incs - learning_rate * gains * grad
+                else:
+                    Y_incs = momentum * Y_incs - learning_rate * grad
                 Y_next = Y + Y_incs
 
                 # 检查新位置是否有效
@@ -472,25 +1017,107 @@ def run_gradient_descent(algorithm, parameters, node_data):
                 # 为了可视化清晰度，去除嵌入的平均值
                 Y = Y - np.mean(Y, axis=0)
 
-                # 记录迭代数据
-                if iteration % recording_interval == 0 or iteration == iterations - 1:
+                # 检查是否收敛
+                if checking:
+                    if grad_norm < settings['min_grad_norm']:
+                        state['stop_reason'] = 'gradient_norm'
+                    elif cost < best_cost * (1.0 - settings['convergence_tolerance']):
+                        best_cost, best_iteration = cost, iteration
+                    elif iteration - best_iteration >= settings['n_iter_without_progress']:
+                        state['stop_reason'] = 'no_progress'
+
+                # 记录迭代数据，提前停止时总是记录最后一次迭代
+                if recording or state['stop_reason']:
                     print("迭代次数", iteration)
-                    iterations_data.append({
+                    summary['recorded'] += 1
+                    summary['final_cost'] = float(cost)
+                    yield {
                         'iteration': iteration,
-                        'embedding': Y.tolist(),
+                        'embedding': Y.copy(),
                         'cost': float(cost),
                         'gradient_norm': float(grad_norm)
-                    })
+                    }
+                if state['stop_reason']:
+                    break
 
             except Exception as e:
                 return {"success": False, "message": f"梯度下降过程中出错: {str(e)}"}
 
+        # 超时时返回成本最低的状态
+        if state['stop_reason'] == 'time_budget' and best['cost'] is not None:
+            Y, Y_prev, Y_incs = best['embedding'], best['embedding'].copy(), np.zeros_like(Y)
+            summary['final_cost'] = best['cost']
+            state['best_iteration'] = best['iteration']
+    finally:
+        # 保存到目前为止的进度，下一次调用从这里继续
+        state.update(Y=Y, Y_prev=Y_prev, Y_incs=Y_incs, gains=gains, learning_rate=learning_rate,
+                     iteration=next_iteration)
+    return None
+
+
+def umap_optimization_steps(state, iterations, time_budget_ms=None):
+    """
+    在优化状态上运行UMAP优化器，产出迭代记录；结束时把嵌入、最终的低维相似度、
+    实际迭代次数和停止原因写回状态
+
+    Returns（生成器结束时）:
+        None，或出错时的错误结果
+    """
+    parameters = state['parameters']
+    # 'sgd'：在近邻图的边上做负采样SGD；'full'：每次迭代计算所有点对的梯度
+    high_similarity_matrix = state['high_similarity_matrix']
+    optimizer = parameters.get('optimizer', 'sgd' if sparse.issparse(high_similarity_matrix) else 'full')
+    recording_interval = parameters.get('recording_interval', 10)
+    min_dist = parameters.get('min_dist', 0.1)
+    progress = {}
+    try:
+        print("high_similarity_matrix",type(high_similarity_matrix))
+        print("Y",type(state['Y']))
+        # print("high_similarity_matrix的尺寸", high_similarity_matrix.shape)
+        print("Y的尺寸", state['Y'].shape)
+        if optimizer == 'sgd':
+            state['Y'], state['final_Q'] = yield from count_records(umap_sgd_steps(
+                high_similarity_matrix, state['Y'],
+                learning_rate=parameters.get('learning_rate', 1.0),
+                n_epochs=iterations,
+                min_dist=min_dist,
+                negative_sample_rate=parameters.get('negative_sample_rate', 5),
+                recording_interval=recording_interval,
+                random_state=parameters.get('random_state', 42),
+                time_budget_ms=time_budget_ms,
+                progress=progress,
+                dtype=state['Y'].dtype
+            ), state['summary'])
+        else:
+            # 全梯度优化器使用稠密的 n×n 矩阵，稀疏近邻图（例如 sparse=True 的相似度）先展开
+            if sparse.issparse(high_similarity_matrix):
+                high_similarity_matrix = high_similarity_matrix.toarray()
+            state['Y'], state['final_Q'] = yield from count_records(umap_gradient_descent_steps(
+                high_similarity_matrix, state['Y'], state['learning_rate'], iterations, min_dist,
+                recording_interval, state['n_jobs'], time_budget_ms, progress, state['Y'].dtype), state['summary'])
+    except Exception as e:
+        return {"success": False, "message": f"UMAP梯度下降过程中出错: {str(e)}"}
+    state['iteration'] = progress['iterations_run']
+    state['stop_reason'] = progress['stop_reason']
+    return None
+
+
+def finish_optimization(state):
+    """
+    用当前的低维表示创建新节点，并计算最终的低维相似度
+
+    Returns:
+        dict: 与 run_gradient_descent 相同的结果，但不包含 iterations
+    """
+    algorithm, P, Y = state['algorithm'], state['P'], state['Y']
+    approximation, by_ref = state['approximation'], state['by_ref']
+
     # 创建新节点
-    new_node = copy.deepcopy(node_data)
+    new_node = copy.deepcopy(state['node_data'])
     new_node['id'] = str(uuid.uuid4())
     new_node['operation'] = f"{algorithm.upper()} 梯度下降"
-    new_node['parameters'] = parameters
-    new_node['dataset'] = Y.tolist()
+    new_node['parameters'] = state['parameters']
+    assign_array(new_node, 'dataset', Y, by_ref)
     new_node['children'] = []
     new_node['selected'] = False
 
@@ -500,26 +1127,286 @@ def run_gradient_descent(algorithm, parameters, node_data):
 
     # 计算最终的低维相似度
     try:
-        if algorithm != 'umap':
-            final_Q = compute_low_similarity(Y)
+        if algorithm == 'umap':
+            final_Q = state['final_Q']
+        elif approximation == 'fft':
+            # 只在P的非零位置上给出Q，归一化常数同样由插值得到
+            _, z = interpolate_repulsion(Y, state['parameters'].get('n_interpolation_points', 3),
+                                         max_boxes=interpolation_max_boxes(state['parameters']))
+            final_Q = sparse_low_similarity(P, Y, z=z)
+        elif approximation != 'exact':
+            # 只在P的非零位置上给出Q
+            final_Q = sparse_low_similarity(P, Y)
+        elif sparse.issparse(P):
+            # 分块模式：只在P的非零位置上给出Q
+            final_Q = sparse_exact_similarity(algorithm, P, Y, state['workspace'])
+        elif state['iteration_kernel'] is blocked_iteration:
+            # 分块模式的稠密P：逐块写入Q，不产生额外的 n×n 临时矩阵
+            final_Q = blocked_low_similarity(algorithm, Y, state['workspace'])
+        elif algorithm == 'tsne':
+            final_Q = compute_low_dimensional_similarity_tsne(Y)
+        else:
+            final_Q = compute_low_dimensional_similarity_sne(Y)
 
     except Exception as e:
         return {"success": False, "message": f"梯度下降出错点1: {str(e)}"}
     try:
-        new_node['computed']['high_similarity_matrix'] = high_similarity_matrix
-        new_node['computed']['low_similarity_matrix'] = final_Q.tolist()
-        new_node['computed']['final_cost'] = float(iterations_data[len(iterations_data) - 1]['cost'])
-        new_node['computed']['iterations_recorded'] = len(iterations_data)
+        # high_similarity_matrix（或其句柄）已随 deepcopy 保留在新节点中，稀疏矩阵重新编码为CSR
+        if sparse.issparse(new_node['computed'].get('high_similarity_matrix')):
+            new_node['computed']['high_similarity_matrix'] = encode_sparse(new_node['computed']['high_similarity_matrix'])
+        if sparse.issparse(final_Q):
+            new_node['computed'].pop('low_similarity_matrix_ref', None)
+            new_node['computed']['low_similarity_matrix'] = encode_sparse(final_Q)
+        else:
+            assign_array(new_node['computed'], 'low_similarity_matrix', final_Q, by_ref)
+        new_node['computed']['final_cost'] = float(state['summary']['final_cost'])
+        new_node['computed']['iterations_recorded'] = state['summary']['recorded']
+        # 实际执行的迭代次数，提前停止时小于请求的 iterations
+        new_node['computed']['iterations_run'] = state['iteration']
+        new_node['computed']['stop_reason'] = state['stop_reason']
+        if state['best_iteration'] is not None:
+            new_node['computed']['best_iteration'] = state['best_iteration']
     except Exception as e:
         return {"success": False, "message": f"梯度下降出错点2: {str(e)}"}
 
     return {
         "success": True,
         "message": "梯度下降计算成功",
-        "node": new_node,
-        "iterations": iterations_data
+        "node": new_node
+    }
+
+
+def optimization_summary(state):
+    """
+    不创建新节点、不计算最终低维相似度的轻量结果：当前的低维表示、成本、实际迭代次数和停止原因，
+    供会话的 step 和批量运行使用，响应中不再重复 n×n 的P和Q
+    """
+    summary = {
+        'embedding': state['Y'],
+        'final_cost': state['summary']['final_cost'],
+        'iterations_run': state['iteration'],
+        'stop_reason': state['stop_reason']
+    }
+    if state['best_iteration'] is not None:
+        summary['best_iteration'] = state['best_iteration']
+    return summary
+
+
+def gradient_descent_steps(algorithm, parameters, node_data):
+    """
+    执行梯度下降算法的生成器：每到记录间隔立即产出一条迭代记录，不在内存中保留历史
+
+    产出:
+        迭代记录 {'iteration', 'embedding', 'cost', 'gradient_norm'}
+
+    返回（生成器结束时）:
+        dict: 与 run_gradient_descent 相同的结果，但不包含 iterations
+
+    parameters 中的 time_budget_ms 从开始准备时计时，包括解析和归一化P的时间
+    """
+    start = time.perf_counter()
+    state, error = prepare_optimization(algorithm, parameters, node_data)
+    if error is not None:
+        return error
+
+    iterations = parameters.get('iterations', 1000)
+    time_budget_ms = remaining_budget_ms(parameters.get('time_budget_ms'), start)
+    if algorithm == 'umap':
+        error = yield from umap_optimization_steps(state, iterations, time_budget_ms)
+    else:
+        # 梯度下降主循环
+        error = yield from optimization_steps(state, iterations, time_budget_ms)
+    if error is not None:
+        return error
+
+    return finish_optimization(state)
+
+
+def run_gradient_descent(algorithm, parameters, node_data):
+    """
+    执行梯度下降算法，返回结果和全部迭代记录
+    """
+    result, iterations_data = collect_records(gradient_descent_steps(algorithm, parameters, node_data))
+    if result.get("success"):
+        result["iterations"] = iterations_data
+    return result
+
+
+# 批量运行中每一组参数可以单独设置的参数；时间预算由整个批量共享
+BATCH_RUN_PARAMETERS = tuple(key for key in LOOP_PARAMETERS if key != 'time_budget_ms') \
+    + UMAP_LOOP_PARAMETERS + ('iterations',)
+
+
+def fork_state(state, parameters, embedding=None):
+    """
+    以同一个准备好的状态为基础创建一次独立的运行：P、工作区和节点数据共用，
+    低维表示、动量项、自适应步长、学习率和迭代进度各自独立
+
+    Args:
+        state: prepare_optimization 返回的状态，不会被修改
+        parameters: 这次运行的完整参数
+        embedding: 可选的初始低维表示，默认使用 state 中的初始低维表示
+    """
+    Y = np.array(state['Y'] if embedding is None else embedding, dtype=state['Y'].dtype)
+    run = dict(state)
+    run.update(parameters=parameters, Y=Y, Y_prev=Y.copy(), Y_incs=np.zeros_like(Y), gains=np.ones_like(Y),
+               learning_rate=initial_learning_rate(parameters, Y.shape[0]), iteration=0,
+               summary={'recorded': 0, 'final_cost': None}, stop_reason=None, best_iteration=None, final_Q=None)
+    return run
+
+
+def run_gradient_descent_batch(algorithm, parameters, node_data, runs, select=None):
+    """
+    在同一个P上依次运行多组参数，P的解析、归一化和工作区只准备一次
+
+    精确模式下各次运行轮流使用同一组 n×n 缓冲区，内存占用与单次运行相同。
+    parameters 中的 time_budget_ms 是整个批量的时间预算，每次运行使用剩余预算的平均份额。
+    每次运行只返回轻量结果，新节点（含最终的低维相似度）只为选中的一次运行创建一次，
+    响应大小不随运行次数成倍增长。
+
+    Args:
+        algorithm: 算法名称
+        parameters: 所有运行共用的参数
+        node_data: 节点数据
+        runs: [{'parameters': {...}, 'embedding': 可选的初始低维表示}, ...]，
+              parameters 只能包含 BATCH_RUN_PARAMETERS 中的参数
+        select: 用来创建新节点的运行序号，默认为成功的运行中最终成本最低的一次
+
+    Returns:
+        dict: {'success', 'message', 'runs', 'selected', 'node'}。runs 中每一项为
+              {'success', 'parameters', 'embedding', 'iterations', 'final_cost', 'iterations_run', 'stop_reason'}，
+              失败的运行为错误信息；node 与 run_gradient_descent 返回的新节点相同，没有成功的运行时不包含
+    """
+    start = time.perf_counter()
+    if not isinstance(runs, list) or not runs:
+        return {"success": False, "message": "缺少运行参数列表"}
+    if len(runs) > GRADIENT_BATCH_MAX_RUNS:
+        return {"success": False, "message": f"一次最多运行 {GRADIENT_BATCH_MAX_RUNS} 组参数"}
+    if select is not None and (not isinstance(select, int) or not 0 <= select < len(runs)):
+        return {"success": False, "message": f"选中的运行序号无效: {select}"}
+
+    run_parameters = []
+    for index, run in enumerate(runs):
+        overrides = (run or {}).get('parameters') or {}
+        unsupported = [key for key in overrides if key not in BATCH_RUN_PARAMETERS]
+        if unsupported:
+            return {"success": False, "message": f"第{index + 1}组参数中不能单独设置: {', '.join(unsupported)}"}
+        if overrides.get('schedule', 'fixed') not in SCHEDULES:
+            return {"success": False, "message": f"不支持的优化策略: {overrides['schedule']}"}
+        run_parameters.append({**parameters, **overrides})
+
+    state, error = prepare_optimization(algorithm, parameters, node_data)
+    if error is not None:
+        return error
+
+    for index, run in enumerate(runs):
+        embedding = (run or {}).get('embedding')
+        if embedding is not None and np.shape(embedding) != state['Y'].shape:
+            return {"success": False,
+                    "message": f"第{index + 1}组的初始低维表示形状 {np.shape(embedding)} 与数据集 {state['Y'].shape} 不一致"}
+
+    results, run_states = [], []
+    for index, (run, run_params) in enumerate(zip(runs, run_parameters)):
+        run_state = fork_state(state, run_params, (run or {}).get('embedding'))
+        time_budget_ms = remaining_budget_ms(parameters.get('time_budget_ms'), start)
+        if time_budget_ms is not None:
+            time_budget_ms /= len(runs) - index
+
+        if algorithm == 'umap':
+            steps = umap_optimization_steps(run_state, run_params.get('iterations', 1000), time_budget_ms)
+        else:
+            steps = optimization_steps(run_state, run_params.get('iterations', 1000), time_budget_ms)
+        error, iterations_data = collect_records(steps)
+
+        if error is not None:
+            result = error
+        else:
+            result = {"success": True, **optimization_summary(run_state), "iterations": iterations_data}
+        result["parameters"] = (run or {}).get('parameters') or {}
+        results.append(result)
+        run_states.append(run_state)
+
+    batch = {"success": True, "message": "批量梯度下降计算完成", "runs": results}
+    succeeded = [index for index, result in enumerate(results) if result.get("success")]
+    if select is None and succeeded:
+        cost = lambda index: np.inf if results[index]['final_cost'] is None else results[index]['final_cost']
+        select = min(succeeded, key=cost)
+    if select is not None:
+        if not results[select].get("success"):
+            return {**batch, "success": False, "message": f"选中的第{select + 1}组运行失败: {results[select].get('message')}"}
+        finished = finish_optimization(run_states[select])
+        if not finished.get("success"):
+            return {**batch, "success": False, "message": finished.get("message")}
+        batch.update(selected=select, node=finished["node"])
+    return batch
+
+
+def gradient_descent_events(algorithm, parameters, node_data):
+    """
+    流式接口的事件：start（开始计算前立即发送）、每条迭代记录一个 iteration、最后一个 result
+    """
+    yield 'start', {
+        'algorithm': algorithm,
+        'iterations': parameters.get('iterations', 1000),
+        'recording_interval': parameters.get('recording_interval', 10)
     }
 
+    steps = gradient_descent_steps(algorithm, parameters, node_data)
+    try:
+        while True:
+            try:
+                record = next(steps)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            yield 'iteration', record
+    except Exception as e:
+        result = {"success": False, "message": f"梯度下降过程中出错: {str(e)}"}
+    finally:
+        steps.close()
+
+    yield 'result', result
+
+
+def parse_gradient_request(*extra_keys):
+    """
+    解析梯度下降请求
+
+    Args:
+        extra_keys: 需要一并取出的其他字段，例如批量接口的 'runs'
+
+    Returns:
+        tuple: ((algorithm, parameters, node_data, *extra), None) 或 (None, 错误响应)
+
+    数组字段直接按参数中的 dtype 转换，float32 时不会先生成一份float64的副本
+    """
+    try:
+        data = get_request_data()
+    except RequestFormatError as e:
+        return None, respond({"success": False, "message": str(e)}, 400)
+
+    algorithm = data.get('algorithm')
+    parameters = data.get('parameters', {})
+    node_data = data.get('node')
+
+    # 不支持的精度（ValueError）和形状不正确的数组（RequestFormatError）都是请求错误
+    try:
+        dtype = resolve_dtype(parameters.get('dtype'))
+        coerce_arrays(data, {
+            'node.dataset': 'matrix',
+            'node.computed.high_similarity_matrix': 'graph'
+        }, dtype)
+    except ValueError as e:
+        return None, respond({"success": False, "message": str(e)}, 400)
+
+    if not algorithm:
+        return None, respond({"success": False, "message": "缺少算法参数"}, 400)
+
+    if not node_data:
+        return None, respond({"success": False, "message": "缺少节点数据"}, 400)
+
+    return (algorithm, parameters, node_data) + tuple(data.get(key) for key in extra_keys), None
+
 
 @gradient_api.route('/api/gradient_descent', methods=['POST'])
 def gradient_descent_endpoint():
@@ -527,24 +1414,52 @@ def gradient_descent_endpoint():
     梯度下降API端点
     """
     try:
-        data = request.get_json()
+        args, error = parse_gradient_request()
+        if error is not None:
+            return error
+
+        # 运行梯度下降
+        result = run_gradient_descent(*args)
 
-        algorithm = data.get('algorithm')
-        parameters = data.get('parameters', {})
-        node_data = data.get('node')
+        return respond(result)
 
-        if not algorithm:
-            return jsonify({"success": False, "message": "缺少算法参数"}), 400
+    except Exception as e:
+        # app.logger.error(f"梯度下降计算错误: {str(e)}")
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
 
-        if not node_data:
-            return jsonify({"success": False, "message": "缺少节点数据"}), 400
 
-        # 运行梯度下降
-        result = run_gradient_descent(algorithm, parameters, node_data)
+@gradient_api.route('/api/gradient_descent/batch', methods=['POST'])
+def gradient_descent_batch_endpoint():
+    """
+    批量梯度下降API端点：请求与 /api/gradient_descent 相同，另含 runs 列表，
+    每一项为 {'parameters': 覆盖的参数, 'embedding': 可选的初始低维表示}，
+    以及可选的 select（用来创建新节点的运行序号）
+    """
+    try:
+        args, error = parse_gradient_request('runs', 'select')
+        if error is not None:
+            return error
 
-        return jsonify(result)
+        return respond(run_gradient_descent_batch(*args))
 
     except Exception as e:
-        # app.logger.error(f"梯度下降计算错误: {str(e)}")
-        return jsonify({"success": False, "message": f"处理请求时出错: {str(e)}"}), 500
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
 
+@gradient_api.route('/api/gradient_descent/stream', methods=['POST'])
+def gradient_descent_stream_endpoint():
+    """
+    梯度下降API端点的流式版本，请求与 /api/gradient_descent 相同
+
+    以 Server-Sent Events 返回：每条迭代记录计算出来后立即作为 iteration 事件发送，服务端不保留历史；
+    最后的 result 事件与非流式接口的结果相同，但不包含 iterations。客户端断开连接后计算随即停止。
+    """
+    try:
+        args, error = parse_gradient_request()
+        if error is not None:
+            return error
+
+        return respond_stream(gradient_descent_events(*args), scopes=('iteration',))
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
@@ -0,0 +1,324 @@
+from flask import Blueprint
+import numpy as np
+import time
+from scipy import sparse
+
+from node_operations.gradient_descent import (SCHEDULES, LOOP_PARAMETERS, prepare_optimization, optimization_steps,
+                                              finish_optimization, optimization_summary, collect_records,
+                                              parse_gradient_request, check_time_budget, remaining_budget_ms)
+from utils.arrayTransport import get_request_data, respond, extract_arrays, insert_at_path, RequestFormatError
+from utils.matrixCodec import encode_sparse, expand_payload
+from utils.sessionStore import (SessionStore, SessionNotFoundError, new_session_id, valid_session_id,
+                                has_checkpoint, save_checkpoint, load_checkpoint, delete_checkpoint)
+
+gradient_session_api = Blueprint('gradient_session_api', __name__)
+
+# 进程内的会话表
+sessions = SessionStore()
+
+# 会话支持的算法：UMAP的优化器每次都从头构造，没有可以接续的状态
+SESSION_ALGORITHMS = ('tsne', 'sne')
+
+# step 请求可以修改的参数，其余参数决定了P和工作区，修改后需要新建会话
+STEP_PARAMETERS = LOOP_PARAMETERS
+
+
+def _encode_sparse_fields(value):
+    """把结构中的稀疏矩阵编码为 csr 字典，便于写入检查点"""
+    if sparse.issparse(value):
+        return encode_sparse(value)
+    if isinstance(value, dict):
+        return {k: _encode_sparse_fields(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode_sparse_fields(v) for v in value]
+    return value
+
+
+def session_summary(session_id, state):
+    return {
+        "success": True,
+        "session_id": session_id,
+        "algorithm": state['algorithm'],
+        "iteration": state['iteration'],
+        "n_samples": state['Y'].shape[0],
+        "learning_rate": state['learning_rate'],
+        "final_cost": state['summary']['final_cost'],
+        "ttl_seconds": sessions.ttl_seconds
+    }
+
+
+def write_checkpoint(session_id, state):
+    """
+    把会话写入检查点：Y、Y_prev、Y_incs 以及节点中的数组存入 arrays.npz，其余存入 meta.json。
+    P 不写入检查点，恢复时从节点数据重新计算
+    """
+    meta = {
+        'algorithm': state['algorithm'],
+        'parameters': state['parameters'],
+        'node_data': _encode_sparse_fields(state['node_data']),
+        'learning_rate': state['learning_rate'],
+        'iteration': state['iteration'],
+        'summary': state['summary'],
+        'Y': state['Y'],
+        'Y_prev': state['Y_prev'],
+        'Y_incs': state['Y_incs'],
+        'gains': state['gains']
+    }
+    meta, arrays = extract_arrays(meta)
+    save_checkpoint(session_id, dict(arrays), meta)
+
+
+def restore_checkpoint(session_id):
+    """
+    从检查点恢复会话状态
+
+    Returns:
+        tuple: (优化状态, None) 或 (None, 错误结果)
+
+    Raises:
+        SessionNotFoundError: 没有该会话的检查点
+    """
+    arrays, meta = load_checkpoint(session_id)
+    for path, array in arrays.items():
+        insert_at_path(meta, path, array)
+    meta = expand_payload(meta)
+
+    state, error = prepare_optimization(meta['algorithm'], meta['parameters'], meta['node_data'])
+    if error is not None:
+        return None, error
+    state.update(Y=meta['Y'], Y_prev=meta['Y_prev'], Y_incs=meta['Y_incs'], gains=meta['gains'],
+                 learning_rate=meta['learning_rate'], iteration=meta['iteration'], summary=meta['summary'])
+    return state, None
+
+
+def get_session(session_id):
+    """
+    取出会话；内存中已被清除但有检查点时自动恢复
+
+    Returns:
+        tuple: (会话, None) 或 (None, 错误响应)
+    """
+    if not valid_session_id(session_id):
+        return None, respond({"success": False, "message": f"无效的会话id: {session_id}"}, 400)
+
+    session = sessions.get(session_id)
+    if session is not None:
+        return session, None
+
+    try:
+        state, error = restore_checkpoint(session_id)
+    except SessionNotFoundError as e:
+        return None, respond({"success": False, "message": str(e.args[0])}, 404)
+    if error is not None:
+        return None, respond(error, 400)
+    return sessions.put(session_id, state), None
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions', methods=['POST'])
+def create_session_endpoint():
+    """
+    创建优化会话，请求与 /api/gradient_descent 相同。只完成准备工作（解析、归一化P，初始化Y），
+    迭代由 step 请求执行
+    """
+    try:
+        args, error = parse_gradient_request()
+        if error is not None:
+            return error
+
+        algorithm = args[0]
+        if algorithm not in SESSION_ALGORITHMS:
+            return respond({"success": False, "message": f"会话不支持算法: {algorithm}"}, 400)
+
+        state, error = prepare_optimization(*args)
+        if error is not None:
+            return respond(error, 400)
+
+        session_id = new_session_id()
+        sessions.put(session_id, state)
+        return respond(session_summary(session_id, state))
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions/<session_id>/step', methods=['POST'])
+def step_session_endpoint(session_id):
+    """
+    在会话上继续迭代
+
+    请求体:
+        iterations: 本次迭代次数，默认 recording_interval
+        embedding: 可选，替换当前的低维表示（例如用户拖动了部分点），动量项随之清零
+        parameters: 可选，修改 STEP_PARAMETERS 中的参数
+        finish: 为 true 时返回与 /api/gradient_descent 相同的完整结果（新节点和最终的低维相似度）
+
+    默认只返回本次的迭代记录、当前的低维表示 embedding、final_cost、iterations_run、stop_reason，
+    以及 session_id 和下一次迭代的序号 iteration，响应大小与P无关；迭代序号接续之前的迭代。
+    参数中的 time_budget_ms 对每次 step 请求单独计时
+    """
+    start = time.perf_counter()
+    try:
+        data = get_request_data({'embedding': 'matrix'}) or {}
+
+        session, error = get_session(session_id)
+        if error is not None:
+            return error
+
+        if not session.lock.acquire(blocking=False):
+            return respond({"success": False, "message": "会话正在计算中，请稍后再试"}, 409)
+        try:
+            state = session.state
+
+            updates = data.get('parameters') or {}
+            unsupported = [key for key in updates if key not in STEP_PARAMETERS]
+            if unsupported:
+                return respond({"success": False,
+                                "message": f"会话中不能修改参数: {', '.join(unsupported)}，请新建会话"}, 400)
+            if updates.get('schedule', 'fixed') not in SCHEDULES:
+                return respond({"success": False, "message": f"不支持的优化策略: {updates['schedule']}"}, 400)
+            if not isinstance(updates.get('learning_rate', 0), (int, float)):
+                return respond({"success": False, "message": "会话中的学习率需要为数值"}, 400)
+            error = check_time_budget(updates.get('time_budget_ms'))
+            if error is not None:
+                return respond(error, 400)
+
+            try:
+                iterations = int(data.get('iterations', {**state['parameters'], **updates}.get('recording_interval', 10)))
+            except (TypeError, ValueError):
+                return respond({"success": False, "message": "迭代次数必须为正整数"}, 400)
+            if iterations < 1:
+                return respond({"success": False, "message": "迭代次数必须为正整数"}, 400)
+
+            embedding = data.get('embedding')
+            if embedding is not None:
+                embedding = np.asarray(embedding, dtype=state['Y'].dtype)
+                if embedding.shape != state['Y'].shape:
+                    return respond({"success": False,
+                                    "message": f"低维表示的形状 {embedding.shape} 与会话中的 {state['Y'].shape} 不一致"}, 400)
+                if not np.isfinite(embedding).all():
+                    return respond({"success": False, "message": "低维表示中包含NaN或Inf"}, 400)
+                state.update(Y=embedding.copy(), Y_prev=embedding.copy(), Y_incs=np.zeros_like(embedding),
+                             gains=np.ones_like(embedding))
+
+            if updates:
+                state['parameters'] = {**state['parameters'], **updates}
+                if 'learning_rate' in updates:
+                    state['learning_rate'] = updates['learning_rate']
+
+            time_budget_ms = remaining_budget_ms(state['parameters'].get('time_budget_ms'), start)
+            error, iterations_data = collect_records(optimization_steps(state, iterations, time_budget_ms))
+            if error is not None:
+                return respond(error)
+
+            if data.get('finish'):
+                result = finish_optimization(state)
+            else:
+                result = {"success": True, "message": "梯度下降计算成功", **optimization_summary(state)}
+            if result.get("success"):
+                result["iterations"] = iterations_data
+                result["session_id"] = session_id
+                result["iteration"] = state['iteration']
+            return respond(result)
+        finally:
+            session.lock.release()
+            sessions.touch(session)
+
+    except RequestFormatError as e:
+        return respond({"success": False, "message": str(e)}, 400)
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions/<session_id>/result', methods=['POST'])
+def session_result_endpoint(session_id):
+    """用会话当前的低维表示创建新节点并计算最终的低维相似度，结果与 /api/gradient_descent 相同但不包含 iterations"""
+    try:
+        session, error = get_session(session_id)
+        if error is not None:
+            return error
+
+        if not session.lock.acquire(blocking=False):
+            return respond({"success": False, "message": "会话正在计算中，请稍后再试"}, 409)
+        try:
+            result = finish_optimization(session.state)
+            if result.get("success"):
+                result["session_id"] = session_id
+                result["iteration"] = session.state['iteration']
+            return respond(result)
+        finally:
+            session.lock.release()
+            sessions.touch(session)
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions/<session_id>/checkpoint', methods=['POST'])
+def checkpoint_session_endpoint(session_id):
+    """把会话写入磁盘，会话被清除或服务重启后可以通过 resume 或 step 继续"""
+    try:
+        session, error = get_session(session_id)
+        if error is not None:
+            return error
+
+        with session.lock:
+            write_checkpoint(session_id, session.state)
+            summary = session_summary(session_id, session.state)
+        summary["checkpointed"] = True
+        return respond(summary)
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions/<session_id>/resume', methods=['POST'])
+def resume_session_endpoint(session_id):
+    """从检查点恢复会话（会话仍在内存中时直接返回），返回会话概况"""
+    try:
+        session, error = get_session(session_id)
+        if error is not None:
+            return error
+        return respond(session_summary(session_id, session.state))
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions/<session_id>', methods=['GET'])
+def get_session_endpoint(session_id):
+    """会话概况；不在内存中时只报告是否有检查点，不恢复会话"""
+    try:
+        if not valid_session_id(session_id):
+            return respond({"success": False, "message": f"无效的会话id: {session_id}"}, 400)
+
+        session = sessions.get(session_id)
+        checkpointed = has_checkpoint(session_id)
+        if session is None:
+            if not checkpointed:
+                return respond({"success": False, "message": f"会话不存在或已过期: {session_id}"}, 404)
+            return respond({"success": True, "session_id": session_id, "in_memory": False, "checkpointed": True})
+
+        summary = session_summary(session_id, session.state)
+        summary.update(in_memory=True, checkpointed=checkpointed)
+        return respond(summary)
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
+
+
+@gradient_session_api.route('/api/gradient_descent/sessions/<session_id>', methods=['DELETE'])
+def delete_session_endpoint(session_id):
+    """删除会话及其检查点"""
+    try:
+        if not valid_session_id(session_id):
+            return respond({"success": False, "message": f"无效的会话id: {session_id}"}, 400)
+
+        found = sessions.pop(session_id) is not None or has_checkpoint(session_id)
+        delete_checkpoint(session_id)
+        if not found:
+            return respond({"success": False, "message": f"会话不存在或已过期: {session_id}"}, 404)
+        return respond({"success": True, "message": "会话已删除", "session_id": session_id})
+
+    except Exception as e:
+        return respond({"success": False, "message": f"处理请求时出错: {str(e)}"}, 500)
@@ -8,7 +8,8 @@ import traceback
 from scipy import stats
 
 
-from utils.jsonProcess import make_json_safe
+from utils.arrayTransport import get_request_data, respond, RequestFormatError
+from utils.arrayStore import resolve_array, assign_array, uses_refs, has_array
 
 preprocess_api = Blueprint('preprocess_api', __name__)
 
@@ -19,34 +20,34 @@ def preprocess_data():
     """
     try:
         # 获取请求数据
-        request_data = request.json
+        request_data = get_request_data({'nodeData.dataset': 'table'})
 
         if not request_data or 'nodeData' not in request_data or 'options' not in request_data:
-            return jsonify(make_json_safe({
+            return respond({
                 'success': False,
                 'error': '请求格式不正确，缺少必要参数'
-            })), 400
+            }, 400)
 
         # 获取节点数据和预处理选项
         node_data = request_data['nodeData']
         options = request_data['options']
 
         # 验证节点数据格式
-        if 'dataset' not in node_data:
-            return jsonify(make_json_safe({
+        if not has_array(node_data, 'dataset'):
+            return respond({
                 'success': False,
                 'error': '节点数据格式不正确，缺少dataset字段'
-            })), 400
+            }, 400)
 
         # 将原始数据转换为Pandas DataFrame以便处理
         try:
-            df = pd.DataFrame(node_data['dataset'])
+            df = pd.DataFrame(resolve_array(node_data, 'dataset'))
             target = np.array(node_data['target']) if 'target' in node_data else None
         except Exception as e:
-            return jsonify(make_json_safe({
+            return respond({
                 'success': False,
                 'error': f'数据格式转换错误: {str(e)}'
-            })), 400
+            }, 400)
 
         # 创建新节点（复制原始节点的基本结构）
         new_node = node_data.copy()
@@ -62,22 +63,28 @@ def preprocess_data():
 
         # 如果处理失败
         if not processing_info['success']:
-            return jsonify(make_json_safe({
+            return respond({
                 'success': False,
                 'error': processing_info['error']
-            })), 400
+            }, 400)
 
         # 更新节点数据
-        new_node['dataset'] = df_processed.values.tolist()
+        assign_array(new_node, 'dataset', df_processed.values, uses_refs(node_data))
         if target_processed is not None:
             new_node['target'] = target_processed.tolist()
 
         # 返回成功响应
-        return jsonify(make_json_safe({
+        return respond({
             'success': True,
             'node': new_node,
             'processing_info': processing_info
-        }))
+        })
+
+    except RequestFormatError as e:
+        return respond({
+            'success': False,
+            'error': str(e)
+        }, 400)
 
     except Exception as e:
         # 记录异常堆栈
@@ -85,10 +92,10 @@ def preprocess_data():
         print(error_traceback)
 
         # 返回错误响应
-        return jsonify(make_json_safe({
+        return respond({
             'success': False,
             'error': f'处理请求时发生错误: {str(e)}'
-        })), 500
+        }, 500)
 
 
 def apply_preprocessing(df, target, options):
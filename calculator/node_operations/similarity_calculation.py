@@ -1,31 +1,49 @@
-from flask import request, jsonify, Blueprint
+from flask import Blueprint
 import numpy as np
+import os
 import uuid
-import math
+from scipy import sparse
 from scipy.spatial.distance import pdist, squareform
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.neighbors import NearestNeighbors
 from umap.umap_ import fuzzy_simplicial_set, nearest_neighbors
 
+from utils.arrayStore import resolve_array, assign_array, uses_refs
+from utils.arrayTransport import get_request_data, respond, coerce_arrays, RequestFormatError
+from utils.computeDtype import resolve_dtype
+from utils.matrixCodec import encode_sparse
+
 calculate_similarity_api = Blueprint('calculate_similarity_api', __name__)
 
+# 困惑度校准时每块的行数，每块需要若干个 block × n 的float64工作区
+PERPLEXITY_BLOCK_ROWS = int(os.environ.get('PERPLEXITY_BLOCK_ROWS', '512'))
+
+# 稀疏模式下样本数少于此值时精确查找近邻（KD树/球树），否则使用umap-learn的NN-descent
+EXACT_KNN_MAX_SAMPLES = int(os.environ.get('EXACT_KNN_MAX_SAMPLES', '4096'))
+
 
 @calculate_similarity_api.route('/calculate-similarity', methods=['POST'])
 def calculate_similarity():
     try:
         # 获取请求数据
-        data = request.json
+        data = get_request_data()
         source_node = data.get('source_node')
         formula = data.get('formula')
         parameters = data.get('parameters', {})
         similarity_type = data.get('similarityType', 'high')
 
+        # 数据集直接按计算精度转换
+        dtype = resolve_dtype(parameters.get('dtype'))
+        coerce_arrays(data, {'source_node.dataset': 'matrix'}, dtype)
+
         # 验证输入数据
         if not source_node or not formula:
-            return jsonify({'success': False, 'message': '缺少必要的参数'})
+            return respond({'success': False, 'message': '缺少必要的参数'})
 
         # 获取数据集
-        dataset = source_node.get('dataset', [])
-        if not dataset or len(dataset) == 0:
-            return jsonify({'success': False, 'message': '数据集为空'})
+        dataset = resolve_array(source_node, 'dataset', [])
+        if len(dataset) == 0:
+            return respond({'success': False, 'message': '数据集为空'})
 
         # 确保源节点有computed和parameters字段
         if 'computed' not in source_node:
@@ -34,7 +52,7 @@ def calculate_similarity():
             source_node['parameters'] = {}
 
         # 将数据集转换为numpy数组
-        data_array = np.array(dataset)
+        data_array = np.asarray(dataset)
 
         # 创建新节点
         new_node = source_node.copy()
@@ -47,40 +65,56 @@ def calculate_similarity():
         # 根据选择的公式计算相似度矩阵
         if similarity_type == 'high':
             # 高维相似度计算
-            similarity_matrix = compute_high_dimensional_similarity(data_array, formula, parameters)
-            new_node["computed"]["high_similarity_matrix"] = similarity_matrix.tolist()
+            diagnostics = {}
+            similarity_matrix = compute_high_dimensional_similarity(data_array, formula, parameters, diagnostics)
+            if sparse.issparse(similarity_matrix):
+                new_node["computed"]["high_similarity_matrix"] = encode_sparse(similarity_matrix)
+            else:
+                assign_array(new_node["computed"], "high_similarity_matrix", similarity_matrix, uses_refs(source_node))
+            if 'sigmas' in diagnostics:
+                # 按困惑度校准得到的每个点的高斯核宽度
+                assign_array(new_node["computed"], "sigmas", diagnostics['sigmas'], uses_refs(source_node))
             # new_node["computed"]["similarity_matrix"] = similarity_matrix.tolist()  # 向后兼容
         else:
             # 低维相似度计算
             similarity_matrix = compute_low_dimensional_similarity(data_array, formula, parameters)
-            new_node["computed"]["low_similarity_matrix"] = similarity_matrix.tolist()
+            assign_array(new_node["computed"], "low_similarity_matrix", similarity_matrix, uses_refs(source_node))
             # new_node["computed"]["similarity_matrix"] = similarity_matrix.tolist()  # 向后兼容
 
-        return jsonify({
+        return respond({
             'success': True,
             'message': '相似度矩阵计算成功',
             'node': new_node
         })
 
+    except RequestFormatError as e:
+        return respond({
+            'success': False,
+            'message': str(e)
+        }, 400)
+
     except Exception as e:
-        return jsonify({
+        return respond({
             'success': False,
             'message': f'计算过程中出错: {str(e)}'
         })
 
 
-def compute_high_dimensional_similarity(data, formula, parameters):
+def compute_high_dimensional_similarity(data, formula, parameters, diagnostics=None):
     """
     计算高维空间中的相似度矩阵
 
     参数:
     - data: numpy数组形式的数据集
     - formula: 计算公式名称
-    - parameters: 计算参数
+    - parameters: 计算参数，其中 dtype（默认为 COMPUTE_DTYPE）为结果的数值类型
+    - diagnostics: 可选的dict，gaussian 和 symmetric_sne 时写入每个点的高斯核宽度 sigmas
 
     返回:
     - similarity_matrix: 相似度矩阵
     """
+    dtype = resolve_dtype(parameters.get('dtype'))
+    data = np.asarray(data, dtype=dtype)
     n_samples = data.shape[0]
 
     if formula == 'euclidean':
@@ -88,7 +122,7 @@ def compute_high_dimensional_similarity(data, formula, parameters):
         sigma = parameters.get('sigma', 1.0)
 
         # 使用scipy计算欧氏距离矩阵
-        distances = squareform(pdist(data, 'euclidean'))
+        distances = squareform(pdist(data, 'euclidean').astype(dtype, copy=False))
 
         # 转换为相似度
         similarity_matrix = np.exp(-(distances ** 2) / (2 * (sigma ** 2)))
@@ -108,29 +142,31 @@ def compute_high_dimensional_similarity(data, formula, parameters):
         # 高斯相似度 (条件概率 p_j|i)
         perplexity = parameters.get('perplexity', 30)
 
-        # 使用scipy计算欧氏距离矩阵
-        distances = squareform(pdist(data, 'euclidean'))
-
-        # 初始化相似度矩阵
-        similarity_matrix = np.zeros((n_samples, n_samples))
-
-        # 为每个点找到合适的sigma_i，使得perplexity达到目标值
-        for i in range(n_samples):
-            similarity_matrix[i, :] = compute_gaussian_kernel_row(distances[i, :], i, perplexity)
+        # 为每个点找到合适的sigma_i，使得perplexity达到目标值；sparse=True 时只在近邻上计算，返回CSR
+        if parameters.get('sparse', False):
+            similarity_matrix, sigmas = knn_gaussian_probabilities(data, perplexity, dtype)
+        else:
+            similarity_matrix, sigmas = gaussian_conditional_probabilities(data, perplexity, dtype)
+        if diagnostics is not None:
+            diagnostics['sigmas'] = sigmas
 
     elif formula == 'symmetric_sne':
         # 对称SNE相似度
         perplexity = parameters.get('perplexity', 30)
 
-        # 首先计算条件概率 p_j|i
-        distances = squareform(pdist(data, 'euclidean'))
-        conditional_probs = np.zeros((n_samples, n_samples))
-
-        for i in range(n_samples):
-            conditional_probs[i, :] = compute_gaussian_kernel_row(distances[i, :], i, perplexity)
+        # 首先计算条件概率 p_j|i；sparse=True 时只在 3·perplexity 个近邻上计算，内存为 O(n·k)
+        if parameters.get('sparse', False):
+            conditional_probs, sigmas = knn_gaussian_probabilities(data, perplexity, dtype)
+        else:
+            conditional_probs, sigmas = gaussian_conditional_probabilities(data, perplexity, dtype)
+        if diagnostics is not None:
+            diagnostics['sigmas'] = sigmas
 
-        # 对称化: p_ij = (p_j|i + p_i|j) / (2n)
+        # 对称化: p_ij = (p_j|i + p_i|j) / (2n)，稀疏矩阵对称化后仍为CSR
         similarity_matrix = (conditional_probs + conditional_probs.T) / (2 * n_samples)
+        if sparse.issparse(similarity_matrix):
+            similarity_matrix = similarity_matrix.tocsr()
+            similarity_matrix.sort_indices()
 
 
     elif formula == 'umap_high_similarity':
@@ -139,14 +175,16 @@ def compute_high_dimensional_similarity(data, formula, parameters):
         n_neighbors = int(parameters.get('n_neighbors', 15))
         min_dist = parameters.get('min_dist', 0.1)
 
-        similarity_matrix = get_umap_similarity_matrix(data,n_neighbors)
+        # sparse=True 时保留近邻图的稀疏结构，供UMAP的负采样SGD直接使用
+        similarity_matrix = get_umap_similarity_matrix(data, n_neighbors,
+                                                       return_sparse=bool(parameters.get('sparse', False)))
 
     else:
         raise ValueError(f"未知的高维相似度计算公式: {formula}")
 
     return similarity_matrix
 
-def get_umap_similarity_matrix(data, n_neighbors=15, metric='euclidean', random_state=42):
+def get_umap_similarity_matrix(data, n_neighbors=15, metric='euclidean', random_state=42, return_sparse=False):
     """
     计算UMAP高维相似度矩阵
 
@@ -154,6 +192,7 @@ def get_umap_similarity_matrix(data, n_neighbors=15, metric='euclidean', random_
     data: 输入数据，形状为 (n_samples, n_features)
     n_neighbors: 近邻数
     metric: 距离度量方式
+    return_sparse: 为True时直接返回CSR格式的模糊单纯集（每行约k个非零元素）
 
     返回:
     similarity_matrix: UMAP高维相似度矩阵
@@ -180,6 +219,9 @@ def get_umap_similarity_matrix(data, n_neighbors=15, metric='euclidean', random_
         local_connectivity=1.0
     )
 
+    if return_sparse:
+        return fuzzy_simp_set.tocsr()
+
     # 转换为密集矩阵
     similarity_matrix = fuzzy_simp_set.toarray()
 
@@ -256,79 +298,144 @@ def compute_low_dimensional_similarity(data, formula, parameters):
 
     return similarity_matrix
 
-def compute_gaussian_kernel_row(dist_row, i, perplexity):
+def calibrate_perplexity(sq_distances, perplexity, exclude=None, tolerance=1e-5, max_iterations=100):
     """
-    为单个点计算高斯核（条件概率p_j|i）
-    使用二分搜索找到合适的sigma，使得概率分布的困惑度接近目标值
+    对一块行同时二分搜索 beta = 1/(2σ²)，使每行的条件概率 p_j|i ∝ exp(-beta_i d_ij²) 的困惑度接近目标值
+
+    熵以自然对数计算，与 log(perplexity) 比较。每行先减去最小的距离再取指数，
+    最近的点的权重为1，求和不会下溢；熵为 H = log Σ_j e_j + beta Σ_j p_j d_j。
 
     参数:
-    - dist_row: 点i到所有其他点的距离
-    - i: 当前点的索引
+    - sq_distances: 平方距离 (rows, m)，作为工作区被修改
     - perplexity: 目标困惑度
+    - exclude: 可选，每行需要排除的列（自身），长度为 rows
+    - tolerance: 熵的容差
+    - max_iterations: 二分搜索的最大步数
 
     返回:
-    - prob_row: 条件概率p_j|i
+    - probs: 条件概率 (rows, m)，float64，排除的位置为0
+    - beta: 每行的 beta
     """
-    n = len(dist_row)
-    tolerance = 1e-5
+    n_rows = sq_distances.shape[0]
+    rows = np.arange(n_rows)
+    if exclude is not None:
+        sq_distances[rows, exclude] = np.inf
+    sq_distances -= sq_distances.min(axis=1, keepdims=True)
+    if exclude is not None:
+        sq_distances[rows, exclude] = 0.0
+
+    # 初始值按每行距离的尺度选取，省去从 beta = 1 开始逐次加倍/减半的步数
     log_perp = np.log(perplexity)
+    scale = sq_distances.sum(axis=1) / max(sq_distances.shape[1] - 1, 1)
+    beta = 1.0 / np.where(scale > 0, scale, 1.0)
+    beta_min = np.zeros(n_rows)
+    beta_max = np.full(n_rows, np.inf)
+    probs = np.empty_like(sq_distances)
+    active = np.ones(n_rows, dtype=bool)
 
-    # 初始化结果向量
-    prob_row = np.zeros(n)
+    for _ in range(max_iterations):
+        np.multiply(sq_distances, -beta[:, None], out=probs)
+        np.exp(probs, out=probs)
+        if exclude is not None:
+            probs[rows, exclude] = 0.0
+        sum_exp = probs.sum(axis=1)
+        probs /= sum_exp[:, None]
+        entropy = np.log(sum_exp) + beta * np.einsum('ij,ij->i', probs, sq_distances)
+
+        # 已收敛的行保持不变
+        entropy_diff = entropy - log_perp
+        active &= np.abs(entropy_diff) >= tolerance
+        if not active.any():
+            break
 
-    # 排除自身
-    indices = np.arange(n) != i
+        # 熵太高时增大beta（上界未知时加倍），太低时减小beta
+        increase = active & (entropy_diff > 0)
+        decrease = active & ~increase
+        beta_min[increase] = beta[increase]
+        beta[increase] = np.where(np.isinf(beta_max[increase]), beta[increase] * 2.0,
+                                  (beta[increase] + beta_max[increase]) / 2.0)
+        beta_max[decrease] = beta[decrease]
+        beta[decrease] = (beta[decrease] + beta_min[decrease]) / 2.0
 
-    # 设置搜索范围
-    beta_min = -np.inf
-    beta_max = np.inf
-    beta = 1.0  # 初始值，beta = 1/(2*sigma^2)
+    return probs, beta
 
-    # 使用二分搜索找到合适的beta
-    max_iterations = 50
-    for _ in range(max_iterations):
-        # 计算高斯核
-        dist_squared = dist_row[indices] ** 2
-        exp_values = np.exp(-beta * dist_squared)
-        sum_exp = np.sum(exp_values)
 
-        if sum_exp == 0:
-            # 避免除以零
-            beta = beta / 2.0
-            continue
+def gaussian_conditional_probabilities(data, perplexity, dtype=np.float64, block_rows=PERPLEXITY_BLOCK_ROWS):
+    """
+    按困惑度校准的高斯条件概率 p_j|i（每行和为1，对角线为0）
 
-        # 计算概率
-        probs = exp_values / sum_exp
+    逐块计算平方距离并由 calibrate_perplexity 同时校准整块的行，不构造 n×n 的距离矩阵
 
-        # 计算熵
-        entropy = np.sum(-probs * np.log2(probs + 1e-10))
+    返回:
+    - probs: 条件概率矩阵 (n, n)
+    - sigmas: 每个点的高斯核宽度 σ_i = 1/sqrt(2 beta_i)
+    """
+    n_samples = data.shape[0]
+    probs = np.zeros((n_samples, n_samples), dtype=dtype)
+    beta = np.ones(n_samples)
+    if n_samples < 2:
+        return probs, np.sqrt(0.5 / beta)
 
-        # 计算困惑度差
-        entropy_diff = entropy - log_perp
+    for start in range(0, n_samples, block_rows):
+        stop = min(start + block_rows, n_samples)
+        # 校准总是以float64进行，结果按 dtype 存储
+        sq_distances = euclidean_distances(data[start:stop], data, squared=True).astype(np.float64, copy=False)
+        probs[start:stop], beta[start:stop] = calibrate_perplexity(
+            sq_distances, perplexity, exclude=np.arange(start, stop))
 
-        if np.abs(entropy_diff) < tolerance:
-            break
+    return probs, np.sqrt(0.5 / beta)
 
-        # 更新beta
-        if entropy_diff > 0:
-            # 当前熵太高，增大beta以减小困惑度
-            beta_min = beta
-            if beta_max == np.inf:
-                beta = beta * 2.0
-            else:
-                beta = (beta + beta_max) / 2.0
-        else:
-            # 当前熵太低，减小beta以增加困惑度
-            beta_max = beta
-            if beta_min == -np.inf:
-                beta = beta / 2.0
-            else:
-                beta = (beta + beta_min) / 2.0
 
-    # 计算最终概率
-    dist_squared = dist_row ** 2
-    exp_values = np.exp(-beta * dist_squared)
-    exp_values[i] = 0  # 确保自身概率为0
-    prob_row = exp_values / np.sum(exp_values)
+def nearest_neighbor_graph(data, n_neighbors, random_state=42):
+    """
+    每个点的 n_neighbors 个近邻（不含自身）
+
+    样本数少于 EXACT_KNN_MAX_SAMPLES 时用KD树/球树精确查找，否则用umap-learn的NN-descent近似查找
+
+    返回:
+    - indices: 近邻的索引 (n, n_neighbors)
+    - sq_distances: 到近邻的平方欧氏距离 (n, n_neighbors)，float64
+    """
+    n_samples = data.shape[0]
+    if n_samples < EXACT_KNN_MAX_SAMPLES:
+        distances, indices = NearestNeighbors(n_neighbors=n_neighbors + 1).fit(data).kneighbors(data)
+    else:
+        indices, distances, _ = nearest_neighbors(
+            data,
+            n_neighbors=n_neighbors + 1,
+            metric='euclidean',
+            metric_kwds={},
+            angular=False,
+            random_state=random_state
+        )
+
+    # 去掉自身；有重复点时自身不一定排在第一列，没有找到自身的行去掉最后一个近邻
+    drop = indices == np.arange(n_samples)[:, None]
+    drop[~drop.any(axis=1), -1] = True
+    keep = ~drop
+    indices = indices[keep].reshape(n_samples, n_neighbors)
+    distances = np.asarray(distances, dtype=np.float64)[keep].reshape(n_samples, n_neighbors)
+    return indices, distances ** 2
+
+
+def knn_gaussian_probabilities(data, perplexity, dtype=np.float64):
+    """
+    只在每个点的 min(n - 1, 3·perplexity + 1) 个近邻上按困惑度校准的高斯条件概率 p_j|i，
+    更远的点的概率可以忽略；内存为 O(n·k)，不需要 n×n 的距离矩阵
+
+    返回:
+    - probs: 条件概率的CSR矩阵 (n, n)，每行和为1
+    - sigmas: 每个点的高斯核宽度 σ_i = 1/sqrt(2 beta_i)
+    """
+    n_samples = data.shape[0]
+    n_neighbors = min(n_samples - 1, int(3 * perplexity + 1))
+    if n_neighbors < 1:
+        return sparse.csr_matrix((n_samples, n_samples), dtype=dtype), np.full(n_samples, np.sqrt(0.5))
+
+    indices, sq_distances = nearest_neighbor_graph(data, n_neighbors)
+    probs, beta = calibrate_perplexity(sq_distances, perplexity)
 
-    return prob_row
+    indptr = np.arange(0, n_samples * n_neighbors + 1, n_neighbors)
+    probs = sparse.csr_matrix((probs.ravel().astype(dtype), indices.ravel(), indptr), shape=(n_samples, n_samples))
+    probs.sort_indices()
+    return probs, np.sqrt(0.5 / beta)
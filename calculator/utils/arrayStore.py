@@ -0,0 +1,190 @@
+"""
+按内容寻址的数组仓库
+
+数组以其内容的哈希作为句柄保存，节点里可以只携带 dataset_ref 之类的句柄，
+各个接口在服务端把句柄解析回numpy数组，避免在每一步操作中来回传输整块矩阵。
+数组同时写入磁盘目录，多个gunicorn worker之间可以共享同一个句柄。
+磁盘目录按总大小限额，超出时按修改时间从最久未使用的文件开始清理，
+被清理的句柄在其他worker中也会失效，需要客户端重新上传。
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from utils.memoryCache import SizedLRUCache
+
+# 磁盘目录，所有worker共享
+ARRAY_STORE_DIR = os.environ.get('ARRAY_STORE_DIR', os.path.join(tempfile.gettempdir(), 'dimreduction_arrays'))
+
+# 进程内缓存上限
+ARRAY_STORE_MEMORY_MB = int(os.environ.get('ARRAY_STORE_MEMORY_MB', '512'))
+
+# 磁盘目录的总大小上限
+ARRAY_STORE_MAX_MB = int(os.environ.get('ARRAY_STORE_MAX_MB', '4096'))
+
+_HANDLE_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+_memory = SizedLRUCache(ARRAY_STORE_MEMORY_MB * 1024 * 1024)
+
+
+class ArrayNotFoundError(KeyError):
+    """句柄不存在或已被清理"""
+
+
+def _array_path(handle):
+    return os.path.join(ARRAY_STORE_DIR, f'{handle}.npy')
+
+
+def _touch(path):
+    """刷新文件的修改时间，使最近使用的数组最后被清理"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _prune_store(keep):
+    """
+    目录总大小超过 ARRAY_STORE_MAX_MB 时，按修改时间从旧到新删除数组文件，
+    刚写入的 keep 不会被删除；正在写入的临时文件不计入
+    """
+    entries = []
+    with os.scandir(ARRAY_STORE_DIR) as it:
+        for entry in it:
+            name, ext = os.path.splitext(entry.name)
+            if ext != '.npy' or not _HANDLE_PATTERN.match(name):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    limit = ARRAY_STORE_MAX_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # 其他worker已经删除
+            pass
+        total -= size
+
+
+def compute_handle(array):
+    """数组的内容哈希（同时包含dtype和形状）"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(array.dtype.str.encode())
+    digest.update(str(array.shape).encode())
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+def put_array(array):
+    """
+    保存数组并返回句柄，相同内容的数组总是得到相同的句柄
+
+    Args:
+        array: 数值型numpy数组或嵌套列表
+
+    Returns:
+        str: 数组句柄
+    """
+    array = np.ascontiguousarray(array)
+    if array.dtype == object:
+        raise TypeError("只能保存数值型数组")
+
+    handle = compute_handle(array)
+
+    # 即使进程内已缓存，也要确认磁盘文件还在（可能已被其他worker清理），其他worker才能解析该句柄
+    path = _array_path(handle)
+    if os.path.exists(path):
+        _touch(path)
+    else:
+        os.makedirs(ARRAY_STORE_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.npy', dir=ARRAY_STORE_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        _prune_store(keep=path)
+
+    if handle in _memory:
+        return handle
+
+    stored = array.copy()
+    stored.flags.writeable = False
+    _memory.put(handle, stored, stored.nbytes)
+    return handle
+
+
+def get_array(handle):
+    """
+    按句柄取回数组，返回的数组是只读的
+
+    Raises:
+        ArrayNotFoundError: 句柄格式不正确或数组不存在
+    """
+    if not isinstance(handle, str) or not _HANDLE_PATTERN.match(handle):
+        raise ArrayNotFoundError(f"无效的数组句柄: {handle}")
+
+    array = _memory.get(handle)
+    if array is not None:
+        return array
+
+    path = _array_path(handle)
+    try:
+        array = np.asarray(np.load(path, mmap_mode='r', allow_pickle=False))
+    except FileNotFoundError:
+        raise ArrayNotFoundError(f"数组句柄不存在或已过期: {handle}")
+
+    _touch(path)
+    _memory.put(handle, array, array.nbytes)
+    return array
+
+
+def uses_refs(node_data):
+    """节点是否以句柄形式携带数据集（此时结果中的大数组也以句柄返回）"""
+    return node_data.get('dataset') is None and bool(node_data.get('dataset_ref'))
+
+
+def resolve_array(container, key, default=None):
+    """
+    读取 container[key]；若只提供了 container[key + '_ref']，则从仓库中解析该句柄
+
+    Returns:
+        内联的原始值、解析出的numpy数组，两者都没有时返回 default
+    """
+    value = container.get(key)
+    if value is None and container.get(f'{key}_ref'):
+        return get_array(container[f'{key}_ref'])
+    return default if value is None else value
+
+
+def has_array(container, key):
+    """container 中是否内联或以句柄形式提供了 key"""
+    return container.get(key) is not None or bool(container.get(f'{key}_ref'))
+
+
+def assign_array(container, key, array, by_ref):
+    """
+    把数组写回节点：by_ref 时写入 key + '_ref' 句柄，否则内联数组本身
+    """
+    array = np.asarray(array)
+    if by_ref and array.dtype != object:
+        container.pop(key, None)
+        container[f'{key}_ref'] = put_array(array)
+    else:
+        container.pop(f'{key}_ref', None)
+        container[key] = array
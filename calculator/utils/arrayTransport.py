@@ -0,0 +1,312 @@
+"""
+节点接口的传输格式
+
+默认仍然使用JSON。客户端可以选择二进制格式：
+
+- 请求：Content-Type 为 multipart/form-data，'meta' 字段是去掉数组后的JSON，
+  其余每个文件字段是一个 .npy 数组，字段名是它在JSON中的路径，例如
+  'nodeData.dataset'、'node.computed.high_similarity_matrix'。
+- 响应：Accept 中优先 multipart/mixed 时，第一部分是 application/json 的元数据，
+  之后每个数组是一个 application/x-npy 部分，name 同样是它在JSON中的路径，
+  例如 'node.dataset'、'iterations.3.embedding'。
+
+查询参数 ?compact=1 时对称矩阵按上三角打包、重复的数组以 $ref 引用；
+?precision=float32|uint8|uint16|<小数位数> 降低 iterations 中数组的精度（computed 保持完整精度），见 matrixCodec；
+?trajectory=keyframe_delta 把 iterations 编码为关键帧+量化差分，见 trajectoryCodec。
+
+长时间运行的计算可以用 respond_stream 以 Server-Sent Events（text/event-stream）逐条返回，
+每个事件是 'event: <名称>\ndata: <单行JSON>\n\n'，同样支持 ?compact= 和 ?precision=。
+"""
+import fnmatch
+import io
+import json
+import uuid
+
+import numpy as np
+from flask import request, Response
+from scipy import sparse
+
+from utils.jsonProcess import dumps_json, json_response, loads_json
+from utils.matrixCodec import compact_payload, expand_payload, apply_precision, parse_precision, PRECISION_SCOPES
+from utils.trajectoryCodec import parse_trajectory, encode_trajectories
+
+JSON_MIMETYPE = 'application/json'
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+MULTIPART_MIMETYPE = 'multipart/mixed'
+NPY_MIMETYPE = 'application/x-npy'
+
+# 流式输出时每块的大小
+CHUNK_BYTES = 1 << 20
+
+# 数组字段的种类
+#   'matrix' - 二维数值矩阵
+#   'square' - 二维数值方阵
+#   'vector' - 一维数值向量
+#   'table'  - 二维表格，能转换为数值时转换，含字符串等非数值列时保持原样交给pandas处理
+#   'graph'  - 方阵，稀疏矩阵保持为CSR（其余种类收到稀疏矩阵时转换为稠密数组）
+ARRAY_KINDS = ('matrix', 'square', 'vector', 'table', 'graph')
+
+
+class RequestFormatError(ValueError):
+    """请求体无法解析，或其中的数组字段形状、类型不正确；接口以400返回"""
+
+
+def decode_npy(buffer):
+    """
+    把 .npy 字节解析为数组，数组直接引用 buffer 的内存，不做复制
+    """
+    stream = io.BytesIO(buffer)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+
+    if dtype.hasobject:
+        raise ValueError("不支持object类型的数组")
+
+    count = int(np.prod(shape)) if shape else 1
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=stream.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def encode_npy_header(array):
+    """生成数组的 .npy 文件头"""
+    stream = io.BytesIO()
+    np.lib.format.write_array_header_1_0(stream, np.lib.format.header_data_from_array_1_0(array))
+    return stream.getvalue()
+
+
+def _split_path(path):
+    return [int(part) if part.isdigit() else part for part in path.split('.')]
+
+
+def insert_at_path(data, path, value):
+    """按 'a.b.0.c' 这样的路径把值写入嵌套的字典/列表，缺失的字典层级会自动创建"""
+    keys = _split_path(path)
+    container = data
+    for key in keys[:-1]:
+        if isinstance(container, list):
+            container = container[key]
+        else:
+            container = container.setdefault(key, {})
+    container[keys[-1]] = value
+
+
+def extract_arrays(data, path=''):
+    """
+    把嵌套结构中的数值型numpy数组抽出来
+
+    Returns:
+        tuple: (去掉数组后的结构, [(路径, 数组), ...])
+    """
+    arrays = []
+
+    def walk(value, current):
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+            arrays.append((current, value))
+            return None
+        if isinstance(value, dict):
+            return {k: walk(v, f'{current}.{k}' if current else str(k)) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [walk(v, f'{current}.{i}' if current else str(i)) for i, v in enumerate(value)]
+        return value
+
+    return walk(data, path), arrays
+
+
+def as_array(value, kind, name='', dtype=np.float64):
+    """
+    把数组字段转换为连续的numpy数组并检查形状
+
+    Args:
+        value: 列表或numpy数组
+        kind: 字段种类，见 ARRAY_KINDS
+        name: 字段名，用于错误信息
+        dtype: 数值类型
+
+    Raises:
+        RequestFormatError: 无法转换或形状不符
+    """
+    if sparse.issparse(value):
+        if kind == 'graph':
+            if value.shape[0] != value.shape[1]:
+                raise RequestFormatError(f"{name} 应为方阵，实际形状为{value.shape}")
+            return sparse.csr_matrix(value, dtype=dtype)
+        value = value.toarray()
+
+    try:
+        array = np.ascontiguousarray(value, dtype=dtype)
+    except (TypeError, ValueError):
+        if kind == 'table':
+            return value
+        raise RequestFormatError(f"{name} 不是规则的数值数组")
+
+    ndim = 1 if kind == 'vector' else 2
+    if array.ndim != ndim:
+        raise RequestFormatError(f"{name} 应为{ndim}维数组，实际为{array.ndim}维")
+    if kind in ('square', 'graph') and array.shape[0] != array.shape[1]:
+        raise RequestFormatError(f"{name} 应为方阵，实际形状为{array.shape}")
+    return array
+
+
+def _matching_paths(data, keys, prefix=''):
+    """按带通配符的路径在嵌套字典中查找字段，返回 [(容器, 键, 完整路径), ...]"""
+    if not isinstance(data, dict):
+        return []
+    key, rest = keys[0], keys[1:]
+    names = [k for k in data if fnmatch.fnmatchcase(str(k), key)] if '*' in key else [key] if key in data else []
+    matches = []
+    for name in names:
+        path = f'{prefix}.{name}' if prefix else name
+        if rest:
+            matches.extend(_matching_paths(data[name], rest, path))
+        else:
+            matches.append((data, name, path))
+    return matches
+
+
+def coerce_arrays(data, array_fields, dtype=np.float64):
+    """
+    按 {路径: 种类} 把请求中的数组字段统一转换为numpy数组，路径中可以使用通配符，
+    例如 'node_data.computed.*_matrix'。缺失、为空或为 None 的字段保持原样。
+    """
+    for pattern, kind in array_fields.items():
+        for container, key, path in _matching_paths(data, pattern.split('.')):
+            value = container[key]
+            if value is None or (isinstance(value, (list, np.ndarray)) and len(value) == 0):
+                continue
+            container[key] = as_array(value, kind, path, dtype)
+    return data
+
+
+def get_request_data(array_fields=None):
+    """
+    读取请求体：multipart/form-data 时按二进制格式解码，否则按JSON解析
+
+    Args:
+        array_fields: {路径: 种类}，这些字段会被统一转换为连续的numpy数组并检查形状，
+                      处理函数拿到的就是现成的数组
+
+    Raises:
+        RequestFormatError: JSON、.npy 或压缩表示无法解析，或数组字段不符合要求
+    """
+    if not (request.mimetype == 'multipart/form-data' or request.is_json):
+        # 保持原有行为：非JSON请求由flask返回415
+        return request.get_json()
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data = json.loads(request.form.get('meta', '{}'))
+            for path, file in request.files.items():
+                insert_at_path(data, path, decode_npy(file.read()))
+        else:
+            data = loads_json(request.get_data())
+
+        # 客户端可以原样回传压缩表示的节点
+        data = expand_payload(data)
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        # orjson.JSONDecodeError 和 json.JSONDecodeError 都是 ValueError 的子类
+        raise RequestFormatError(f"请求体无法解析: {e}") from e
+
+    if array_fields and isinstance(data, dict):
+        coerce_arrays(data, array_fields)
+    return data
+
+
+def wants_binary():
+    """客户端是否在Accept中明确优先选择了 multipart/mixed"""
+    return request.accept_mimetypes.best_match([JSON_MIMETYPE, MULTIPART_MIMETYPE]) == MULTIPART_MIMETYPE
+
+
+def wants_compact():
+    """客户端是否通过 ?compact=1 选择了对称矩阵打包和去重"""
+    return request.args.get('compact', '').lower() in ('1', 'true')
+
+
+def _multipart_body(meta, arrays, boundary):
+    yield (f'--{boundary}\r\nContent-Type: {JSON_MIMETYPE}\r\n'
+           f'Content-Disposition: inline; name="meta"\r\n\r\n').encode()
+    yield dumps_json(meta)
+
+    for path, array in arrays:
+        array = np.ascontiguousarray(array)
+        yield (f'\r\n--{boundary}\r\nContent-Type: {NPY_MIMETYPE}\r\n'
+               f'Content-Disposition: attachment; name="{path}"\r\n\r\n').encode()
+        yield encode_npy_header(array)
+        view = memoryview(array).cast('B') if array.size else memoryview(b'')
+        for start in range(0, len(view), CHUNK_BYTES):
+            yield bytes(view[start:start + CHUNK_BYTES])
+
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def respond(payload, status=200):
+    """
+    按照内容协商返回响应：默认JSON，Accept优先 multipart/mixed 时数组以 .npy 分块传输
+    """
+    try:
+        precision = parse_precision(request.args.get('precision'))
+        trajectory, tolerance = parse_trajectory(request.args.get('trajectory'),
+                                                 request.args.get('trajectory_tolerance'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+
+    if trajectory is not None:
+        payload = encode_trajectories(payload, tolerance)
+    if wants_compact():
+        payload = compact_payload(payload)
+    try:
+        payload = apply_precision(payload, precision)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+
+    if wants_binary():
+        meta, arrays = extract_arrays(payload)
+        boundary = uuid.uuid4().hex
+        response = Response(_multipart_body(meta, arrays, boundary),
+                            content_type=f'{MULTIPART_MIMETYPE}; boundary={boundary}')
+        response.status_code = status
+        return response
+
+    return json_response(payload, status)
+
+
+def encode_event(event, payload):
+    """编码一条SSE事件；orjson的输出不含换行，一个data行即可"""
+    return b'event: ' + event.encode() + b'\ndata: ' + dumps_json(payload) + b'\n\n'
+
+
+def _event_body(events, precision, compact, scopes):
+    try:
+        for event, payload in events:
+            if compact:
+                payload = compact_payload(payload)
+            # 事件名也作为一层字段参与 scopes 的匹配，例如 'iteration' 事件整体降低精度
+            payload = apply_precision({event: payload}, precision, scopes)[event]
+            yield encode_event(event, payload)
+    finally:
+        # 客户端断开时服务器关闭响应体，计算随之停止
+        events.close()
+
+
+def respond_stream(events, scopes=PRECISION_SCOPES):
+    """
+    以 Server-Sent Events 逐条返回 events 产出的 (事件名, 数据)
+
+    events 只在服务器发送完上一条事件后才被继续推进，计算速度不会超过客户端接收的速度；
+    客户端断开连接时 events 被关闭。查询参数在开始发送之前读取，events 中不能再访问 request。
+
+    Args:
+        events: 产出 (事件名, 数据) 的生成器
+        scopes: ?precision= 作用的字段名或事件名
+    """
+    try:
+        precision = parse_precision(request.args.get('precision'))
+    except ValueError as e:
+        events.close()
+        return json_response({'error': str(e)}, 400)
+
+    return Response(_event_body(events, precision, wants_compact(), scopes),
+                    mimetype=EVENT_STREAM_MIMETYPE,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,352 @@
+"""
+精确t-SNE/SNE梯度的分块计算
+
+融合内核 exact_iteration 需要三个 n×n 的float64缓冲区，点数上万时内存按 n² 增长，
+两万个点就需要近10GB。分块模式每次只处理若干行：
+
+- 第一遍逐块计算核函数，累加Q的归一化常数 Σ_{i≠j} k_ij；
+- 第二遍重新计算每块的核函数，得到这些行的Q、梯度和KL散度。
+
+每块的工作区为 4 × block_rows × n 个元素，block_rows 由内存预算和计算精度决定（float32 每个元素4字节），
+峰值内存为 O(block·n)。
+核函数在两遍中各算一次，但每块的数据量小、缓存命中率高，实测耗时与融合内核相近；
+结果与融合内核一致（仅有求和顺序带来的舍入差异）。
+
+P为稀疏矩阵时保持稀疏，逐块展开为稠密行；未存储的位置与稠密模式一样取 1e-12 后归一化。
+
+各行的计算互不依赖，可以交给线程池并行（numpy的运算会释放GIL）：融合内核和UMAP按固定的
+PARALLEL_ROWS 行切分、共用 n×n 缓冲区，切分与线程数无关，部分和按块的顺序累加，结果不随线程数变化；
+分块模式每个线程有自己的一组块缓冲区，内存预算由各线程平分，块的大小随线程数变化，结果只有舍入差异。
+
+    GRADIENT_MEMORY_BUDGET_MB  精确模式工作区（以及FFT插值网格）的内存预算，默认1024；请求参数 memory_budget_mb 可覆盖
+    GRADIENT_N_JOBS            梯度计算的线程数，默认1，-1 表示使用全部CPU；请求参数 n_jobs 可覆盖
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from utils.tsneApproximation import clip_rows
+
+GRADIENT_MEMORY_BUDGET_MB = float(os.environ.get('GRADIENT_MEMORY_BUDGET_MB', '1024'))
+GRADIENT_N_JOBS = int(os.environ.get('GRADIENT_N_JOBS', '1'))
+
+# 融合内核的 n×n 缓冲区个数，分块模式每块的 block×n 缓冲区个数
+FUSED_BUFFERS = 3
+BLOCK_BUFFERS = 4
+
+# 共用 n×n 缓冲区时，每个并行任务处理的行数
+PARALLEL_ROWS = 256
+
+# 按线程数缓存的线程池，进程内所有请求共用
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def resolve_n_jobs(n_jobs=None):
+    """请求参数或 GRADIENT_N_JOBS 给出的线程数；负数按 joblib 的约定，-1 为全部CPU"""
+    if n_jobs is None:
+        n_jobs = GRADIENT_N_JOBS
+    n_jobs = int(n_jobs)
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+    return max(1, n_jobs)
+
+
+def get_executor(n_jobs):
+    with _executors_lock:
+        if n_jobs not in _executors:
+            _executors[n_jobs] = ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix='gradient')
+        return _executors[n_jobs]
+
+
+def parallel_map(func, items, n_jobs=1):
+    """按顺序返回 func(item) 的结果；只有一个线程或一项任务时直接在当前线程执行"""
+    items = list(items)
+    if n_jobs == 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    return list(get_executor(n_jobs).map(func, items))
+
+
+def row_ranges(n_samples, block_rows=PARALLEL_ROWS):
+    return [(start, min(start + block_rows, n_samples)) for start in range(0, n_samples, block_rows)]
+
+
+def plan_block_rows(n_samples, memory_budget_mb=None, n_jobs=1, itemsize=8):
+    """
+    根据内存预算决定每块的行数，分块模式下预算由各线程平分；itemsize 为缓冲区每个元素的字节数
+
+    Returns:
+        int: 每块的行数；不小于 n_samples 时表示融合内核的工作区放得下，不必分块
+    """
+    if memory_budget_mb is None:
+        memory_budget_mb = GRADIENT_MEMORY_BUDGET_MB
+    budget = memory_budget_mb * 2 ** 20
+    if FUSED_BUFFERS * n_samples * n_samples * itemsize <= budget:
+        return n_samples
+    return int(min(n_samples - 1, max(1, budget // (BLOCK_BUFFERS * n_samples * itemsize * n_jobs))))
+
+
+def normalize_sparse_p(P, dtype=np.float64):
+    """
+    按稠密模式的方式归一化稀疏P：无效值和小于1e-12的元素（包括未存储的位置）取1e-12，再除以总和
+
+    Args:
+        P: 稀疏的高维相似度矩阵
+        dtype: 结果的数值类型，总和总是以float64累加
+
+    Returns:
+        tuple: (归一化后的csr_matrix, 未存储位置的取值)；总和不为正时返回 (None, None)
+    """
+    P = sparse.csr_matrix(P, dtype=dtype)
+    P.sum_duplicates()
+    n_rows, n_cols = P.shape
+    P.data = np.maximum(np.nan_to_num(P.data, nan=1e-12, posinf=1e-12, neginf=1e-12), 1e-12)
+
+    P_sum = P.data.sum(dtype=np.float64) + (n_rows * n_cols - P.nnz) * 1e-12
+    if not P_sum > 0:
+        return None, None
+    P.data /= P_sum
+    return P, 1e-12 / P_sum
+
+
+def create_blocked_workspace(P, n_components, block_rows, p_fill=0.0, n_jobs=1):
+    """
+    分块模式的预分配缓冲区，每个线程一组
+
+    Args:
+        P: 稠密或稀疏（normalize_sparse_p 的结果）的高维相似度矩阵，缓冲区与P的dtype相同
+        n_components: 低维嵌入的维数
+        block_rows: 每块的行数
+        p_fill: 稀疏P未存储位置的取值
+        n_jobs: 线程数
+    """
+    n, dtype = P.shape[0], P.dtype
+    block_rows = max(1, min(block_rows, n))
+    return {
+        'block_rows': block_rows,
+        'p_fill': p_fill,
+        'buffers': [{
+            'kernel': np.empty((block_rows, n), dtype=dtype),
+            'Q': np.empty((block_rows, n), dtype=dtype),
+            'work': np.empty((block_rows, n), dtype=dtype),
+            'p_block': np.empty((block_rows, n), dtype=dtype),
+            'row_sums': np.empty(block_rows, dtype=dtype)
+        } for _ in range(n_jobs)],
+        'sq_norms': np.empty(n, dtype=dtype),
+        'grad': np.empty((n, n_components), dtype=dtype)
+    }
+
+
+def kernel_block(algorithm, Y, sq_norms, start, stop, out):
+    """计算第 start..stop 行的核函数：t-SNE为 (1 + D)^-1，SNE为 exp(-D)，对角线保留"""
+    np.dot(Y[start:stop], Y.T, out=out)
+    out *= -2.0
+    out += sq_norms[start:stop, None]
+    out += sq_norms[None, :]
+    np.maximum(out, 0.0, out=out)
+    if algorithm == 'tsne':
+        out += 1.0
+        np.reciprocal(out, out=out)
+    else:
+        np.negative(out, out=out)
+        np.exp(out, out=out)
+    return out
+
+
+def p_rows(P, start, stop, p_fill, out):
+    """取P的第 start..stop 行；稀疏P展开到 out 中"""
+    if not sparse.issparse(P):
+        return P[start:stop]
+    out.fill(p_fill)
+    block = P[start:stop]
+    out[np.repeat(np.arange(stop - start), np.diff(block.indptr)), block.indices] = block.data
+    return out
+
+
+def similarity_rows(algorithm, Y, sq_norms, start, stop, kernel, Q):
+    """
+    计算第 start..stop 行的核函数（写入 kernel）和未归一化的Q（写入 Q，对角线为0）
+
+    Returns:
+        float: 这些行的 Σ_{j≠i} k_ij（以float64累加）
+    """
+    rows = np.arange(stop - start)
+    kernel_block(algorithm, Y, sq_norms, start, stop, kernel)
+    np.copyto(Q, kernel)
+    Q[rows, rows + start] = 0.0
+    return Q.sum(dtype=np.float64)
+
+
+def q_scaling(q_sum, n_samples):
+    """与 compute_low_dimensional_similarity_* 相同：和太小时每个元素（含对角线）加1e-12再归一化"""
+    if q_sum < 1e-12:
+        return 1e-12, q_sum + n_samples * n_samples * 1e-12
+    return 0.0, q_sum
+
+
+def gradient_rows(algorithm, p, Y, start, stop, kernel, Q, work, row_sums, grad, q_offset, q_total,
+                  exaggeration=1.0):
+    """
+    归一化第 start..stop 行的Q（不小于1e-12），并把这些行的梯度写入 grad[start:stop]
+
+    t-SNE c = 4 (P - Q) (1 + D)^-1，SNE c = 2 (P - Q)；Σ_j c_ij (y_i - y_j) = y_i Σ_j c_ij - (C Y)_i。
+    早期夸大阶段以 exaggeration × P 代替 P
+    """
+    if q_offset:
+        Q += q_offset
+    Q /= q_total
+    np.maximum(Q, 1e-12, out=Q)
+
+    if exaggeration == 1.0:
+        np.subtract(p, Q, out=work)
+    else:
+        np.multiply(p, exaggeration, out=work)
+        work -= Q
+    if algorithm == 'tsne':
+        work *= kernel
+    np.sum(work, axis=1, out=row_sums)
+    block_grad = grad[start:stop]
+    np.dot(work, Y, out=block_grad)
+    np.subtract(Y[start:stop] * row_sums[:, None], block_grad, out=block_grad)
+    block_grad *= 4.0 if algorithm == 'tsne' else 2.0
+
+
+def cost_rows(p_floor, Q, work):
+    """这些行的KL散度 Σ P log(max(P / Q, 1e-12))，P、Q 均不小于 1e-12"""
+    np.divide(p_floor, Q, out=work)
+    np.maximum(work, 1e-12, out=work)
+    np.log(work, out=work)
+    return weighted_sum(p_floor, work)
+
+
+def weighted_sum(weights, values):
+    """
+    Σ weights · values，以float64累加
+
+    float32 下BLAS的点积以单精度累加，n² 项相加会损失精度，这时先逐元素相乘（覆盖 values）再以float64求和
+    """
+    if values.dtype == np.float64:
+        return float(np.vdot(weights, values))
+    np.multiply(values, weights, out=values)
+    return float(values.sum(dtype=np.float64))
+
+
+def map_blocks(func, n_samples, workspace):
+    """
+    把各块轮流分给线程，每个线程使用自己的一组缓冲区
+
+    Returns:
+        list: 按块的顺序排列的 func(start, stop, buffers) 结果
+    """
+    blocks = row_ranges(n_samples, workspace['block_rows'])
+    n_jobs = len(workspace['buffers'])
+
+    def worker(thread_index):
+        buffers = workspace['buffers'][thread_index]
+        return [func(start, stop, {name: buffer[:stop - start] for name, buffer in buffers.items()})
+                for start, stop in blocks[thread_index::n_jobs]]
+
+    per_thread = parallel_map(worker, range(n_jobs), n_jobs)
+    return [per_thread[i % n_jobs][i // n_jobs] for i in range(len(blocks))]
+
+
+def normalization(algorithm, Y, workspace):
+    """第一遍：逐块累加 Σ_{i≠j} k_ij；出现NaN/Inf时返回 None"""
+    sq_norms = workspace['sq_norms']
+    np.einsum('ij,ij->i', Y, Y, out=sq_norms)
+
+    q_sum = sum(map_blocks(
+        lambda start, stop, buffers: similarity_rows(algorithm, Y, sq_norms, start, stop,
+                                                     buffers['kernel'], buffers['Q']),
+        Y.shape[0], workspace))
+
+    if not np.isfinite(q_sum):
+        return None
+    return q_sum
+
+
+def blocked_iteration(algorithm, P, Y, workspace, compute_cost=True, exaggeration=1.0):
+    """
+    分块计算精确模式的单次迭代，参数和返回值与 exact_iteration 相同
+
+    Returns:
+        tuple: (梯度, 成本)；Q中出现NaN/Inf时返回 (None, None)，不计算成本时成本为 None
+    """
+    n = Y.shape[0]
+    q_sum = normalization(algorithm, Y, workspace)
+    if q_sum is None:
+        return None, None
+    q_offset, q_total = q_scaling(q_sum, n)
+    sq_norms, grad = workspace['sq_norms'], workspace['grad']
+
+    def process_block(start, stop, buffers):
+        kernel, Q, work = buffers['kernel'], buffers['Q'], buffers['work']
+        similarity_rows(algorithm, Y, sq_norms, start, stop, kernel, Q)
+        p = p_rows(P, start, stop, workspace['p_fill'], buffers['p_block'])
+        gradient_rows(algorithm, p, Y, start, stop, kernel, Q, work, buffers['row_sums'], grad, q_offset, q_total,
+                      exaggeration)
+        if compute_cost:
+            return cost_rows(np.maximum(p, 1e-12, out=buffers['p_block']), Q, work)
+        return 0.0
+
+    costs = map_blocks(process_block, n, workspace)
+    return clip_rows(grad), (sum(costs) if compute_cost else None)
+
+
+def blocked_low_similarity(algorithm, Y, workspace):
+    """
+    分块计算稠密的最终低维相似度，结果与 compute_low_dimensional_similarity_* 相同（仅有舍入差异）；
+    核函数直接写入输出矩阵的各块，除输出本身外只使用分块工作区
+
+    Returns:
+        ndarray: (n, n) 的Q，dtype与工作区相同
+    """
+    n = Y.shape[0]
+    sq_norms = workspace['sq_norms']
+    np.einsum('ij,ij->i', Y, Y, out=sq_norms)
+    Q = np.empty((n, n), dtype=sq_norms.dtype)
+
+    q_sum = sum(map_blocks(
+        lambda start, stop, buffers: similarity_rows(algorithm, Y, sq_norms, start, stop,
+                                                     buffers['kernel'], Q[start:stop]),
+        n, workspace))
+    if not np.isfinite(q_sum):
+        raise ValueError("低维相似度中出现无效值")
+    q_offset, q_total = q_scaling(q_sum, n)
+
+    def normalize(start, stop, buffers):
+        block = Q[start:stop]
+        if q_offset:
+            block += q_offset
+        block /= q_total
+        np.maximum(block, 1e-12, out=block)
+
+    map_blocks(normalize, n, workspace)
+    return Q
+
+
+def sparse_exact_similarity(algorithm, P, Y, workspace):
+    """
+    只在稀疏P的非零位置上给出精确的低维相似度，归一化常数复用分块工作区计算，不构造 n×n 矩阵
+
+    Returns:
+        csr_matrix: 与P结构相同的Q
+    """
+    n = Y.shape[0]
+    q_sum = normalization(algorithm, Y, workspace)
+    if q_sum is None:
+        raise ValueError("低维相似度中出现无效值")
+
+    P = P.tocoo()
+    diff = Y[P.row] - Y[P.col]
+    distances = np.einsum('ij,ij->i', diff, diff)
+    kernel = 1.0 / (1.0 + distances) if algorithm == 'tsne' else np.exp(-distances)
+    kernel[P.row == P.col] = 0.0
+    if q_sum < 1e-12:
+        q = (kernel + 1e-12) / (q_sum + n * n * 1e-12)
+    else:
+        q = kernel / q_sum
+    return sparse.csr_matrix((np.maximum(q, 1e-12), (P.row, P.col)), shape=(n, n))
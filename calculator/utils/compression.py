@@ -0,0 +1,111 @@
+"""
+响应压缩
+
+按照请求的 Accept-Encoding 对响应体做 zstd 或 gzip 压缩。压缩是流式进行的：
+原始响应体按块送入压缩器，压缩结果边生成边发送，不会在内存中再完整保存一份压缩后的响应；
+二进制 multipart 这类本身就是流式生成的响应同样逐块压缩。
+
+    COMPRESSION_MIN_BYTES  小于该字节数的响应不压缩，默认1024
+    GZIP_LEVEL             gzip压缩级别 1-9，默认6
+    ZSTD_LEVEL             zstd压缩级别 1-22，默认3
+"""
+import os
+import zlib
+
+from flask import request
+
+try:
+    import zstandard
+except ImportError:  # 未安装时只提供gzip
+    zstandard = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', '3'))
+
+# 每次送入压缩器的字节数
+CHUNK_BYTES = 1 << 18
+
+# 不压缩的响应类型：事件流需要逐条即时送达，图片等已经是压缩格式
+SKIP_MIMETYPES = ('text/event-stream', 'image/', 'video/', 'audio/', 'application/zip', 'application/gzip')
+
+
+def _gzip_compressor():
+    # wbits=31 输出带gzip头的数据
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def _zstd_compressor():
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+
+def available_encodings():
+    """服务端支持的编码，按优先级排列"""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def choose_encoding(accept_encodings):
+    """
+    根据请求的 Accept-Encoding 选择编码
+
+    Args:
+        accept_encodings: werkzeug 解析得到的 request.accept_encodings
+
+    Returns:
+        'zstd'、'gzip' 或 None
+    """
+    candidates = [e for e in available_encodings() if accept_encodings[e] > 0]
+    if not candidates:
+        return None
+    # 客户端权重相同时按服务端优先级
+    return max(candidates, key=lambda e: accept_encodings[e])
+
+
+def compress_stream(body, encoding):
+    """
+    逐块压缩响应体的生成器
+
+    Args:
+        body: 原始响应体的可迭代对象（bytes块），内存中的块只做切片视图，不复制
+        encoding: 'zstd' 或 'gzip'
+    """
+    compressor = _zstd_compressor() if encoding == 'zstd' else _gzip_compressor()
+    for data in body:
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_BYTES):
+            compressed = compressor.compress(view[start:start + CHUNK_BYTES])
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def _should_compress(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return False
+    if response.mimetype and response.mimetype.startswith(SKIP_MIMETYPES):
+        return False
+    # 流式响应长度未知，一律压缩
+    return response.is_streamed or response.calculate_content_length() >= COMPRESSION_MIN_BYTES
+
+
+def compress_response(response):
+    """after_request 钩子：协商编码并把响应体替换为压缩流"""
+    if not _should_compress(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.response = compress_stream(response.iter_encoded(), encoding)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    return response
+
+
+def init_compression(app):
+    """为整个应用注册响应压缩"""
+    app.after_request(compress_response)
@@ -0,0 +1,35 @@
+"""
+计算精度
+
+相似度矩阵、P、Q以及梯度下降的 n×n 缓冲区默认为float64。float32 的缓冲区只占一半内存，
+带宽受限的逐元素运算和矩阵乘法也快得多，对可视化来说精度足够：
+
+- 求和与成本（Σ Q、KL散度、交叉熵）仍以float64累加，n² 项相加时不会丢失精度；
+- 代码中的下限 1e-12 / 1e-10 远大于float32的最小正规数（约1.2e-38），在float32下同样有效；
+- 响应按数组本身的dtype编码，float32 的JSON更短、二进制传输减半。
+
+    COMPUTE_DTYPE  整个进程默认的计算精度，'float64'（默认）或 'float32'；请求参数 dtype 可覆盖
+"""
+import os
+
+import numpy as np
+
+COMPUTE_DTYPES = ('float64', 'float32')
+
+COMPUTE_DTYPE = os.environ.get('COMPUTE_DTYPE', 'float64')
+
+
+def resolve_dtype(value=None):
+    """
+    解析计算精度，未指定时使用 COMPUTE_DTYPE
+
+    Returns:
+        np.dtype: float64 或 float32
+
+    Raises:
+        ValueError: 不支持的精度
+    """
+    name = COMPUTE_DTYPE if value is None else value
+    if name not in COMPUTE_DTYPES:
+        raise ValueError(f"不支持的计算精度: {name}，可选 {', '.join(COMPUTE_DTYPES)}")
+    return np.dtype(name)
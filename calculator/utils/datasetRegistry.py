@@ -0,0 +1,156 @@
+"""
+内置数据集注册表
+
+数据集在第一次被请求时才加载，加载结果以 .npz 二进制数组的形式缓存在磁盘上，
+之后直接从缓存读取。构建镜像时可以预先执行
+
+    python -m utils.datasetRegistry
+
+把所有数据集下载到缓存目录，运行时设置 DATASET_OFFLINE=1 即可保证不再访问网络。
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+from sklearn import datasets
+from sklearn.utils import Bunch
+
+# 磁盘缓存目录，默认位于 calculator/dataset_cache
+DATASET_CACHE_DIR = os.environ.get(
+    'DATASET_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset_cache')
+)
+
+# 离线模式下缓存缺失时直接报错，不会在请求中途去下载数据
+DATASET_OFFLINE = os.environ.get('DATASET_OFFLINE', '0') == '1'
+
+# MNIST小样本的样本数
+MNIST_SMALL_SAMPLES = 2000
+
+
+def _openml_home():
+    """openml原始下载文件也放在缓存目录下，避免重复下载"""
+    return os.path.join(DATASET_CACHE_DIR, 'openml')
+
+
+def load_boston():
+    """从openml加载波士顿房价数据集（回归问题，目标为MEDV）"""
+    bunch = datasets.fetch_openml(name='boston', version=1, as_frame=True,
+                                  parser='auto', data_home=_openml_home())
+    return Bunch(
+        data=bunch.data.astype(np.float64).to_numpy(),
+        target=bunch.target.astype(np.float64).to_numpy(),
+        feature_names=list(bunch.data.columns),
+        target_names=None,
+        DESCR=bunch.DESCR
+    )
+
+
+def load_mnist_small():
+    """加载MNIST数据集的小样本版本"""
+    X, y = datasets.fetch_openml('mnist_784', version=1, return_X_y=True, as_frame=False,
+                                 parser='auto', data_home=_openml_home())
+    X = np.asarray(X[:MNIST_SMALL_SAMPLES], dtype=np.float64)  # 只取前2000个样本
+    y = np.asarray(y[:MNIST_SMALL_SAMPLES]).astype(int)
+
+    return Bunch(
+        data=X,
+        target=y,
+        feature_names=[f'pixel_{i}' for i in range(X.shape[1])],
+        target_names=np.unique(y),
+        DESCR="MNIST手写数字数据集(小样本版)"
+    )
+
+
+# 数据集ID -> 原始加载函数（只在缓存缺失时调用）
+DATASETS = {
+    'iris': datasets.load_iris,
+    'wine': datasets.load_wine,
+    'breast_cancer': datasets.load_breast_cancer,
+    'digits': datasets.load_digits,
+    'boston': load_boston,
+    'mnist_small': load_mnist_small
+}
+
+
+def _cache_path(dataset_id):
+    return os.path.join(DATASET_CACHE_DIR, f'{dataset_id}.npz')
+
+
+def _write_cache(dataset_id, bunch):
+    """把数据集写成 .npz，先写临时文件再原子替换，多个worker同时写也不会读到半个文件"""
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+
+    arrays = {
+        'data': np.asarray(bunch.data, dtype=np.float64),
+        'target': np.asarray(bunch.target),
+        'feature_names': np.asarray(bunch.feature_names if bunch.get('feature_names') is not None else [], dtype=str),
+        'DESCR': np.asarray(bunch.get('DESCR') or '', dtype=str)
+    }
+    if bunch.get('target_names') is not None:
+        arrays['target_names'] = np.asarray(bunch.target_names)
+
+    fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=DATASET_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, _cache_path(dataset_id))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _read_cache(dataset_id):
+    with np.load(_cache_path(dataset_id), allow_pickle=False) as cached:
+        return Bunch(
+            data=cached['data'],
+            target=cached['target'],
+            feature_names=cached['feature_names'].tolist(),
+            target_names=cached['target_names'] if 'target_names' in cached else None,
+            DESCR=str(cached['DESCR'])
+        )
+
+
+def load_dataset(dataset_id):
+    """
+    按ID加载内置数据集，优先读取磁盘缓存
+
+    Args:
+        dataset_id: DATASETS 中的数据集ID
+
+    Returns:
+        Bunch: data为float64矩阵，target为标签数组
+    """
+    if dataset_id not in DATASETS:
+        raise KeyError(f"找不到数据集: {dataset_id}")
+
+    if os.path.exists(_cache_path(dataset_id)):
+        return _read_cache(dataset_id)
+
+    if DATASET_OFFLINE:
+        raise RuntimeError(f"离线模式下数据集 {dataset_id} 没有预先缓存")
+
+    _write_cache(dataset_id, DATASETS[dataset_id]())
+    return _read_cache(dataset_id)
+
+
+def seed_cache(dataset_ids=None):
+    """预先下载并缓存数据集，返回加载失败的数据集ID列表"""
+    failed = []
+    for dataset_id in dataset_ids or DATASETS:
+        try:
+            bunch = load_dataset(dataset_id)
+            print(f"已缓存 {dataset_id}: {bunch.data.shape}")
+        except Exception as e:
+            print(f"缓存 {dataset_id} 失败: {e}")
+            failed.append(dataset_id)
+    return failed
+
+
+if __name__ == '__main__':
+    failed = seed_cache(sys.argv[1:])
+    if failed:
+        print(f"以下数据集缓存失败: {', '.join(failed)}")
+        sys.exit(1)
@@ -1,17 +1,103 @@
+"""
+JSON的编码与解码
+
+numpy数组和numpy标量由orjson直接编码，不再先转换成Python列表再交给json模块遍历；
+请求体同样由orjson解析。
+"""
+import math
+
 import numpy as np
+import orjson
+from flask import Response
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# 非有限值(NaN/Inf)的处理策略
+#   'null'   - 编码为 null（JSON本身无法表示NaN/Inf）
+#   'raise'  - 抛出 ValueError
+#   'finite' - NaN替换为0，±Inf替换为对应dtype的最大/最小有限值
+NONFINITE_POLICIES = ('null', 'raise', 'finite')
+
 
-def make_json_safe(data):
+def _default(obj):
+    """orjson无法直接编码的对象：非C连续的数组、非数值dtype的数组等"""
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind in 'biuf' and not obj.flags.c_contiguous:
+            return np.ascontiguousarray(obj)
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def _apply_policy(array, nonfinite, precision):
+    """对单个浮点数组应用非有限值策略和精度"""
+    if nonfinite == 'raise' and not np.isfinite(array).all():
+        raise ValueError("响应中包含NaN或Inf")
+    if nonfinite == 'finite':
+        array = np.nan_to_num(array)
+    if precision == 'float32':
+        array = array.astype(np.float32)
+    elif isinstance(precision, int):
+        array = np.round(array, precision)
+    return array
+
+
+def _prepare(data, nonfinite, precision):
+    """遍历容器，只对其中的浮点数组/浮点数应用策略，其余值原样保留"""
     if isinstance(data, dict):
-        return {k: make_json_safe(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [make_json_safe(v) for v in data]
-    elif isinstance(data, np.ndarray):
-        return data.tolist()
-    elif isinstance(data, (np.int64, np.int32, np.int16, np.int8)):
-        return int(data)
-    elif isinstance(data, (np.float64, np.float32, np.float16)):
-        return float(data)
-    elif isinstance(data, (np.str_, np.unicode_)):
-        return str(data)
-    else:
-        return data
+        return {k: _prepare(v, nonfinite, precision) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_prepare(v, nonfinite, precision) for v in data]
+    if isinstance(data, np.ndarray) and data.dtype.kind == 'f':
+        return _apply_policy(data, nonfinite, precision)
+    if isinstance(data, (float, np.floating)):
+        if not math.isfinite(data):
+            if nonfinite == 'raise':
+                raise ValueError("响应中包含NaN或Inf")
+            if nonfinite == 'finite':
+                return float(np.nan_to_num(data))
+            return None
+        if isinstance(precision, int):
+            return round(float(data), precision)
+        if precision == 'float32':
+            return np.float32(data)
+    return data
+
+
+def dumps_json(data, nonfinite='null', precision=None):
+    """
+    把包含numpy数组/标量的结构编码为JSON字节
+
+    Args:
+        data: 任意由dict/list/标量/numpy数组组成的结构
+        nonfinite: 非有限值策略，见 NONFINITE_POLICIES
+        precision: None 保持float64的完整精度；'float32' 以单精度最短表示输出；
+                   整数 k 表示四舍五入到小数点后k位
+
+    Returns:
+        bytes: UTF-8编码的JSON
+    """
+    if nonfinite not in NONFINITE_POLICIES:
+        raise ValueError(f"未知的非有限值策略: {nonfinite}")
+
+    if nonfinite != 'null' or precision is not None:
+        data = _prepare(data, nonfinite, precision)
+    return orjson.dumps(data, default=_default, option=JSON_OPTIONS)
+
+
+def json_response(data, status=200, **options):
+    """用 dumps_json 编码的 application/json 响应，代替 flask.jsonify"""
+    return Response(dumps_json(data, **options), status=status, mimetype='application/json')
+
+
+def loads_json(body):
+    """
+    解析JSON请求体
+
+    使用orjson在C中完成解析，数组字段随后由 arrayTransport 中的统一解码层一次性转换为
+    连续的numpy数组，中间的Python列表在转换后立即释放。
+    """
+    return orjson.loads(body)
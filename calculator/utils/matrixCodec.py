@@ -0,0 +1,267 @@
+"""
+响应中数组的压缩表示：对称矩阵打包、重复数组去重、精度与量化
+
+协方差矩阵、散度矩阵、相似度矩阵都是对称的，只需要传输上三角（含对角线）：
+
+    {"symmetric": true, "format": "packed_upper", "shape": [n, n], "data": [a00, a01, ..., a0n, a11, ...]}
+
+data 按行依次排列每一行从对角线开始的元素，共 n(n+1)/2 个数。
+
+同一个数组对象在响应中出现多次时（例如特征值分解接口在顶层和 new_node 中都返回特征向量），
+只有第一次出现的位置保留数据，其余位置写为 {"$ref": "路径"}，路径与二进制传输中的数组名相同，
+例如 'eigenvectors'、'new_node.computed.lda_eigenvectors'。
+
+客户端通过 ?compact=1 选择这种表示，服务端的请求解析同样能识别这两种写法。
+
+此外可以通过 ?precision= 为迭代记录（iterations）选择较低的精度。计算结果（computed）中的矩阵
+会被后续步骤当作输入回传（例如 high_similarity_matrix 是梯度下降的输入，协方差矩阵和特征向量是
+特征分解和投影的输入），降低精度会改变之后的计算，因此始终以完整精度传输。量化后的数组写为
+
+    {"quantized": true, "dtype": "uint8", "scale": s, "offset": o, "data": [[q, ...], ...]}
+
+还原值为 offset + scale * q。默认保持float64的完整精度。
+
+稀疏矩阵（例如UMAP的近邻图）以CSR形式传输，服务端解析请求时还原为 scipy.sparse.csr_matrix：
+
+    {"format": "csr", "shape": [n, m], "data": [...], "indices": [...], "indptr": [...]}
+
+迭代轨迹的关键帧+差分编码见 trajectoryCodec，expand_payload 同样会把它还原为迭代记录列表。
+"""
+import numpy as np
+from scipy import sparse
+
+from utils.trajectoryCodec import is_trajectory_encoded, decode_trajectory
+
+PACKED_FORMAT = 'packed_upper'
+CSR_FORMAT = 'csr'
+REF_KEY = '$ref'
+
+# 精度策略：'float32' 单精度，整数 k 表示保留k位小数，'uint8'/'uint16' 为带 scale/offset 的线性量化
+PRECISIONS = ('float32', 'uint8', 'uint16')
+
+# 只对这些字段下的数组降低精度：迭代记录只用于展示，不会作为后续计算的输入
+PRECISION_SCOPES = ('iterations',)
+
+# 概率矩阵的元素大多远小于 10^-k，按小数位数舍入会把它们变成0
+PROBABILITY_FIELDS = ('high_similarity_matrix', 'low_similarity_matrix')
+
+
+def is_symmetric(array):
+    """是否为严格对称的浮点方阵（不对称的条件概率矩阵等会原样传输）"""
+    return (isinstance(array, np.ndarray) and array.dtype.kind == 'f' and array.ndim == 2
+            and array.shape[0] == array.shape[1] and array.shape[0] > 1
+            and np.array_equal(array, array.T))
+
+
+def _upper_mask(n):
+    return np.triu(np.ones((n, n), dtype=bool))
+
+
+def pack_symmetric(array):
+    """对称矩阵 -> packed_upper 字典，data 为一维numpy数组"""
+    n = array.shape[0]
+    return {
+        'symmetric': True,
+        'format': PACKED_FORMAT,
+        'shape': [n, n],
+        'data': array[_upper_mask(n)]
+    }
+
+
+def is_packed(value):
+    return isinstance(value, dict) and value.get('format') == PACKED_FORMAT
+
+
+def unpack_symmetric(packed, dtype=np.float64):
+    """packed_upper 字典 -> 完整的对称矩阵"""
+    n = int(packed['shape'][0])
+    data = np.asarray(packed['data'], dtype=dtype)
+    if data.shape != (n * (n + 1) // 2,):
+        raise ValueError(f"packed_upper 数据长度 {data.size} 与形状 {n}x{n} 不符")
+
+    mask = _upper_mask(n)
+    matrix = np.empty((n, n), dtype=dtype)
+    matrix[mask] = data
+    # 转置视图按行优先遍历上三角，正好依次写入原矩阵的下三角
+    matrix.T[mask] = data
+    return matrix
+
+
+def encode_sparse(matrix):
+    """scipy稀疏矩阵 -> csr 字典，各分量为numpy数组"""
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sort_indices()
+    return {
+        'format': CSR_FORMAT,
+        'shape': list(matrix.shape),
+        'data': matrix.data,
+        'indices': matrix.indices,
+        'indptr': matrix.indptr
+    }
+
+
+def is_sparse_encoded(value):
+    return isinstance(value, dict) and value.get('format') == CSR_FORMAT
+
+
+def decode_sparse(encoded, dtype=np.float64):
+    """csr 字典 -> scipy.sparse.csr_matrix"""
+    shape = tuple(int(size) for size in encoded['shape'])
+    return sparse.csr_matrix((np.asarray(encoded['data'], dtype=dtype),
+                              np.asarray(encoded['indices'], dtype=np.int64),
+                              np.asarray(encoded['indptr'], dtype=np.int64)), shape=shape)
+
+
+def _is_container_list(value):
+    """只遍历元素为字典/列表的列表，纯数值列表（矩阵的行）直接跳过"""
+    return len(value) > 0 and isinstance(value[0], (dict, list, tuple))
+
+
+def compact_payload(data):
+    """
+    对响应做压缩：对称矩阵打包为上三角，重复出现的数组替换为 $ref
+
+    Returns:
+        新的结构，原结构不会被修改
+    """
+    seen = {}
+
+    def walk(value, path):
+        if isinstance(value, np.ndarray):
+            if value.size > 1:
+                if id(value) in seen:
+                    return {REF_KEY: seen[id(value)]}
+                seen[id(value)] = path
+            return pack_symmetric(value) if is_symmetric(value) else value
+        if isinstance(value, dict):
+            return {k: walk(v, f'{path}.{k}' if path else str(k)) for k, v in value.items()}
+        if isinstance(value, (list, tuple)) and _is_container_list(value):
+            return [walk(v, f'{path}.{i}' if path else str(i)) for i, v in enumerate(value)]
+        return value
+
+    return walk(data, '')
+
+
+def quantize(array, dtype):
+    """
+    把浮点数组线性量化为无符号整数：value ≈ offset + scale * q
+
+    NaN/Inf 不参与取值范围的计算，编码时截断到范围两端（NaN记为offset）。
+    """
+    levels = np.iinfo(dtype).max
+    finite = array[np.isfinite(array)]
+    low = float(finite.min()) if finite.size else 0.0
+    high = float(finite.max()) if finite.size else 0.0
+    scale = (high - low) / levels if high > low else 1.0
+
+    q = np.rint((np.nan_to_num(array, nan=low) - low) / scale)
+    return {
+        'quantized': True,
+        'dtype': np.dtype(dtype).name,
+        'scale': scale,
+        'offset': low,
+        'data': np.clip(q, 0, levels).astype(dtype)
+    }
+
+
+def is_quantized(value):
+    return isinstance(value, dict) and value.get('quantized') is True and 'data' in value
+
+
+def dequantize(quantized, dtype=np.float64):
+    data = np.asarray(quantized['data'], dtype=dtype)
+    return quantized['offset'] + quantized['scale'] * data
+
+
+def parse_precision(value):
+    """
+    解析精度参数，返回 None（保持float64完整精度）、'float32'、'uint8'、'uint16' 或小数位数
+
+    Raises:
+        ValueError: 无法识别的取值
+    """
+    if value is None or value == '':
+        return None
+    if value in PRECISIONS:
+        return value
+    if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+        return int(value)
+    raise ValueError(f"未知的精度参数: {value}，可选 {', '.join(PRECISIONS)} 或小数位数")
+
+
+def _reduce_array(array, precision):
+    if precision == 'float32':
+        return array.astype(np.float32)
+    if isinstance(precision, int):
+        return np.round(array, precision)
+    return quantize(array, np.dtype(precision).type)
+
+
+def apply_precision(data, precision, scopes=PRECISION_SCOPES):
+    """
+    对 scopes 中的字段（默认只有 iterations）下的浮点数组降低精度
+
+    数据集和 computed 中的矩阵等其他字段保持原样，客户端回传节点时不会损失输入精度。
+
+    Returns:
+        新的结构，原结构不会被修改
+
+    Raises:
+        ValueError: 要按小数位数舍入的范围内包含概率矩阵
+    """
+    if precision is None:
+        return data
+
+    def walk(value, in_scope, key=None):
+        if isinstance(value, np.ndarray):
+            if in_scope and value.dtype.kind == 'f' and value.size > 0:
+                if isinstance(precision, int) and key in PROBABILITY_FIELDS:
+                    raise ValueError(f"{key} 是概率矩阵，不能按小数位数舍入，请使用 float32、uint8 或 uint16")
+                return _reduce_array(value, precision)
+            return value
+        if isinstance(value, dict):
+            return {k: walk(v, in_scope or k in scopes, k) for k, v in value.items()}
+        if isinstance(value, (list, tuple)) and _is_container_list(value):
+            return [walk(v, in_scope, key) for v in value]
+        return value
+
+    return walk(data, False)
+
+
+def expand_payload(data):
+    """
+    compact_payload 和 apply_precision 的逆过程：解析 $ref，还原量化数组，
+    把 packed_upper 还原为完整矩阵、csr 还原为稀疏矩阵、keyframe_delta 还原为迭代记录，就地修改并返回 data
+    """
+    refs = []
+
+    def walk(value, container, key):
+        if isinstance(value, dict):
+            if set(value) == {REF_KEY}:
+                refs.append((container, key, value[REF_KEY]))
+                return
+            if is_quantized(value):
+                container[key] = dequantize(value)
+                return
+            # 先处理子节点：打包矩阵的 data 本身可能是量化过的
+            for k, v in list(value.items()):
+                walk(v, value, k)
+            if is_packed(value):
+                container[key] = unpack_symmetric(value)
+            elif is_sparse_encoded(value):
+                container[key] = decode_sparse(value)
+            elif is_trajectory_encoded(value):
+                container[key] = decode_trajectory(value)
+        elif isinstance(value, list) and _is_container_list(value):
+            for i, v in enumerate(value):
+                walk(v, value, i)
+
+    root = [data]
+    walk(data, root, 0)
+
+    for container, key, path in refs:
+        target = root[0]
+        for part in path.split('.'):
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        container[key] = target
+    return root[0]
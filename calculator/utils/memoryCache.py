@@ -0,0 +1,58 @@
+"""
+进程内按字节数限额的LRU缓存
+"""
+import threading
+from collections import OrderedDict
+
+
+class SizedLRUCache:
+    """
+    线程安全的LRU缓存，按条目占用的字节数而不是条目个数限额
+
+    超出 max_bytes 时从最久未使用的条目开始淘汰；单个条目比上限还大时不缓存。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+            if nbytes > self.max_bytes:
+                return
+
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+
+            # 淘汰最久未使用的条目
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, nbytes = self._entries.pop(key)
+            self.current_bytes -= nbytes
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
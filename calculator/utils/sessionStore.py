@@ -0,0 +1,196 @@
+"""
+服务端的优化会话
+
+会话保存继续迭代所需的全部状态（P、低维表示、动量项、学习率等），按会话id访问：
+
+- 超过 GRADIENT_SESSION_TTL_SECONDS 未被访问的会话被清除；
+- 所有会话占用的内存超过 GRADIENT_SESSION_MEMORY_MB 时，从最久未访问的会话开始清除；
+- 检查点写入 GRADIENT_SESSION_DIR/<会话id>/，会话被清除或进程重启后可以从检查点恢复，
+  多个gunicorn worker之间也通过检查点共享会话。
+
+会话只存在于创建它的进程内，检查点之外的状态不会跨进程共享。
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+from scipy import sparse
+
+from utils.jsonProcess import dumps_json, loads_json
+
+GRADIENT_SESSION_TTL_SECONDS = float(os.environ.get('GRADIENT_SESSION_TTL_SECONDS', '1800'))
+GRADIENT_SESSION_MEMORY_MB = int(os.environ.get('GRADIENT_SESSION_MEMORY_MB', '2048'))
+GRADIENT_SESSION_DIR = os.environ.get('GRADIENT_SESSION_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'dimreduction_sessions'))
+
+_SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class SessionNotFoundError(KeyError):
+    """会话不存在、已过期且没有检查点"""
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+
+def state_nbytes(value):
+    """状态中numpy数组和稀疏矩阵占用的字节数（递归统计dict/list）"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if sparse.issparse(value):
+        value = value.tocsr()
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, dict):
+        return sum(state_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(state_nbytes(v) for v in value)
+    return 0
+
+
+class Session:
+    """一个优化会话：状态、访问时间和保证同一时间只有一个请求在计算的锁"""
+
+    def __init__(self, session_id, state):
+        self.id = session_id
+        self.state = state
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+        self.nbytes = state_nbytes(state)
+
+
+class SessionStore:
+    """
+    线程安全的会话表，按空闲时间和内存总量清除会话
+    """
+
+    def __init__(self, ttl_seconds=GRADIENT_SESSION_TTL_SECONDS, max_bytes=GRADIENT_SESSION_MEMORY_MB * 2 ** 20):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        expired = [sid for sid, s in self._sessions.items() if now - s.last_access > self.ttl_seconds]
+        for sid in expired:
+            del self._sessions[sid]
+
+    def _evict(self, keep):
+        total = sum(s.nbytes for s in self._sessions.values())
+        # 正在计算的会话不清除
+        for session in sorted(self._sessions.values(), key=lambda s: s.last_access):
+            if total <= self.max_bytes:
+                break
+            if session.id == keep or session.lock.locked():
+                continue
+            del self._sessions[session.id]
+            total -= session.nbytes
+
+    def put(self, session_id, state):
+        session = Session(session_id, state)
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self._sessions[session_id] = session
+            self._evict(keep=session_id)
+        return session
+
+    def get(self, session_id):
+        """
+        Returns:
+            Session 或 None（不存在或已过期）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = now
+            return session
+
+    def touch(self, session):
+        """计算完成后更新访问时间和内存占用"""
+        with self._lock:
+            session.last_access = time.monotonic()
+            session.nbytes = state_nbytes(session.state)
+            self._evict(keep=session.id)
+
+    def pop(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            self._expire(time.monotonic())
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._sessions)
+
+
+def _checkpoint_dir(session_id):
+    return os.path.join(GRADIENT_SESSION_DIR, session_id)
+
+
+def has_checkpoint(session_id):
+    return valid_session_id(session_id) and os.path.exists(os.path.join(_checkpoint_dir(session_id), 'meta.json'))
+
+
+def save_checkpoint(session_id, arrays, meta):
+    """
+    写入检查点：arrays 保存为 arrays.npz，meta（可包含numpy数组，稀疏矩阵需先编码）保存为 meta.json
+
+    先写入临时目录再整体替换，读到的检查点总是完整的
+    """
+    os.makedirs(GRADIENT_SESSION_DIR, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f'.{session_id}-', dir=GRADIENT_SESSION_DIR)
+    try:
+        np.savez(os.path.join(temp_dir, 'arrays.npz'), **arrays)
+        with open(os.path.join(temp_dir, 'meta.json'), 'wb') as f:
+            f.write(dumps_json(meta))
+
+        target = _checkpoint_dir(session_id)
+        if os.path.exists(target):
+            old_dir = tempfile.mkdtemp(prefix=f'.{session_id}-old-', dir=GRADIENT_SESSION_DIR)
+            os.replace(target, os.path.join(old_dir, 'checkpoint'))
+            os.replace(temp_dir, target)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        else:
+            os.replace(temp_dir, target)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+
+def load_checkpoint(session_id):
+    """
+    Returns:
+        tuple: (arrays, meta)
+
+    Raises:
+        SessionNotFoundError: 没有该会话的检查点
+    """
+    if not has_checkpoint(session_id):
+        raise SessionNotFoundError(f"会话不存在或已过期: {session_id}")
+    directory = _checkpoint_dir(session_id)
+    with np.load(os.path.join(directory, 'arrays.npz'), allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    with open(os.path.join(directory, 'meta.json'), 'rb') as f:
+        meta = loads_json(f.read())
+    return arrays, meta
+
+
+def delete_checkpoint(session_id):
+    if valid_session_id(session_id):
+        shutil.rmtree(_checkpoint_dir(session_id), ignore_errors=True)
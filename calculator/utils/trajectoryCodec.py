@@ -0,0 +1,166 @@
+"""
+迭代轨迹的关键帧+差分编码
+
+梯度下降的 iterations 中每条记录都是一份完整的嵌入，1000次迭代、每10次记录一次、2000个点时
+要传输100份 2000×2 的float64。相邻两次记录之间嵌入变化很小，这里把整段轨迹编码为：
+
+    {"format": "keyframe_delta", "shape": [n, d], "tolerance": t, "keyframe_interval": k,
+     "columns": {"iteration": [...], "cost": [...], "gradient_norm": [...]},
+     "keyframe_index": [...], "keyframes": float32 (k, n, d),
+     "scale": float64 (m,), "deltas": int8/int16 (m - k, n, d)}
+
+- 每 keyframe_interval 条记录保存一个float32的关键帧；
+- 其余记录保存与上一条（解码后的）记录之差，按 scale 量化为整数，解码值为 上一帧 + scale * delta；
+- 迭代序号、成本、梯度范数等标量各自成为 columns 中的一列。
+
+量化步长 scale 为 tolerance × 该帧坐标的最大绝对值，差分基于解码后的上一帧计算，误差不会逐帧累积：
+每个坐标的误差不超过 scale / 2（关键帧另有float32的舍入误差）。差分超出int16范围的记录改存为关键帧；
+所有差分都在int8范围内时以int8保存。
+
+客户端通过 ?trajectory=keyframe_delta 选择这种表示，?trajectory_tolerance= 调整 tolerance；
+二进制传输时 keyframes 和 deltas 直接作为 .npy 数组传输。
+"""
+import numpy as np
+
+TRAJECTORY_FORMAT = 'keyframe_delta'
+TRAJECTORIES = (TRAJECTORY_FORMAT,)
+
+DEFAULT_TOLERANCE = 1e-4
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+_INT16_MAX = np.iinfo(np.int16).max
+_INT8_MAX = np.iinfo(np.int8).max
+
+
+def parse_trajectory(value, tolerance=None):
+    """
+    解析 ?trajectory= 和 ?trajectory_tolerance=
+
+    Returns:
+        tuple: (编码名称或 None, tolerance)
+
+    Raises:
+        ValueError: 无法识别的取值
+    """
+    if value is None or value == '':
+        return None, DEFAULT_TOLERANCE
+    if value not in TRAJECTORIES:
+        raise ValueError(f"未知的轨迹编码: {value}，可选 {', '.join(TRAJECTORIES)}")
+    if tolerance is None or tolerance == '':
+        return value, DEFAULT_TOLERANCE
+    try:
+        tolerance = float(tolerance)
+    except ValueError:
+        raise ValueError(f"无效的轨迹误差: {tolerance}")
+    if not 0 < tolerance < 1:
+        raise ValueError(f"轨迹误差需要在 (0, 1) 之间: {tolerance}")
+    return value, tolerance
+
+
+def is_trajectory_records(value):
+    """是否为 [{'embedding': ..., ...}, ...] 形式的迭代记录"""
+    return (isinstance(value, list) and len(value) > 0
+            and all(isinstance(record, dict) and 'embedding' in record for record in value))
+
+
+def is_trajectory_encoded(value):
+    return isinstance(value, dict) and value.get('format') == TRAJECTORY_FORMAT
+
+
+def encode_trajectory(records, tolerance=DEFAULT_TOLERANCE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    """
+    把迭代记录编码为关键帧+量化差分
+
+    Args:
+        records: 迭代记录列表，每条包含相同形状的 'embedding' 和若干标量
+        tolerance: 量化步长相对于该帧坐标最大绝对值的比例
+        keyframe_interval: 每隔多少条记录保存一个关键帧
+    """
+    embeddings = [np.asarray(record['embedding'], dtype=np.float64) for record in records]
+    shape = embeddings[0].shape
+    m = len(records)
+
+    columns = {key: np.asarray([record[key] for record in records])
+               for key in records[0] if key != 'embedding'}
+
+    keyframe_index, keyframes, deltas = [], [], []
+    scale = np.zeros(m)
+    previous = None
+    for t, Y in enumerate(embeddings):
+        if Y.shape != shape:
+            raise ValueError(f"第{t}条记录的嵌入形状 {Y.shape} 与 {shape} 不一致")
+
+        if previous is not None and t % keyframe_interval != 0:
+            step = tolerance * np.abs(Y).max()
+            if step > 0:
+                q = np.rint((Y - previous) / step)
+                if np.abs(q).max() <= _INT16_MAX:
+                    scale[t] = step
+                    deltas.append(q.astype(np.int16))
+                    # 以解码端看到的值作为下一帧的基准，误差不累积
+                    previous = previous + step * q
+                    continue
+
+        keyframe = Y.astype(np.float32)
+        keyframe_index.append(t)
+        keyframes.append(keyframe)
+        previous = keyframe.astype(np.float64)
+
+    if deltas:
+        deltas = np.stack(deltas)
+        if np.abs(deltas).max() <= _INT8_MAX:
+            deltas = deltas.astype(np.int8)
+    else:
+        deltas = np.zeros((0,) + shape, dtype=np.int8)
+
+    return {
+        'format': TRAJECTORY_FORMAT,
+        'shape': list(shape),
+        'tolerance': tolerance,
+        'keyframe_interval': keyframe_interval,
+        'columns': columns,
+        'keyframe_index': np.asarray(keyframe_index, dtype=np.int32),
+        'keyframes': np.stack(keyframes),
+        'scale': scale,
+        'deltas': deltas
+    }
+
+
+def decode_trajectory(encoded):
+    """
+    encode_trajectory 的逆过程，按顺序重放出迭代记录（嵌入为float64）
+    """
+    shape = tuple(encoded['shape'])
+    columns = {key: np.asarray(values).tolist() for key, values in encoded['columns'].items()}
+    scale = np.asarray(encoded['scale'], dtype=np.float64)
+    keyframes = np.asarray(encoded['keyframes'], dtype=np.float64).reshape((-1,) + shape)
+    deltas = np.asarray(encoded['deltas'], dtype=np.float64).reshape((-1,) + shape)
+    keyframe_at = {int(t): i for i, t in enumerate(np.asarray(encoded['keyframe_index']).ravel())}
+
+    records = []
+    previous = None
+    next_delta = 0
+    for t in range(len(scale)):
+        if t in keyframe_at:
+            Y = keyframes[keyframe_at[t]].copy()
+        else:
+            Y = previous + scale[t] * deltas[next_delta]
+            next_delta += 1
+        record = {key: values[t] for key, values in columns.items()}
+        record['embedding'] = Y
+        records.append(record)
+        previous = Y
+    return records
+
+
+def encode_trajectories(payload, tolerance=DEFAULT_TOLERANCE):
+    """
+    把响应顶层的 iterations 替换为编码后的轨迹，批量结果中 runs 的每一项分别编码，返回新的结构
+    """
+    if not isinstance(payload, dict):
+        return payload
+    if isinstance(payload.get('runs'), list):
+        payload = {**payload, 'runs': [encode_trajectories(run, tolerance) for run in payload['runs']]}
+    if not is_trajectory_records(payload.get('iterations')):
+        return payload
+    return {**payload, 'iterations': encode_trajectory(payload['iterations'], tolerance)}
@@ -0,0 +1,312 @@
+"""
+t-SNE梯度的近似计算
+
+精确梯度需要 n×n 的距离矩阵和Q矩阵，点数上万时时间和内存都不可接受。这里的近似方法
+只在稀疏的P上计算吸引力，排斥力用空间划分树近似：
+
+- barnes_hut：四叉树（二维嵌入）或八叉树（三维嵌入），距离足够远的一团点视为一个质心，
+  theta 越大越快、误差越大。树的构建和遍历使用scikit-learn中用Cython实现的 _barnes_hut_tsne。
+- fft：FIt-SNE的插值方法（仅二维）。把嵌入区域划分为网格，每个格子内用拉格朗日多项式插值，
+  先把各点的"电荷"分配到等距的插值节点上，节点之间的核函数求和是一个卷积，用FFT完成，
+  再插值回各点。每次迭代的代价约为 O(n + N log N)，N为网格节点数，与点之间的距离分布无关。
+
+梯度的定义、每行梯度范数截断到10 的处理都与精确模式的 compute_gradient_tsne 保持一致。
+"""
+import numpy as np
+from scipy import fft, sparse
+from sklearn.manifold import _barnes_hut_tsne
+from sklearn.utils._openmp_helpers import _openmp_effective_n_threads
+
+APPROXIMATIONS = ('exact', 'barnes_hut', 'fft')
+
+# 与精确模式一致的单行梯度范数上限
+MAX_ROW_NORM = 10.0
+
+# FFT插值中每个 N² 占用的字节数（N为每个维度上的网格节点数）：三个电荷网格的半频谱、
+# 一个核函数及其半频谱、一次逆变换的结果，以及截取出的四个势，都定义在 2N×2N 的网格上
+FFT_GRID_BYTES = 256
+
+
+def to_sparse_p(P, perplexity=30):
+    """
+    把高维相似度转换为近似方法使用的稀疏P
+
+    稠密矩阵每行只保留最大的 3*perplexity 个元素（与t-SNE的近邻数一致），稀疏矩阵保持原有结构；
+    之后对称化为 P + P^T 并归一化为和为1。
+
+    Returns:
+        csr_matrix: data为float32、索引为int64，可以直接交给Cython实现，不必每次迭代再转换
+    """
+    if sparse.issparse(P):
+        P = sparse.csr_matrix(P, dtype=np.float64)
+        P.setdiag(0.0)
+    else:
+        P = np.asarray(P, dtype=np.float64)
+        n = P.shape[0]
+        k = min(n - 1, int(3 * perplexity + 1))
+        # 多取一个，去掉对角线后每行仍有k个
+        candidates = np.argpartition(-P, k, axis=1)[:, :k + 1]
+        rows = np.repeat(np.arange(n), k + 1)
+        cols = candidates.ravel()
+        off_diagonal = rows != cols
+        rows, cols = rows[off_diagonal], cols[off_diagonal]
+        P = sparse.csr_matrix((P[rows, cols], (rows, cols)), shape=(n, n))
+
+    P.eliminate_zeros()
+    P = P + P.T
+    P /= P.sum()
+    P.sort_indices()
+
+    P.data = P.data.astype(np.float32)
+    P.indices = P.indices.astype(np.int64)
+    P.indptr = P.indptr.astype(np.int64)
+    return P
+
+
+def clip_rows(grad, max_norm=MAX_ROW_NORM):
+    """每行梯度的范数超过 max_norm 时按比例缩小，避免梯度爆炸"""
+    norms = np.sqrt(np.einsum('ij,ij->i', grad, grad))
+    too_large = norms > max_norm
+    grad[too_large] *= (max_norm / norms[too_large])[:, None]
+    return grad
+
+
+def barnes_hut_gradient(P, Y, theta=0.5, compute_error=False, num_threads=None, exaggeration=1.0):
+    """
+    Barnes-Hut近似的t-SNE梯度
+
+    Args:
+        P: to_sparse_p 返回的稀疏P
+        Y: 当前低维嵌入，形状为 (n_samples, 2) 或 (n_samples, 3)
+        theta: 角度阈值，0时退化为精确计算
+        compute_error: 是否同时计算KL散度
+        num_threads: OpenMP线程数，默认使用所有可用的核
+        exaggeration: 早期夸大系数，梯度中以 exaggeration × P 代替 P
+
+    Returns:
+        tuple: (梯度, KL散度)，梯度与Y的dtype相同；不计算KL散度时后者为 None
+    """
+    n_components = Y.shape[1]
+    if n_components not in (2, 3):
+        raise ValueError("Barnes-Hut近似只支持二维或三维嵌入")
+
+    positions = np.ascontiguousarray(Y, dtype=np.float32)
+    forces = np.zeros(positions.shape, dtype=np.float32)
+    p = P.data if exaggeration == 1.0 else P.data * np.float32(exaggeration)
+    error = _barnes_hut_tsne.gradient(
+        p, positions, P.indices, P.indptr, forces, theta, n_components, 0,
+        dof=1.0, compute_error=compute_error,
+        num_threads=num_threads or _openmp_effective_n_threads()
+    )
+
+    # _barnes_hut_tsne 返回的是 (p_ij - q_ij) (1 + d_ij²)^-1 (y_i - y_j) 之和，t-SNE梯度的系数为4
+    grad = forces.astype(Y.dtype)
+    grad *= 4.0
+    if compute_error and exaggeration != 1.0:
+        # 按 αP 计算的是 Σ αp log(αp / q) = α (KL + log α)（Σ p = 1），换算回原始P的KL散度
+        error = error / exaggeration - np.log(exaggeration)
+    return clip_rows(grad), (float(error) if compute_error else None)
+
+
+def lagrange_weights(t, n_nodes):
+    """
+    格子内相对位置 t∈[0,1) 处各插值节点的拉格朗日基函数值，节点位于 (k + 0.5) / n_nodes
+
+    Returns:
+        ndarray: 形状为 (len(t), n_nodes)
+    """
+    nodes = (np.arange(n_nodes) + 0.5) / n_nodes
+    weights = np.ones((t.shape[0], n_nodes))
+    for k in range(n_nodes):
+        for m in range(n_nodes):
+            if m != k:
+                weights[:, k] *= (t - nodes[m]) / (nodes[k] - nodes[m])
+    return weights
+
+
+def plan_max_boxes(memory_budget_mb, n_interpolation_points=3, min_boxes=50):
+    """
+    根据内存预算决定FFT插值每个维度上格子数的上限
+
+    网格有 N = 格子数 × 插值节点数 个节点时，卷积在 2N×2N 的网格上进行，内存按 N² 增长，
+    每个 N² 约占 FFT_GRID_BYTES 字节。上限不低于 min_boxes。
+
+    Returns:
+        int: 每个维度上格子数的上限
+    """
+    n_nodes = int(np.sqrt(memory_budget_mb * 2 ** 20 / FFT_GRID_BYTES))
+    return max(min_boxes, n_nodes // n_interpolation_points)
+
+
+def interpolate_repulsion(Y, n_interpolation_points=3, min_boxes=50, intervals_per_integer=1.0, max_boxes=256):
+    """
+    用插值 + FFT卷积计算二维嵌入的排斥项
+
+        rep_i = Σ_j (1 + |y_i - y_j|²)^-2 (y_i - y_j)
+        Z     = Σ_{i≠j} (1 + |y_i - y_j|²)^-1
+
+    Args:
+        Y: 形状为 (n_samples, 2) 的嵌入
+        n_interpolation_points: 每个格子每个维度上的插值节点数
+        min_boxes: 每个维度上格子数的下限
+        intervals_per_integer: 嵌入中单位长度对应的格子数，格子宽度不超过核函数的变化尺度
+        max_boxes: 每个维度上格子数的上限，内存和耗时按其平方增长，可由 plan_max_boxes 按内存预算给出
+
+    Returns:
+        tuple: (rep, Z)
+    """
+    n = Y.shape[0]
+    p = n_interpolation_points
+
+    low = Y.min(axis=0)
+    span = float((Y.max(axis=0) - low).max())
+    n_boxes = int(min(max_boxes, max(min_boxes, np.ceil(span * intervals_per_integer))))
+    # 略微放大，保证最大的点也落在最后一个格子内
+    box_width = max(span, 1e-12) * (1 + 1e-9) / n_boxes
+    n_nodes = n_boxes * p
+    spacing = box_width / p
+
+    # 每个点所在格子、格子内的插值权重以及对应的网格节点
+    scaled = (Y - low) / box_width
+    boxes = np.minimum(scaled.astype(np.int64), n_boxes - 1)
+    wx = lagrange_weights(scaled[:, 0] - boxes[:, 0], p)
+    wy = lagrange_weights(scaled[:, 1] - boxes[:, 1], p)
+    node_x = boxes[:, 0:1] * p + np.arange(p)
+    node_y = boxes[:, 1:2] * p + np.arange(p)
+    nodes = (node_x[:, :, None] * n_nodes + node_y[:, None, :]).reshape(n, p * p)
+    weights = (wx[:, :, None] * wy[:, None, :]).reshape(n, p * p)
+
+    # 核 K1 = (1+d²)^-1 作用于电荷 1；核 K2 = (1+d²)^-2 作用于电荷 1、y_x、y_y
+    charges = np.column_stack([np.ones(n), Y[:, 0], Y[:, 1]])
+    flat_nodes = nodes.ravel()
+    grid = np.empty((3, n_nodes, n_nodes))
+    for c in range(3):
+        grid[c] = np.bincount(flat_nodes, weights=(weights * charges[:, c:c + 1]).ravel(),
+                              minlength=n_nodes * n_nodes).reshape(n_nodes, n_nodes)
+
+    # 核函数在节点偏移量上的取值，按循环卷积的方式嵌入到 2N×2N 网格中
+    offsets = np.arange(2 * n_nodes)
+    offsets = np.where(offsets < n_nodes, offsets, offsets - 2 * n_nodes) * spacing
+    offsets[n_nodes] = np.inf
+
+    # 逐个核函数卷积：乘积直接写入之后不再需要的频谱，同一时刻只有一个核函数的频谱
+    shape = (2 * n_nodes, 2 * n_nodes)
+    grid_spectrum = fft.rfft2(grid, s=shape, workers=-1)
+    del grid
+    potentials = np.empty((4, n_nodes, n_nodes))
+    kernel = 1.0 / (1.0 + offsets[:, None] ** 2 + offsets[None, :] ** 2)
+    kernel_spectrum = fft.rfft2(kernel, workers=-1)
+    kernel_spectrum *= grid_spectrum[0]
+    potentials[0] = fft.irfft2(kernel_spectrum, s=shape, workers=-1, overwrite_x=True)[:n_nodes, :n_nodes]
+    del kernel_spectrum
+
+    np.square(kernel, out=kernel)
+    kernel_spectrum = fft.rfft2(kernel, workers=-1)
+    del kernel
+    for c in range(3):
+        grid_spectrum[c] *= kernel_spectrum
+        potentials[c + 1] = fft.irfft2(grid_spectrum[c], s=shape, workers=-1, overwrite_x=True)[:n_nodes, :n_nodes]
+
+    # 插值回各点
+    potentials = potentials.reshape(4, -1)
+    phi = np.einsum('nk,cnk->nc', weights, potentials[:, nodes])
+
+    # K1 求和包含 j = i 的一项（核值为1）
+    z = phi[:, 0].sum() - n
+    rep = Y * phi[:, 1:2] - phi[:, 2:4]
+    return rep, z
+
+
+def sparse_attraction(P, Y):
+    """
+    稀疏P上的吸引项 Σ_j p_ij (1 + |y_i - y_j|²)^-1 (y_i - y_j)
+
+    Returns:
+        tuple: (吸引项, 每条边的 (1 + d²)^-1)
+    """
+    n = Y.shape[0]
+    rows = np.repeat(np.arange(n), np.diff(P.indptr))
+    diff = Y[rows] - Y[P.indices]
+    num = 1.0 / (1.0 + np.einsum('ij,ij->i', diff, diff))
+    coeff = P.data * num
+    attraction = np.column_stack([
+        np.bincount(rows, weights=coeff * diff[:, d], minlength=n) for d in range(Y.shape[1])
+    ])
+    return attraction, num
+
+
+def fft_gradient(P, Y, compute_error=False, n_interpolation_points=3, min_boxes=50, intervals_per_integer=1.0,
+                 exaggeration=1.0, max_boxes=256):
+    """
+    FFT插值近似的t-SNE梯度
+
+    Args:
+        P: to_sparse_p 返回的稀疏P
+        Y: 当前低维嵌入，形状为 (n_samples, 2)
+        compute_error: 是否同时计算KL散度
+        exaggeration: 早期夸大系数，吸引项乘以该系数
+        其余参数见 interpolate_repulsion
+
+    Returns:
+        tuple: (梯度, KL散度)，梯度与Y的dtype相同（插值和卷积总是以float64计算）；不计算KL散度时后者为 None
+    """
+    if Y.shape[1] != 2:
+        raise ValueError("FFT插值近似只支持二维嵌入")
+
+    dtype = Y.dtype
+    Y = np.asarray(Y, dtype=np.float64)
+    attraction, num = sparse_attraction(P, Y)
+    rep, z = interpolate_repulsion(Y, n_interpolation_points, min_boxes, intervals_per_integer, max_boxes)
+    z = max(z, 1e-12)
+
+    if exaggeration != 1.0:
+        attraction *= exaggeration
+    grad = 4.0 * (attraction - rep / z)
+
+    error = None
+    if compute_error:
+        # KL(P||Q) = Σ p log p - Σ p log(num) + log Z，其中 Σ p = 1
+        p = P.data.astype(np.float64)
+        p_safe = np.maximum(p, 1e-12)
+        error = float(np.sum(p * np.log(p_safe)) - np.sum(p * np.log(num)) + np.log(z) * p.sum())
+
+    return clip_rows(grad.astype(dtype, copy=False)), error
+
+
+def sparse_low_similarity(P, Y, z=None, block_rows=1024):
+    """
+    只在P的非零位置上给出低维相似度 q_ij，不构造 n×n 矩阵
+
+    Args:
+        z: 归一化常数 Z；未提供时按行分块精确计算（O(n²)时间，O(n)内存）
+
+    Returns:
+        csr_matrix: 与P结构相同的Q
+    """
+    Y = np.asarray(Y, dtype=np.float64)
+    n = Y.shape[0]
+
+    if z is None:
+        z = exact_normalization(Y, block_rows)
+
+    P = P.tocoo()
+    diff = Y[P.row] - Y[P.col]
+    q = 1.0 / (1.0 + np.einsum('ij,ij->i', diff, diff)) / max(z, 1e-12)
+    return sparse.csr_matrix((np.maximum(q, 1e-12), (P.row, P.col)), shape=(n, n))
+
+
+def exact_normalization(Y, block_rows=1024):
+    """按行分块精确计算 Z = Σ_{i≠j} (1 + |y_i - y_j|²)^-1"""
+    n = Y.shape[0]
+    sq_norms = np.einsum('ij,ij->i', Y, Y)
+
+    z = 0.0
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        block = sq_norms[start:stop, None] + sq_norms[None, :] - 2.0 * (Y[start:stop] @ Y.T)
+        np.maximum(block, 0.0, out=block)
+        block += 1.0
+        np.reciprocal(block, out=block)
+        # 去掉 q_ii
+        z += block.sum() - (stop - start)
+    return z
@@ -1,4 +1,5 @@
 import axios from "axios";
+import { expandPayload } from "./matrixCodec";
 
 const apiBaseUrl = import.meta.env.VITE_API_BASE_URL;
 
@@ -11,6 +12,8 @@ const instance = axios.create({
 instance.interceptors.request.use(
     (config) => {
         // 可以在这里添加请求头信息
+        // 对称矩阵按上三角打包、重复数组去重，响应拦截器中还原
+        config.params = { compact: 1, ...config.params };
         return config;
     },
     (error) => {
@@ -21,7 +24,7 @@ instance.interceptors.request.use(
 // 拦截响应（可选）
 instance.interceptors.response.use(
     (response) => {
-        return response.data;
+        return expandPayload(response.data);
     },
     (error) => {
         return Promise.reject(error);
@@ -0,0 +1,52 @@
+// 读取计算服务的 Server-Sent Events 响应
+//
+// EventSource 只支持 GET，梯度下降这类接口需要 POST 节点数据，所以用 fetch 读取响应流并按
+// 'event: <名称>\ndata: <JSON>\n\n' 切分事件。数据与 calculatorAxios 一样带 ?compact=1，
+// 每个事件的数据经 expandPayload 还原后交给 onEvent。通过 signal 中止请求时服务端随即停止计算。
+
+import { expandPayload } from "./matrixCodec";
+
+const apiBaseUrl = import.meta.env.VITE_API_BASE_URL;
+
+function parseEvent(block) {
+    let event = 'message';
+    const data = [];
+    block.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            data.push(line.slice(5).trimStart());
+        }
+    });
+    return data.length ? [event, expandPayload(JSON.parse(data.join('\n')))] : null;
+}
+
+export async function postEventStream(path, body, onEvent, { signal, params = {} } = {}) {
+    const query = new URLSearchParams({ compact: 1, ...params });
+    const response = await fetch(`${apiBaseUrl}:5000${path}?${query}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+        body: JSON.stringify(body),
+        signal
+    });
+    if (!response.ok) {
+        const detail = await response.json().catch(() => ({}));
+        throw new Error(detail.message || detail.error || `请求失败: ${response.status}`);
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+
+        let end = buffer.indexOf('\n\n');
+        while (end >= 0) {
+            const parsed = parseEvent(buffer.slice(0, end));
+            buffer = buffer.slice(end + 2);
+            if (parsed) onEvent(...parsed);
+            end = buffer.indexOf('\n\n');
+        }
+    }
+}
@@ -0,0 +1,131 @@
+// 计算服务 ?compact=1 / ?precision= 响应的解码
+//
+// 对称矩阵以上三角打包传输：
+//   { symmetric: true, format: 'packed_upper', shape: [n, n], data: [a00, a01, ..., a0n, a11, ...] }
+// 重复出现的数组以 { $ref: 'eigenvectors' } 引用第一次出现的位置（以点分隔的路径）
+// ?precision=uint8|uint16 时数组被量化：
+//   { quantized: true, dtype: 'uint8', scale, offset, data: [[q, ...], ...] }，还原值为 offset + scale * q
+// 稀疏矩阵（UMAP近邻图、kNN稀疏P）以 { format: 'csr', shape, data, indices, indptr } 传输，保持稀疏形式，
+// 展示时用 csrToDense 只展开需要显示的左上角部分
+// ?trajectory=keyframe_delta 时迭代记录编码为关键帧+量化差分（见计算服务的 trajectoryCodec），
+// expandPayload 把它重放为 [{ iteration, cost, gradient_norm, embedding }, ...]
+
+const PACKED_FORMAT = 'packed_upper';
+const TRAJECTORY_FORMAT = 'keyframe_delta';
+const REF_KEY = '$ref';
+
+export function unpackSymmetric(packed) {
+    const n = packed.shape[0];
+    const { data } = packed;
+    if (data.length !== n * (n + 1) / 2) {
+        throw new Error(`packed_upper 数据长度 ${data.length} 与形状 ${n}x${n} 不符`);
+    }
+
+    const matrix = Array.from({ length: n }, () => new Array(n));
+    let k = 0;
+    for (let i = 0; i < n; i++) {
+        for (let j = i; j < n; j++) {
+            matrix[i][j] = data[k];
+            matrix[j][i] = data[k];
+            k++;
+        }
+    }
+    return matrix;
+}
+
+export function dequantize(quantized) {
+    const { scale, offset } = quantized;
+    const restore = (value) => (Array.isArray(value) ? value.map(restore) : offset + scale * value);
+    return restore(quantized.data);
+}
+
+export function isCsr(value) {
+    return Boolean(value) && value.format === 'csr';
+}
+
+// limit 指定时只展开左上角 limit×limit 的部分，大矩阵不会在浏览器中生成完整的稠密矩阵
+export function csrToDense(csr, limit = Infinity) {
+    const rows = Math.min(csr.shape[0], limit);
+    const cols = Math.min(csr.shape[1], limit);
+    const matrix = Array.from({ length: rows }, () => new Array(cols).fill(0));
+    for (let i = 0; i < rows; i++) {
+        for (let k = csr.indptr[i]; k < csr.indptr[i + 1]; k++) {
+            const j = csr.indices[k];
+            if (j < cols) {
+                matrix[i][j] = csr.data[k];
+            }
+        }
+    }
+    return matrix;
+}
+
+// 解码端以上一条记录的重放结果为基准：embedding = 上一帧 + scale * delta
+export function decodeTrajectory(encoded) {
+    const [n, d] = encoded.shape;
+    const keyframeAt = new Map(encoded.keyframe_index.map((t, i) => [t, i]));
+    const columns = Object.keys(encoded.columns);
+
+    const records = [];
+    let previous = null;
+    let nextDelta = 0;
+    for (let t = 0; t < encoded.scale.length; t++) {
+        let embedding;
+        if (keyframeAt.has(t)) {
+            embedding = encoded.keyframes[keyframeAt.get(t)].map((point) => point.slice());
+        } else {
+            const scale = encoded.scale[t];
+            const delta = encoded.deltas[nextDelta++];
+            embedding = Array.from({ length: n }, (_, i) => (
+                Array.from({ length: d }, (__, k) => previous[i][k] + scale * delta[i][k])
+            ));
+        }
+        const record = {};
+        columns.forEach((key) => { record[key] = encoded.columns[key][t]; });
+        record.embedding = embedding;
+        records.push(record);
+        previous = embedding;
+    }
+    return records;
+}
+
+function isContainerList(value) {
+    return value.length > 0 && typeof value[0] === 'object' && value[0] !== null;
+}
+
+// 解析 $ref、还原量化数组、完整矩阵和迭代轨迹，就地修改并返回 data
+export function expandPayload(data) {
+    const refs = [];
+    const root = [data];
+
+    const walk = (value, container, key) => {
+        if (Array.isArray(value)) {
+            if (isContainerList(value)) {
+                value.forEach((item, i) => walk(item, value, i));
+            }
+        } else if (value !== null && typeof value === 'object') {
+            const keys = Object.keys(value);
+            if (keys.length === 1 && keys[0] === REF_KEY) {
+                refs.push([container, key, value[REF_KEY]]);
+                return;
+            }
+            if (value.quantized === true) {
+                container[key] = dequantize(value);
+                return;
+            }
+            // 先处理子节点：打包矩阵的 data 本身可能是量化过的
+            keys.forEach((k) => walk(value[k], value, k));
+            if (value.format === PACKED_FORMAT) {
+                container[key] = unpackSymmetric(value);
+            } else if (value.format === TRAJECTORY_FORMAT) {
+                container[key] = decodeTrajectory(value);
+            }
+        }
+    };
+
+    walk(data, root, 0);
+
+    refs.forEach(([container, key, path]) => {
+        container[key] = path.split('.').reduce((target, part) => target[part], root[0]);
+    });
+    return root[0];
+}